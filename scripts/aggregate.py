@@ -0,0 +1,193 @@
+'''
+Online aggregation of simulation results: running statistics per (plan_id, flood_depth) cell
+that are updated one batch of runs at a time, so per-run rows never have to be kept.
+'''
+
+import numpy as np
+import pandas as pd
+
+# Quantiles reported for each cell
+QUANTILES = (0.05, 0.5, 0.95)
+
+
+class QuantileSketch:
+    '''
+    Mergeable quantile sketch with relative accuracy alpha (DDSketch style log buckets) for a
+    fixed shape of cells. Values at or below min_value go into a zero bucket; values above
+    max_value are clipped into the last bucket.
+    '''
+
+    def __init__(self, shape, alpha=0.01, min_value=1e-2, max_value=1e9):
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = np.log(self.gamma)
+        self.min_value = min_value
+        self.offset = int(np.ceil(np.log(min_value) / self.log_gamma))
+        n_buckets = int(np.ceil(np.log(max_value) / self.log_gamma)) - self.offset + 2
+        self.counts = np.zeros(tuple(shape) + (n_buckets,), dtype=np.int64)
+
+    def bucket(self, values):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            k = np.ceil(np.log(values) / self.log_gamma) - self.offset + 1
+        k = np.where(values > self.min_value, k, 0)
+        return(np.clip(k, 0, self.counts.shape[-1] - 1).astype(np.int64))
+
+    def update(self, values, index=None):
+        '''
+        Adds values shaped runs x cells, or runs x len(index) for the flattened cells in index.
+        '''
+        values = np.asarray(values, dtype=float)
+        n_cells = int(np.prod(self.counts.shape[:-1]))
+        cells = np.arange(n_cells) if index is None else np.asarray(index)
+        flat = self.bucket(values.reshape(values.shape[0], cells.shape[0]))
+        flat = flat + cells[None, :] * self.counts.shape[-1]
+        self.counts += np.bincount(flat.ravel(), minlength=self.counts.size).reshape(self.counts.shape)
+
+    def merge(self, other):
+        self.counts += other.counts
+
+    def quantile(self, q):
+        cum = np.cumsum(self.counts, axis=-1)
+        n = cum[..., -1:]
+        rank = q * (n - 1)
+        k = (cum <= rank).sum(axis=-1)
+        k = np.minimum(k, self.counts.shape[-1] - 1)
+        value = 2 * np.power(self.gamma, k + self.offset - 1) / (self.gamma + 1)
+        return(np.where((k == 0) | (n[..., 0] == 0), 0.0, value))
+
+
+def merge_moments(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    '''
+    Combines count, mean and sum of squared deviations of two sets of values (Chan et al.).
+    '''
+    n = n_a + n_b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = mean_b - mean_a
+        mean = np.where(n > 0, mean_a + delta * n_b / n, 0.0)
+        m2 = m2_a + m2_b + np.where(n > 0, np.square(delta) * n_a * n_b / n, 0.0)
+    return(n, mean, m2)
+
+
+class RunningStats:
+    '''
+    Running count, mean, variance (Chan et al. parallel update), min, max and quantile sketch
+    of a statistic for a fixed shape of cells, e.g. (plans, depths).
+    '''
+
+    def __init__(self, shape, alpha=0.01):
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+        self.sketch = QuantileSketch(shape, alpha)
+
+    def update(self, values, index=None):
+        '''
+        Adds a batch of values shaped runs x cells. If index is given, values are shaped
+        runs x len(index) and only those (flattened) cells are updated.
+        '''
+        values = np.asarray(values, dtype=float)
+        if index is None:
+            batch_mean = values.mean(axis=0)
+            self.merge_moments(values.shape[0], batch_mean, np.square(values - batch_mean).sum(axis=0))
+            self.min = np.minimum(self.min, values.min(axis=0))
+            self.max = np.maximum(self.max, values.max(axis=0))
+        else:
+            count, mean, m2 = self.count.reshape(-1), self.mean.reshape(-1), self.m2.reshape(-1)
+            batch_mean = values.mean(axis=0)
+            count[index], mean[index], m2[index] = merge_moments(
+                count[index], mean[index], m2[index],
+                values.shape[0], batch_mean, np.square(values - batch_mean).sum(axis=0)
+            )
+            self.min.reshape(-1)[index] = np.minimum(self.min.reshape(-1)[index], values.min(axis=0))
+            self.max.reshape(-1)[index] = np.maximum(self.max.reshape(-1)[index], values.max(axis=0))
+        self.sketch.update(values, index)
+
+    def merge_moments(self, n_b, mean_b, m2_b):
+        self.count, self.mean, self.m2 = merge_moments(self.count, self.mean, self.m2, n_b, mean_b, m2_b)
+
+    def merge(self, other):
+        self.merge_moments(other.count, other.mean, other.m2)
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.sketch.merge(other.sketch)
+
+    def var(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return(np.where(self.count > 1, self.m2 / (self.count - 1), 0.0))
+
+    def converged(self, tol, z=1.96):
+        '''
+        True for cells where the width of the z confidence interval of the mean, relative to the
+        mean, is at most tol. Cells whose runs are all identical (e.g. always 0) count as converged.
+        '''
+        width = 2 * z * np.sqrt(self.var() / np.maximum(self.count, 1))
+        return((width <= tol * np.abs(self.mean)) | (width == 0))
+
+    def summary(self, prefix, quantiles=QUANTILES):
+        '''
+        Returns a dict of flattened summary columns named <prefix>_mean, <prefix>_var, ...
+        '''
+        columns = {
+            f'{prefix}_mean': self.mean.ravel(),
+            f'{prefix}_var': self.var().ravel(),
+            f'{prefix}_min': self.min.ravel(),
+            f'{prefix}_max': self.max.ravel()
+        }
+        for q in quantiles:
+            columns[f'{prefix}_p{round(q * 100):g}'] = self.sketch.quantile(q).ravel()
+        return(columns)
+
+
+def segment_sum(plan_idx, run, depth_idx, shape, *values):
+    '''
+    Sums each values array over the rows that share a (plan, run, depth index) cell. The cell is encoded
+    as one dense integer key and reduced with np.bincount, giving arrays shaped plans x runs x depths
+    (shape). NaN values are skipped, as in a groupby sum.
+    '''
+    key = np.ravel_multi_index((plan_idx, run, depth_idx), shape)
+    size = int(np.prod(shape))
+    return(tuple(
+        np.bincount(key, weights=np.where(np.isnan(v), 0.0, v), minlength=size).reshape(shape) for v in values
+    ))
+
+
+def summary_frame(plan_info, depths, damage, co2):
+    '''
+    Builds the summary table (one row per plan and flood depth) from RunningStats of
+    sum_damage and sum_co2 shaped plans x depths.
+    '''
+    n_plans, n_depths = damage.count.shape
+    result = plan_info.iloc[np.repeat(np.arange(n_plans), n_depths)].reset_index(drop=True)
+    result['flood_depth'] = np.tile(depths, n_plans)
+    result['n_runs'] = damage.count.ravel()
+    for stats, prefix in [(damage, 'sum_damage'), (co2, 'sum_co2')]:
+        for col, values in stats.summary(prefix).items():
+            result[col] = values
+    return(result)
+
+
+def summarize_sums(plan_info, depths, sum_damage, sum_co2):
+    '''
+    Summary table straight from plans x runs x depths sum_damage and sum_co2 arrays (e.g. engine.simulate_plan),
+    without building the per-run rows. plan_info has one row of plan attributes per plan.
+    '''
+    damage = RunningStats((sum_damage.shape[0], depths.shape[0]))
+    co2 = RunningStats((sum_co2.shape[0], depths.shape[0]))
+    damage.update(sum_damage.transpose(1, 0, 2))
+    co2.update(sum_co2.transpose(1, 0, 2))
+    return(summary_frame(plan_info, depths, damage, co2))
+
+
+def summarize_runs(result, depths):
+    '''
+    Aggregates the per-run output of floorplan_mcs_specific for a single plan (one row per run and
+    depth, sorted by run then depth) into the summary table.
+    '''
+    n_depths = depths.shape[0]
+    plan_info = result.iloc[[0]].drop(columns=['run', 'flood_depth', 'sum_damage', 'sum_co2'])
+    return(summarize_sums(
+        plan_info, depths,
+        result['sum_damage'].to_numpy().reshape(1, -1, n_depths),
+        result['sum_co2'].to_numpy().reshape(1, -1, n_depths)
+    ))
@@ -0,0 +1,347 @@
+'''
+Micro-benchmarks for the hot spots of the simulation.
+'''
+
+import os
+import sys
+import json
+import time
+import timeit
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from scipy.stats import triang
+import calculations
+import curves
+import parse
+import engine
+import storage
+import main
+
+# Stage timings of run_suite() are saved here with --save and compared against with --compare
+BASELINE_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+# A stage is flagged as a regression when it is this much slower (or uses this much more memory) than the baseline
+REGRESSION_TOL = 0.25
+# ... and at least this many seconds slower, so timer noise on tiny cases is not flagged
+REGRESSION_MIN_SECONDS = 0.05
+
+# Typical unit cost and CO2e per functional unit (median, log-sd across components) of the material options
+SYNTHETIC_UNIT_COST = {'ea': (900, 1.0), 'sqft': (1.8, 0.6), 'ft': (8, 0.9)}
+SYNTHETIC_UNIT_CO2 = {'ea': (150, 1.0), 'sqft': (0.5, 0.5), 'ft': (1.5, 0.9)}
+
+
+def scipy_triang_cdf(x, min, max, mode):
+    # the previous scipy implementation of the fragility CDF
+    l = min
+    s = max - min
+    c = (mode - min) / s
+    return(triang.cdf(x, c, l, s))
+
+
+def scipy_fail_count(n, min, max, mode, depth, rng):
+    # the previous fail_count: one CDF and binomial draw thrown away in the try block, then both again
+    l = min
+    s = max - min
+    c = (mode - min) / s
+    try:
+        x = rng.binomial(n, triang.cdf(depth, c, l, s))
+    except:
+        x = triang.cdf(depth, c, l, s)
+    return(rng.binomial(n, triang.cdf(depth, c, l, s)))
+
+
+def fragility_rows(size, rng):
+    '''
+    Random fragility parameters shaped like the parsed components, including the
+    degenerate mode == min, mode == max and max - min = 0.01 cases.
+    '''
+    min = rng.uniform(-1, 10, size)
+    max = min + rng.choice([0.01, 1, 4], size)
+    mode = min + (max - min) * rng.choice([0, 0.5, 1], size)
+    depth = rng.uniform(-1, 16, size)
+    n = rng.integers(0, 2000, size)
+    return(n, min, max, mode, depth)
+
+
+def bench_triang_cdf(size=1_000_000, small=54, repeat=5, seed=29705):
+    '''
+    Times the closed-form triangular CDF kernel and fail_count against the scipy path on
+    size random fragility rows, and per call on a small (one plan's components) array
+    where scipy's argument validation dominates. Checks that both give the same probabilities.
+    '''
+    rng = np.random.default_rng(seed)
+    n, min, max, mode, depth = fragility_rows(size, rng)
+    sn, smin, smax, smode, sdepth = fragility_rows(small, rng)
+
+    timings = {
+        'triang_cdf': (
+            min_time(lambda: scipy_triang_cdf(depth, min, max, mode), repeat),
+            min_time(lambda: calculations.triang_cdf(depth, min, max, mode), repeat)
+        ),
+        'fail_count': (
+            min_time(lambda: scipy_fail_count(n, min, max, mode, depth, rng), repeat),
+            min_time(lambda: calculations.fail_count(n, min, max, mode, depth, rng), repeat)
+        ),
+        f'triang_cdf per call ({small} rows)': (
+            min_time(lambda: scipy_triang_cdf(sdepth, smin, smax, smode), repeat, 1000) / 1000,
+            min_time(lambda: calculations.triang_cdf(sdepth, smin, smax, smode), repeat, 1000) / 1000
+        )
+    }
+    diff = np.nanmax(np.abs(scipy_triang_cdf(depth, min, max, mode) - calculations.triang_cdf(depth, min, max, mode)))
+
+    print(f"{size} fragility rows, best of {repeat}")
+    for name, (t_scipy, t_numpy) in timings.items():
+        print(f"  {name:<32} scipy {t_scipy*1000:9.3f} ms   numpy {t_numpy*1000:9.3f} ms   speedup {t_scipy/t_numpy:5.1f}x")
+    print(f"  max abs difference in probability: {diff:.2e}")
+    return(timings)
+
+
+def bench_curve_index(path, n_queries=5_000_000, repeat=3, seed=29705):
+    '''
+    Times batch queries of random (plan_id, depth) pairs against the curve index in path
+    (curves.DamageCurveIndex), with and without the plan_id lookup.
+    '''
+    index = curves.DamageCurveIndex(path)
+    rng = np.random.default_rng(seed)
+    plan_ids = np.asarray(index.plans)[rng.integers(0, index.plans.shape[0], n_queries)]
+    depths = rng.uniform(index.depths[0], index.depths[-1], n_queries)
+    plan_idx = index.plan_index(plan_ids)
+
+    t_query = min_time(lambda: index.query(plan_ids, depths), repeat)
+    t_lookup = min_time(lambda: index.lookup(plan_idx, depths), repeat)
+    print(f"{n_queries} curve queries over {index.plans.shape[0]} plans, best of {repeat}")
+    print(f"  query (plan_id)    {n_queries/t_query/1e6:6.2f} M/s")
+    print(f"  lookup (plan_idx)  {n_queries/t_lookup/1e6:6.2f} M/s")
+    return(t_query, t_lookup)
+
+
+def synthetic_plans(n_plans, rng):
+    '''
+    Random Single-Family rows of the floor_plans sheet (same columns, roughly the same distributions
+    and missing values as the real plans) plus rs_means_cost, for benchmarking without the spreadsheets.
+    '''
+    def normal(mean, sd, lo, hi, size=n_plans):
+        return(np.clip(rng.normal(mean, sd, size), lo, hi))
+
+    def count(mean, sd, lo, hi):
+        return(np.round(normal(mean, sd, lo, hi)))
+
+    two = rng.random(n_plans) < 0.25
+    floor_area1 = np.round(normal(2000, 480, 400, 3600))
+    floor_area2 = np.where(two, np.round(normal(470, 200, 150, 1300)), 0)
+
+    plans = pd.DataFrame({
+        'plan_id': [f"SYN{i:06d}" for i in range(n_plans)],
+        'type': "Single-Family",
+        'num_units': 1,
+        'sqft': floor_area1 + floor_area2,
+        'num_floors': np.where(two, 2, 1),
+        'floor_area1': floor_area1,
+        'floor_area2': floor_area2,
+        'ceiling_height1': rng.choice([8, 9, 10], n_plans, p=[0.1, 0.75, 0.15]),
+        'ceiling_height2': np.where(two, rng.choice([8, 9], n_plans), 0),
+        'n_bed1': count(3.2, 0.7, 0, 6),
+        'n_bed2': np.where(two, count(1.3, 0.6, 0, 4), 0),
+        'n_bath1': np.round(normal(2.4, 0.6, 0.5, 4) * 2) / 2,
+        'n_bath2': np.where(two, np.round(normal(0.7, 0.4, 0, 2) * 2) / 2, 0),
+        'n_window1': count(15, 4.4, 3, 33),
+        'n_window2': np.where(two, count(2.8, 2, 0, 14), 0),
+        'n_int_door1': count(16, 5.7, 2, 60),
+        'n_ext_door1': count(3.7, 1.3, 2, 12),
+        'n_int_door2': np.where(two, count(2, 2, 0, 13), 0),
+        'n_ext_door2': 0,
+        'ext_wall_len1': np.round(6 * np.sqrt(floor_area1) * normal(1, 0.08, 0.7, 1.3)),
+        'int_wall_len1': np.round(0.34 * floor_area1 * normal(1, 0.15, 0.4, 1.6)),
+        'int_wall_len_garage': np.where(rng.random(n_plans) < 0.09, np.nan, count(117, 36, 0, 218)),
+        'ext_wall_len2': np.where(two, np.round(6 * np.sqrt(floor_area2)), 0),
+        'int_wall_len2': np.where(two, np.round(0.34 * floor_area2), 0),
+        'roof_height': normal(9.4, 1.5, 8, 20),
+        'roof_pitch': normal(0.76, 0.15, 0.333, 1.17),
+        'roof_length': np.where(rng.random(n_plans) < 0.87, np.nan, count(46, 17, 12, 113)),
+        'roof_footprint': np.round(1.7 * floor_area1 * normal(1, 0.05, 0.8, 1.2)),
+        'Garage_Type': rng.choice(["Attached", "Carport", None], n_plans, p=[0.92, 0.04, 0.04]),
+        'Size_Area': count(593, 183, 0, 1132),
+        'Amount_cars': rng.choice([0, 1, 2, 3], n_plans, p=[0.02, 0.05, 0.85, 0.08])
+    })
+    plans['ridge_height'] = plans['ceiling_height1'] * plans['num_floors'] + plans['roof_height'] + normal(4, 1.5, 0, 8)
+    plans['rs_means_cost'] = calculations.calc_rs_means_cost(
+        plans['num_floors'], plans['sqft'], (plans['n_bath1'] + plans['n_bath2'])
+    )
+    return(plans)
+
+
+def synthetic_lca(rng, options=(2, 20)):
+    '''
+    Random Cost_LCA_Coupled table with between options[0] and options[1] material options for every
+    component the spec joins onto (parse.COMPONENT_SPEC), priced per functional unit.
+    '''
+    spec = pd.DataFrame(parse.COMPONENT_SPEC, columns=parse.SPEC_COLUMNS)
+    spec['component'] = spec['component'].str.replace("2nd Floor ", "")
+    spec = spec.drop_duplicates('component')
+
+    rows = []
+    for component, component_type, unit in spec[['component', 'component_type', 'unit']].itertuples(index=False):
+        n = rng.integers(options[0], options[1] + 1)
+        cost_median, cost_sd = SYNTHETIC_UNIT_COST[unit]
+        co2_median, co2_sd = SYNTHETIC_UNIT_CO2[unit]
+        cost = cost_median * rng.lognormal(0, cost_sd) * rng.lognormal(0, 0.4, n)
+        co2 = co2_median * rng.lognormal(0, co2_sd) * rng.lognormal(0, 0.5, n)
+        rows.append(pd.DataFrame({
+            'component': component,
+            'type': component_type,
+            'product': [f"{component} option {i}" for i in range(n)],
+            'functional_unit': "ft2" if unit == "sqft" else unit,
+            'kg_co2e_fu': co2,
+            'unit_cost': cost,
+            'total_cost': cost,
+            'total_cost_inc_op': cost * 1.15
+        }))
+    return(pd.concat(rows, ignore_index=True))
+
+
+def stage_runner(stage, plans, lca_data, n, step, seed):
+    '''
+    Returns a function that runs one pipeline stage on the given synthetic inputs and returns the
+    number of rows it produced. The depth grid is main.MIN_DEPTH to main.MAX_DEPTH by step.
+    '''
+    depths = np.arange(main.MIN_DEPTH, main.MAX_DEPTH, step)
+
+    if stage == "parse_floorplan":
+        rows = [plan for _, plan in plans.iterrows()]
+        return(lambda: sum(parse.parse_floorplan(plan.copy(deep=True)).shape[0] for plan in rows))
+
+    if stage == "parse_floorplans":
+        return(lambda: parse.parse_floorplans(plans).shape[0])
+
+    if stage == "flood_structure":
+        plan = parse.parse_floorplan(plans.iloc[0].copy(deep=True))
+        plan = plan[(plan['component_type'] == "structure")]
+        simulations = calculations.generate_simulations(plan, main.MIN_DEPTH, main.MAX_DEPTH, step, n)
+        return(lambda: calculations.flood_structure(simulations.copy(), np.random.default_rng(seed)).shape[0])
+
+    if stage == "floorplan_mcs_specific":
+        parsed = [parse.parse_floorplan(plan.copy(deep=True)) for _, plan in plans.iterrows()]
+        return(lambda: sum(
+            main.floorplan_mcs_specific(plan, lca_data, np.random.default_rng(seed), n=n).shape[0] for plan in parsed
+        ))
+
+    if stage == "main_loop":
+        def run():
+            with tempfile.TemporaryDirectory() as tmp:
+                with storage.ResultWriter(os.path.join(tmp, "results.parquet")) as writer:
+                    for result in main.simulate_plans(plans, lca_data, workers=1):
+                        writer.write(result)
+                return(writer.rows)
+        return(run)
+
+    if stage == "engine_batch":
+        return(lambda: sum(result.shape[0] for result in engine.floorplan_mcs_batch(
+            engine.pack_plan_table(plans), lca_data, depths, n, seed
+        )))
+
+    raise ValueError(f"Unknown stage {stage!r}")
+
+
+def suite_cases(plan_counts, ns, steps):
+    '''
+    (stage, plans, n, step) combinations of the suite. Parsing only depends on the number of plans,
+    the single-plan stages on N and the depth step, the end-to-end stages on all three.
+    '''
+    cases = []
+    for n_plans in plan_counts:
+        cases += [("parse_floorplan", n_plans, None, None), ("parse_floorplans", n_plans, None, None)]
+    for n in ns:
+        for step in steps:
+            cases += [("flood_structure", 1, n, step), ("floorplan_mcs_specific", 1, n, step)]
+    for n_plans in plan_counts:
+        for n in ns:
+            for step in steps:
+                cases += [("main_loop", n_plans, n, step), ("engine_batch", n_plans, n, step)]
+    return(cases)
+
+
+def run_suite(plan_counts=(1, 4, 16), ns=(25, 100), steps=(0.5, 0.1), repeat=3, seed=29705):
+    '''
+    Times every stage of the pipeline on synthetic floor plans and LCA data (best of repeat runs) and
+    measures its peak traced memory (tracemalloc, in a separate run). Returns one row per case with
+    stage, plans, n, step, rows, seconds and peak_mb.
+    '''
+    rng = np.random.default_rng(seed)
+    all_plans = synthetic_plans(max(plan_counts), rng)
+    lca_data = synthetic_lca(rng)
+
+    saved = (main.N, main.STEP, main.OUTPUT, main.SAMPLER)
+    results = []
+    try:
+        main.OUTPUT, main.SAMPLER = "raw", "mc"
+        for stage, n_plans, n, step in suite_cases(plan_counts, ns, steps):
+            main.N = n or saved[0]
+            main.STEP = step or saved[1]
+            run = stage_runner(stage, all_plans.iloc[:n_plans], lca_data, main.N, main.STEP, seed)
+
+            seconds = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                rows = run()
+                seconds.append(time.perf_counter() - start)
+
+            tracemalloc.start()
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            results.append({
+                'stage': stage, 'plans': n_plans, 'n': n, 'step': step,
+                'rows': rows, 'seconds': min(seconds), 'peak_mb': peak / 2**20
+            })
+            print(f"  {stage:<24} plans {n_plans:>4}  N {str(n):>5}  step {str(step):>5}  "
+                  f"{min(seconds):9.3f} s  {peak / 2**20:9.1f} MB  {rows} rows")
+    finally:
+        main.N, main.STEP, main.OUTPUT, main.SAMPLER = saved
+    return(pd.DataFrame(results))
+
+
+def save_baseline(results, path=BASELINE_FILENAME):
+    with open(path, 'w') as f:
+        json.dump(json.loads(results.to_json(orient='records')), f, indent=1)
+
+
+def compare_baseline(results, path=BASELINE_FILENAME, tol=REGRESSION_TOL):
+    '''
+    Joins suite results onto the saved baseline and flags cases that got more than tol slower or
+    whose peak memory grew by more than tol. Returns the joined table with a regression column.
+    '''
+    baseline = pd.read_json(path, orient='records')
+    keys = ['stage', 'plans', 'n', 'step']
+    for df in (results, baseline):
+        df[['n', 'step']] = df[['n', 'step']].astype(float).fillna(-1)
+
+    check = results.merge(baseline[keys + ['seconds', 'peak_mb']], on=keys, how='left', suffixes=('', '_baseline'))
+    check['time_ratio'] = check['seconds'] / check['seconds_baseline']
+    check['memory_ratio'] = check['peak_mb'] / check['peak_mb_baseline']
+    slower = (check['time_ratio'] > 1 + tol) & (check['seconds'] - check['seconds_baseline'] > REGRESSION_MIN_SECONDS)
+    check['regression'] = slower | (check['memory_ratio'] > 1 + tol)
+    return(check)
+
+
+def min_time(f, repeat, number=1):
+    return(min(timeit.repeat(f, number=number, repeat=repeat)))
+
+
+if __name__ == "__main__":
+    # python bench.py [triang | suite [--quick] [--save | --compare]]
+    args = sys.argv[1:]
+    if not args or args[0] == "triang":
+        bench_triang_cdf()
+    elif args[0] == "suite":
+        quick = "--quick" in args
+        results = run_suite(plan_counts=(1, 4), ns=(25,), steps=(0.5,), repeat=1) if quick else run_suite()
+        if "--save" in args:
+            save_baseline(results)
+            print(f"Saved baseline to {BASELINE_FILENAME}")
+        elif "--compare" in args:
+            check = compare_baseline(results)
+            print(check[['stage', 'plans', 'n', 'step', 'time_ratio', 'memory_ratio', 'regression']].to_string(index=False))
+            sys.exit(1 if check['regression'].any() else 0)
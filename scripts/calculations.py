@@ -2,11 +2,29 @@
 Functions used in the main model script to calculate material quantities, component failure counts, etc.
 '''
 
+import os
 import numpy as np
 import pandas as pd
-from scipy.stats import triang
 import sys
 import math
+import hashlib
+from collections import OrderedDict
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# How many per-plan fragility tables to keep in memory (see plan_fragility_table)
+FRAGILITY_CACHE_SIZE = 1024
+FRAGILITY_CACHE = OrderedDict()
+
+# Integer codes of the failure calculations used by the fused damage kernel (anything else is -1)
+FAILURE_CODES = {'fail_count': 0, 'calc_drywall_insulation': 1, 'calc_facade': 2}
+
+# Run the damage kernel compiled with Numba instead of NumPy? Off by default; set the MCS_NUMBA=1 environment
+# variable (numba must be installed) to switch it on. tests/test_calculations.py checks both give the same output.
+USE_NUMBA = numba is not None and os.environ.get("MCS_NUMBA") == "1"
 
 def generate_simulations(components, min, max, d, i):
     depths = generate_floods(min, max, d, i)
@@ -28,33 +46,33 @@ def calc_unit_cost_co2_triang(rng, min, max, mean):
     return(rng.triangular(min, mean, max))
 
 
+def triang_cdf(x, min, max, mode):
+    '''
+    Closed-form CDF of the triangular distribution with lower limit min, upper limit max and peak mode.
+    Vectorized over all arguments and safe for degenerate distributions: mode == min, mode == max
+    and max == min (a step from 0 to 1 at min) never divide by zero.
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lower = np.square(x - min) / ((max - min) * (mode - min))
+        upper = 1 - np.square(max - x) / ((max - min) * (max - mode))
+    p = np.where(x <= min, 0.0, np.where(x >= max, 1.0, np.where(x <= mode, lower, upper)))
+    return(np.clip(p, 0.0, 1.0))
+
 def fail_count_check(n, min, max, mode, depth):
-    l = min
-    s = max - min
-    c = (mode - min) / s
-    return(triang.cdf(depth, c, l, s)) # can this be calculated using the rng.triangular available in numpy???
+    return(triang_cdf(depth, min, max, mode))
 
 def fail_prob(min, max, mode, depth):
-    l = min
-    s = max - min
-    c = (mode - min) / s
-    return(triang.cdf(depth, c, l, s))
+    return(triang_cdf(depth, min, max, mode))
 
-def fail_count(n, min, max, mode, depth):
+def fail_count(n, min, max, mode, depth, rng):
     '''
     Calculates the number of components that will fail at a given flood depth using a random binomial distribution f(n, p) where:
-      n = total number of given component in structure
+      n = total number of given component in structure (truncated to a whole number)
       p = probability that component fails at depth at or below given flood depth based on component's triangular distribution CDF
+    rng = numpy Generator the binomial draws are taken from
     '''
-    l = min
-    s = max - min
-    c = (mode - min) / s
-    try:
-        x = np.random.binomial(n, triang.cdf(depth, c, l, s))
-    except:
-        x = triang.cdf(depth, c, l, s)
-        
-    return(np.random.binomial(n, triang.cdf(depth, c, l, s)))
+    p = triang_cdf(depth, min, max, mode)
+    return(rng.binomial(np.asarray(n).astype(np.int64), p))
 
 def calc_drywall_insulation(quantity, min, mode, max, depth):
     '''
@@ -128,35 +146,244 @@ def flood_structure2(components):
 
     return(pd.concat([fc, dw, fd]))
 
-def flood_structure(components):
-    fc = components.loc[components['failure_calculation'] == 'fail_count']
-    dw = components.loc[components['failure_calculation'] == 'calc_drywall_insulation']
-    fd = components.loc[components['failure_calculation'] == 'calc_facade']
+def flood_structure(components, rng):
+    '''
+    Adds the damaged quantity of every row (component at a flood depth) to components, in row order:
+    binomial failure counts for fail_count components, damaged fractions of the quantity for
+    calc_drywall_insulation and calc_facade components (see flood_damage). Rows with any other
+    failure_calculation get NaN.
+    '''
+    components['damage_quantity'] = flood_damage(
+        failure_codes(components['failure_calculation']),
+        *(components[col].to_numpy(dtype=float) for col in ['quantity', 'min', 'max', 'mode', 'flood_depth']),
+        rng
+    )
+    return(components)
 
+def failure_codes(failure_calculation):
+    '''
+    Converts failure_calculation names to FAILURE_CODES (int8), via the categories so large
+    categorical columns are not compared string by string.
+    '''
+    values = pd.Categorical(failure_calculation)
+    lookup = np.array([FAILURE_CODES.get(str(v), -1) for v in values.categories] + [-1], dtype=np.int8)
+    return(lookup[values.codes])
 
-    fc.loc[:,'damage_quantity'] = fail_count(
-        fc.loc[:,'quantity'],
-        fc.loc[:,'min'],
-        fc.loc[:,'max'],
-        fc.loc[:,'mode'],
-        fc.loc[:,'flood_depth']
-    )
-    dw.loc[:,'damage_quantity'] = calc_drywall_insulation(
-        dw.loc[:,'quantity'],
-        dw.loc[:,'min'],
-        dw.loc[:,'max'],
-        dw.loc[:,'mode'],
-        dw.loc[:,'flood_depth'] 
-    )
+def flood_damage(code, quantity, min, max, mode, depth, rng, unit_cost=None, unit_co2=None):
+    '''
+    Fused damage kernel over contiguous row arrays: the failure probability or damaged fraction of each
+    row (by its failure code) followed by the damaged quantity and, if unit_cost/unit_co2 are given, its
+    cost and CO2e. Returns damage_quantity or (damage_quantity, damage_cost, damage_co2).
+    '''
+    if USE_NUMBA:
+        frag = np.empty(code.shape[0])
+        _fragility_numba(code, min, max, mode, depth, frag)
+    else:
+        frag = _fragility_numpy(code, min, max, mode, depth)
+    return(damage_from_fragility(code, quantity, frag, rng, unit_cost, unit_co2))
+
+def damage_from_fragility(code, quantity, frag, rng, unit_cost=None, unit_co2=None):
+    '''
+    Second half of the fused kernel: damaged quantity (and cost and CO2e) from each row's failure
+    probability or damaged fraction frag. The binomial draws for the fail_count rows are one call, in row
+    order, so a seeded rng gives the same counts as drawing them separately.
+    '''
+    fc = code == 0
+    draws = rng.binomial(quantity[fc].astype(np.int64), frag[fc])
+    return(combine_damage(code, quantity, frag, draws, unit_cost, unit_co2))
 
-    fd.loc[:,'damage_quantity'] = calc_facade(
-        fd.loc[:,'quantity'],
-        fd.loc[:,'min'],
-        fd.loc[:,'max'],
-        fd.loc[:,'flood_depth']
-    )
+def combine_damage(code, quantity, frag, draws, unit_cost=None, unit_co2=None):
+    '''
+    damage_from_fragility with the fail_count counts already drawn: draws holds one count per fail_count
+    row (code 0), in row order.
+    '''
+    costs = unit_cost is not None
+    if USE_NUMBA:
+        damage = np.empty(code.shape[0])
+        damage_cost = np.empty(code.shape[0] if costs else 0)
+        damage_co2 = np.empty(code.shape[0] if costs else 0)
+        _combine_numba(code, quantity, frag, draws, unit_cost if costs else damage_cost,
+                       unit_co2 if costs else damage_co2, costs, damage, damage_cost, damage_co2)
+    else:
+        damage = frag * quantity
+        damage[code == 0] = draws
+        unknown = code < 0
+        if unknown.any():
+            damage[unknown] = np.nan
+        if costs:
+            damage_cost = damage * unit_cost
+            damage_co2 = damage * unit_co2
+    if costs:
+        return(damage, damage_cost, damage_co2)
+    return(damage)
+
+def _fragility_numpy(code, min, max, mode, depth):
+    frag = np.zeros(code.shape[0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        i = np.flatnonzero(code == 0)
+        frag[i] = triang_cdf(depth[i], min[i], max[i], mode[i])
+        i = np.flatnonzero(code == 1)
+        frag[i] = calc_drywall_insulation_pct(min[i], max[i], mode[i], depth[i])
+        i = np.flatnonzero(code == 2)
+        frag[i] = calc_facade_pct(min[i], max[i], depth[i])
+    return(np.nan_to_num(frag))
+
+if numba is not None:
+    @numba.njit(cache=True, error_model='numpy')
+    def _fragility_numba(code, min, max, mode, depth, out):
+        # same formulas as triang_cdf, calc_drywall_insulation_pct (with its mode/max argument order) and
+        # calc_facade_pct, one row at a time, followed by np.nan_to_num
+        for i in range(code.shape[0]):
+            lo, hi, md, x = min[i], max[i], mode[i], depth[i]
+            p = 0.0
+            if code[i] == 0:
+                if x <= lo:
+                    p = 0.0
+                elif x >= hi:
+                    p = 1.0
+                elif x <= md:
+                    p = (x - lo) ** 2 / ((hi - lo) * (md - lo))
+                else:
+                    p = 1 - (hi - x) ** 2 / ((hi - lo) * (hi - md))
+                p = 0.0 if p < 0 else (1.0 if p > 1 else p)
+            elif code[i] == 1:
+                d = x if x < md else md
+                y = d if d > lo else 0.0
+                v = md if y > hi else 0.0
+                p = (y if y > v else v) / md
+            elif code[i] == 2:
+                d = x if x < hi else hi
+                y = d if d > lo else lo
+                p = (y - lo) / (hi - lo)
+            out[i] = np.nan_to_num(p)
+
+    @numba.njit(cache=True, error_model='numpy')
+    def _combine_numba(code, quantity, frag, draws, unit_cost, unit_co2, costs, damage, damage_cost, damage_co2):
+        j = 0
+        for i in range(code.shape[0]):
+            if code[i] == 0:
+                dq = draws[j]
+                j += 1
+            elif code[i] > 0:
+                dq = frag[i] * quantity[i]
+            else:
+                dq = np.nan
+            damage[i] = dq
+            if costs:
+                damage_cost[i] = dq * unit_cost[i]
+                damage_co2[i] = dq * unit_co2[i]
+else:
+    _fragility_numba = _combine_numba = None
+
+def fragility_table(failure_calculation, min, max, mode, depths):
+    '''
+    Calculates the failure probability (fail_count components) or the damaged fraction of the
+    quantity (calc_drywall_insulation and calc_facade components) of every component at every depth.
+    Parameters are arrays over components (optionally with leading dimensions, e.g. plans x components);
+    the result has a trailing depth dimension. Undefined fractions (e.g. a facade with max == min) are 0.
+    '''
+    failure_calculation = np.asarray(failure_calculation).astype(str)[..., None]
+    min, max, mode = (np.asarray(x, dtype=float)[..., None] for x in (min, max, mode))
+    depths = np.asarray(depths, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        table = np.where(
+            failure_calculation == 'fail_count', triang_cdf(depths, min, max, mode),
+            np.where(
+                failure_calculation == 'calc_drywall_insulation', calc_drywall_insulation_pct(min, max, mode, depths),
+                np.where(failure_calculation == 'calc_facade', calc_facade_pct(min, max, depths), 0.0)
+            )
+        )
+    return(np.nan_to_num(table))
+
+def plan_fragility_table(plan, depths):
+    '''
+    Cached fragility_table for the components of a parsed floor plan. Tables are keyed by plan_id and a
+    hash of the component parameters and depth grid, so an edited plan never reuses a stale table.
+    '''
+    params = [np.asarray(plan[col], dtype=float) for col in ['min', 'max', 'mode']] + [np.asarray(depths, dtype=float)]
+    digest = hashlib.sha1(b''.join(p.tobytes() for p in params))
+    digest.update('|'.join(plan['failure_calculation'].astype(str)).encode())
+    key = (plan['plan_id'].iloc[0], digest.hexdigest())
+
+    if key in FRAGILITY_CACHE:
+        FRAGILITY_CACHE.move_to_end(key)
+        return(FRAGILITY_CACHE[key])
+
+    table = fragility_table(plan['failure_calculation'], *params)
+    FRAGILITY_CACHE[key] = table
+    if len(FRAGILITY_CACHE) > FRAGILITY_CACHE_SIZE:
+        FRAGILITY_CACHE.popitem(last=False)
+    return(table)
+
+def flood_structure_table(components, table, rng, costs=False):
+    '''
+    Same result as flood_structure, but the failure probability / damaged fraction of each row is looked up
+    in a precomputed components x depths fragility table (plan_fragility_table) with the row's comp_idx and
+    depth_idx columns. Only the binomial draws for fail_count components are done per row. With costs=True
+    damage_cost and damage_co2 are computed in the same pass from the total_cost and kg_co2e_fu columns.
+    '''
+    frag = table[components['comp_idx'].to_numpy(), components['depth_idx'].to_numpy()]
+    code = failure_codes(components['failure_calculation'])
+    quantity = components['quantity'].to_numpy(dtype=float)
+
+    if costs:
+        damage, damage_cost, damage_co2 = damage_from_fragility(
+            code, quantity, frag, rng,
+            components['total_cost'].to_numpy(dtype=float), components['kg_co2e_fu'].to_numpy(dtype=float)
+        )
+        components['damage_cost'] = damage_cost
+        components['damage_co2'] = damage_co2
+    else:
+        damage = damage_from_fragility(code, quantity, frag, rng)
+    components['damage_quantity'] = damage
+    return(components)
+
+def material_moments(lca_data, component_join):
+    '''
+    Mean and second moment of the unit cost (total_cost) and CO2e (kg_co2e_fu) of a material option drawn
+    uniformly from the lca_data rows of each component in component_join. Missing values and components
+    without options count as 0, like they do in the Monte Carlo sums.
+    '''
+    values = lca_data[['total_cost', 'kg_co2e_fu']].fillna(0)
+    values = pd.concat([values, values.pow(2).add_suffix('_sq')], axis=1)
+    values['component'] = lca_data['component']
+    moments = values.groupby('component').mean().reindex(component_join).fillna(0)
+    return(moments)
 
-    return(pd.concat([fc, dw, fd]))
+def damage_moments(plan, table, lca_data):
+    '''
+    Exact mean and variance of sum_damage and sum_co2 at every depth of a plan's fragility table
+    (plan_fragility_table), without sampling.
+
+    fail_count components fail binomial(n, p), so E = n*p and Var = n*p*(1-p); drywall/insulation and facade
+    damage is deterministic given depth. Components that share a component_join share one material option
+    (unit value U) per run, so for each group g with total damaged quantity T_g:
+        E[S]   = sum_g E[T_g] * E[U_g]
+        Var[S] = sum_g Var[T_g] * E[U_g^2] + E[T_g]^2 * Var[U_g]
+    '''
+    quantity = np.nan_to_num(plan['quantity'].to_numpy(dtype=float))[:, None]
+    fc = (plan['failure_calculation'] == 'fail_count').to_numpy()[:, None]
+
+    n = np.where(fc, np.floor(quantity), quantity)
+    mean = n * table
+    var = np.where(fc, n * table * (1 - table), 0.0)
+
+    # add up the damaged quantities of the components that share a material option
+    groups, group_idx = np.unique(plan['component_join'].to_numpy(), return_inverse=True)
+    t_mean = np.zeros((groups.shape[0], table.shape[1]))
+    t_var = np.zeros((groups.shape[0], table.shape[1]))
+    np.add.at(t_mean, group_idx, mean)
+    np.add.at(t_var, group_idx, var)
+
+    u = material_moments(lca_data, groups)
+    result = {}
+    for col, out in [('total_cost', 'sum_damage'), ('kg_co2e_fu', 'sum_co2')]:
+        u_mean = u[col].to_numpy()[:, None]
+        u_sq = u[col + '_sq'].to_numpy()[:, None]
+        result[out + '_mean'] = (t_mean * u_mean).sum(axis=0)
+        result[out + '_var'] = (t_var * u_sq + np.square(t_mean) * (u_sq - np.square(u_mean))).sum(axis=0)
+    return(result)
 
 def calc_rs_means_cost(floors, sqft, baths):
     '''
@@ -0,0 +1,158 @@
+'''
+Depth-damage curve index: per-plan sum_damage and sum_co2 curves on a sorted depth grid,
+stored as .npy arrays and memory-mapped, for fast batch lookups of damage at arbitrary depths
+(e.g. one modeled flood depth per building of a large inventory).
+'''
+
+import os
+import json
+import numpy as np
+import pandas as pd
+import aggregate
+
+CURVE_COLUMNS = ['sum_damage', 'sum_co2']
+
+
+class DamageCurveIndex:
+    '''
+    Read side of a curve index directory written by build_index() (see from_results/from_summary):
+
+        meta.json               plan ids and statistic names
+        depths.npy              sorted depth grid (D)
+        sum_damage.npy          curves shaped statistics x plans x depths, e.g. mean, p5, p50, p95
+        sum_co2.npy
+        runs_sum_damage.npy     optional per-run curves shaped plans x runs x depths (float32)
+        runs_sum_co2.npy
+
+    Usage:
+        index = DamageCurveIndex.from_results(results, "../results/curves")
+        damage, co2 = index.query(buildings['plan_id'], buildings['flood_depth'])
+    '''
+
+    def __init__(self, path, mmap_mode='r'):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.stats = meta['stats']
+        self.plans = pd.Index(meta['plan_ids'])
+        self.depths = np.load(os.path.join(path, "depths.npy"))
+        self.curves = {col: np.load(os.path.join(path, f"{col}.npy"), mmap_mode=mmap_mode) for col in CURVE_COLUMNS}
+
+        self.runs = {}
+        if meta['runs']:
+            self.runs = {col: np.load(os.path.join(path, f"runs_{col}.npy"), mmap_mode=mmap_mode) for col in CURVE_COLUMNS}
+
+    @classmethod
+    def from_results(cls, results, path, quantiles=aggregate.QUANTILES, runs=False):
+        '''
+        Builds an index from raw results (one row per plan, run and flood depth, e.g. read back from
+        RESULT_FILENAME) with the mean and exact quantiles over runs. runs=True also keeps every run.
+        '''
+        plan_idx, plan_ids = pd.factorize(results['plan_id'], sort=True)
+        depths, depth_idx = np.unique(results['flood_depth'].to_numpy(), return_inverse=True)
+        run_idx = results['run'].to_numpy()
+        n_runs = int(run_idx.max()) + 1
+
+        stats = ['mean'] + [f'p{round(q * 100):g}' for q in quantiles]
+        curves, per_run = {}, {}
+        for col in CURVE_COLUMNS:
+            values = np.full((plan_ids.shape[0], n_runs, depths.shape[0]), np.nan)
+            values[plan_idx, run_idx, depth_idx] = results[col].to_numpy()
+            curves[col] = np.concatenate([
+                np.nanmean(values, axis=1)[None],
+                np.nanquantile(values, quantiles, axis=1)
+            ])
+            if runs:
+                per_run[col] = values.astype(np.float32)
+        return(build_index(path, plan_ids, depths, stats, curves, per_run))
+
+    @classmethod
+    def from_summary(cls, summary, path):
+        '''
+        Builds an index from the summary table (OUTPUT = "summary", aggregate.summary_frame) using its
+        <column>_mean and <column>_p<q> curves.
+        '''
+        plan_idx, plan_ids = pd.factorize(summary['plan_id'], sort=True)
+        depths, depth_idx = np.unique(summary['flood_depth'].to_numpy(), return_inverse=True)
+
+        stats = ['mean'] + [col[len('sum_damage_'):] for col in summary.columns if col.startswith('sum_damage_p')]
+        curves = {}
+        for col in CURVE_COLUMNS:
+            values = np.full((len(stats), plan_ids.shape[0], depths.shape[0]), np.nan)
+            for k, stat in enumerate(stats):
+                values[k, plan_idx, depth_idx] = summary[f'{col}_{stat}'].to_numpy()
+            curves[col] = values
+        return(build_index(path, plan_ids, depths, stats, curves))
+
+    def plan_index(self, plan_ids):
+        '''
+        Row of each plan_id in the curve arrays (-1 for plans that are not in the index). Callers that
+        query the same buildings repeatedly can compute this once and pass it to lookup().
+        '''
+        return(self.plans.get_indexer(np.asarray(plan_ids)))
+
+    def query(self, plan_ids, depths, stat='mean', run=None):
+        '''
+        Returns (sum_damage, sum_co2) for every (plan_id, depth) pair, linearly interpolated between
+        the grid depths. See lookup().
+        '''
+        return(self.lookup(self.plan_index(plan_ids), depths, stat, run))
+
+    def lookup(self, plan_idx, depths, stat='mean', run=None):
+        '''
+        Interpolated (sum_damage, sum_co2) for arrays of plan rows (plan_index()) and depths. Depths outside
+        the grid take the value at the nearest end; unknown plans give NaN. stat selects the curve
+        ('mean', 'p5', 'p50', ...); run (an int or an array of runs, 0 <= run < n_runs) selects per-run
+        curves instead.
+        '''
+        plan_idx = np.asarray(plan_idx)
+        depths = np.asarray(depths, dtype=float)
+        n_depths = self.depths.shape[0]
+
+        i = np.clip(np.searchsorted(self.depths, depths, side='right') - 1, 0, n_depths - 2)
+        d0 = self.depths[i]
+        w = np.clip((depths - d0) / (self.depths[i + 1] - d0), 0.0, 1.0)
+        missing = plan_idx < 0
+
+        if run is None:
+            k = self.stats.index(stat)
+            cell = np.where(missing, 0, plan_idx) * n_depths + i
+            sources = [self.curves[col][k].reshape(-1) for col in CURVE_COLUMNS]
+        else:
+            if not self.runs:
+                raise ValueError(f"The curve index at {self.path} has no per-run curves (build it with runs=True)")
+            n_runs = self.runs[CURVE_COLUMNS[0]].shape[1]
+            run = np.asarray(run)
+            # runs are consecutive within a plan's block, so an out-of-range run would read another plan's curve
+            bad = (run < 0) | (run >= n_runs)
+            if bad.any():
+                raise ValueError(f"Runs must be between 0 and {n_runs - 1}, got {np.unique(run[bad]).tolist()}")
+            cell = (np.where(missing, 0, plan_idx) * n_runs + run) * n_depths + i
+            sources = [self.runs[col].reshape(-1) for col in CURVE_COLUMNS]
+
+        result = []
+        for values in sources:
+            lo = values[cell]
+            hi = values[cell + 1]
+            result.append(np.where(missing, np.nan, lo + w * (hi - lo)))
+        return(tuple(result))
+
+
+def build_index(path, plan_ids, depths, stats, curves, runs=None):
+    '''
+    Writes the curve arrays (statistics x plans x depths per column) and optional per-run arrays to path
+    and returns the memory-mapped DamageCurveIndex.
+    '''
+    if depths.shape[0] < 2:
+        raise ValueError("A curve index needs at least two flood depths")
+    runs = runs or {}
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "depths.npy"), np.asarray(depths, dtype=float))
+    for col in CURVE_COLUMNS:
+        np.save(os.path.join(path, f"{col}.npy"), np.ascontiguousarray(curves[col]))
+        if runs:
+            np.save(os.path.join(path, f"runs_{col}.npy"), np.ascontiguousarray(runs[col]))
+    with open(os.path.join(path, "meta.json"), 'w') as f:
+        json.dump({'plan_ids': [str(p) for p in plan_ids], 'stats': stats, 'runs': bool(runs)}, f)
+    return(DamageCurveIndex(path))
@@ -0,0 +1,475 @@
+'''
+Batched tensor engine: simulates many floor plans at once on dense NumPy arrays
+instead of building a components x runs x depths DataFrame for every plan.
+'''
+
+import itertools
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import calculations
+import aggregate
+import utils
+import parse
+import profiling
+
+PLAN_COLUMNS = ['plan_id', 'sqft', 'num_floors', 'nbed', 'nbath', 'ncar', 'rs_means_cost']
+
+# Upper bound on the number of cells in the plans x components x runs x depths grid
+# that is evaluated at once. 2**24 cells is ~128MB of float64 per temporary array.
+CHUNK_CELLS = 2**24
+
+# Approximate bytes held per components x runs x depths row while floorplan_mcs_specific evaluates a block
+# (code, quantity, fragility, unit cost/CO2e, damage, damage cost/CO2e and the failure draws)
+ROW_BYTES = 80
+
+
+def pack_plans(parsed_plans):
+    '''
+    Packs a list of parsed floor plans (output of parse.parse_floorplan) into dense
+    arrays shaped plans x components. Every plan must come from the same component list.
+    '''
+    parsed_plans = [p[(p['component_type'] == "structure")] for p in parsed_plans]
+    first = parsed_plans[0]
+
+    packed = {
+        'component': first['component'].to_numpy(),
+        'component_join': first['component_join'].to_numpy(),
+        'failure_calculation': first['failure_calculation'].astype(str).to_numpy(),
+        'plans': pd.DataFrame([p[PLAN_COLUMNS].iloc[0] for p in parsed_plans]).reset_index(drop=True)
+    }
+    for col in ['quantity', 'min', 'max', 'mode']:
+        packed[col] = np.stack([p[col].to_numpy(dtype=float) for p in parsed_plans])
+    # missing quantities (e.g. no int_wall_len_garage) are skipped by the groupby sum in
+    # floorplan_mcs_specific, so they count as no damage here
+    packed['quantity'] = np.nan_to_num(packed['quantity'])
+    return(packed)
+
+
+def pack_plan_table(plans):
+    '''
+    Same as pack_plans, but evaluates the component spec directly over the floor plans table
+    (parse.component_arrays) instead of parsing each plan separately.
+    '''
+    arrays = parse.component_arrays(plans)
+    structure = arrays['component_type'] == "structure"
+
+    packed = {col: arrays[col][structure] for col in ['component', 'component_join', 'failure_calculation']}
+    packed['plans'] = arrays['plans']
+    for col in ['quantity', 'min', 'max', 'mode']:
+        packed[col] = arrays[col][:, structure]
+    packed['quantity'] = np.nan_to_num(packed['quantity'])
+    return(packed)
+
+
+def select_plans(packed, plans):
+    '''
+    The packed plans (pack_plans, pack_plan_table) at the given indices.
+    '''
+    selected = dict(packed)
+    for col in ['quantity', 'min', 'max', 'mode']:
+        selected[col] = packed[col][plans]
+    selected['plans'] = packed['plans'].iloc[plans].reset_index(drop=True)
+    return(selected)
+
+
+def pack_materials(lca_data, component_join):
+    '''
+    Groups the material options in lca_data by component into contiguous cost and CO2e
+    arrays. offsets/counts give the slice of options for each group and join_idx maps
+    every packed component onto its group (-1 if there are no options for it).
+    '''
+    lca_data = lca_data.sort_values('component', kind='stable')
+    groups, counts = np.unique(lca_data['component'].to_numpy(), return_counts=True)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    join_idx = pd.Index(groups).get_indexer(component_join)
+    return({
+        'groups': groups,
+        'offsets': offsets,
+        'counts': counts,
+        'join_idx': join_idx,
+        'total_cost': lca_data['total_cost'].to_numpy(dtype=float),
+        'kg_co2e_fu': lca_data['kg_co2e_fu'].to_numpy(dtype=float)
+    })
+
+
+def sample_materials(materials, n_plans, n_runs, rng):
+    '''
+    Draws one material option per plan, component group and run and returns the unit
+    cost and CO2e of the chosen option for every packed component (plans x components x runs).
+    Components that share a component_join share the same option within a run.
+    '''
+    counts = materials['counts']
+    choice = rng.integers(0, counts[None, :, None], size=(n_plans, counts.shape[0], n_runs))
+    choice = choice + materials['offsets'][None, :, None]
+
+    join_idx = materials['join_idx']
+    choice = choice[:, np.maximum(join_idx, 0), :]
+    missing = (join_idx < 0)[None, :, None]
+
+    cost = np.where(missing, 0.0, materials['total_cost'][choice])
+    co2 = np.where(missing, 0.0, materials['kg_co2e_fu'][choice])
+    return(np.nan_to_num(cost), np.nan_to_num(co2))
+
+
+def simulate_chunk(packed, materials, plans, table, n_runs, rng, sampled=None):
+    '''
+    Simulates a block of plans for n_runs runs at every depth of their fragility table
+    (plans x components x depths, see calculations.fragility_table) and returns
+    (sum_damage, sum_co2) arrays shaped plans x runs x depths. sampled can pass in the
+    (cost, co2) material draws of sample_materials() to reuse them across calls.
+    '''
+    ftype = packed['failure_calculation']
+    fc = ftype == 'fail_count'
+    quantity = packed['quantity'][plans]
+
+    with profiling.stage("sampling") as s:
+        if sampled is None:
+            sampled = sample_materials(materials, plans.shape[0], n_runs, rng)
+        cost, co2 = sampled
+        s.rows = cost.size
+
+    with profiling.stage("flood_structure") as s:
+        # fail_count components need a binomial draw for every run and depth, drawn run by run so
+        # consecutive blocks of runs use the stream in the same order as a single block
+        n = quantity[:, None, fc, None].astype(np.int64)
+        p = table[:, None, fc, :]
+        dq = rng.binomial(np.broadcast_to(n, (n.shape[0], n_runs, n.shape[2], p.shape[-1])), p)
+        sum_damage = np.einsum('prcd,pcr->prd', dq, cost[:, fc, :])
+        sum_co2 = np.einsum('prcd,pcr->prd', dq, co2[:, fc, :])
+
+        # drywall/insulation and facade damage only depend on component and depth
+        dq = table[:, ~fc, :] * quantity[:, ~fc, None]
+        sum_damage += np.einsum('pcd,pcr->prd', dq, cost[:, ~fc, :])
+        sum_co2 += np.einsum('pcd,pcr->prd', dq, co2[:, ~fc, :])
+        s.rows = quantity.shape[0] * quantity.shape[1] * n_runs * table.shape[-1]
+
+    return(sum_damage, sum_co2)
+
+
+def block_shape(n_comp, n_runs, n_depths, memory_budget_mb=None, row_bytes=ROW_BYTES):
+    '''
+    Number of runs and depths per block so a block of n_comp components x runs x depths rows stays under
+    memory_budget_mb (None: everything in one block). Whole runs are kept together while they fit; the
+    depth axis is only split when a single run is over budget.
+    '''
+    if memory_budget_mb is None:
+        return(n_runs, n_depths)
+    rows = int(memory_budget_mb * 2**20 // row_bytes)
+    run_chunk = min(n_runs, rows // (n_comp * n_depths))
+    if run_chunk >= 1:
+        return(run_chunk, n_depths)
+    return(1, int(max(1, min(n_depths, rows // n_comp))))
+
+
+def simulate_plan(plan, table, lca_data, n, rng, memory_budget_mb=None, groups=None, components=None, materials=None):
+    '''
+    Monte Carlo core of main.floorplan_mcs_specific for one plan's structure components (rows of plan,
+    aligned with its components x depths fragility table). Returns sum_damage and sum_co2 shaped
+    groups x runs x depths, where groups (one group index per component, default all 0) selects which
+    components are summed together; the runs x depths x components rows are evaluated in blocks under
+    memory_budget_mb (block_shape). components="nonzero" or "rle" also returns the per-component damage
+    as sparse entries (sparse_components) of the same runs. materials can pass in the plan's
+    pack_materials(lca_data, plan['component_join']) when it is reused.
+    '''
+    n_comp, n_depths = table.shape
+    with profiling.stage("sampling") as s:
+        # one material option per lca_data component and run, drawn as an index into the contiguous option
+        # arrays; components that share a component_join share the option. Components without options get
+        # NaN, which the sums below skip.
+        if materials is None:
+            materials = pack_materials(lca_data, plan['component_join'].to_numpy())
+        counts = materials['counts']
+        choice = materials['offsets'][:, None] + rng.integers(0, counts[:, None], size=(counts.shape[0], n))
+        join_idx = materials['join_idx']
+        choice = choice[np.maximum(join_idx, 0)]
+        missing = (join_idx < 0)[:, None]
+        total_cost = np.where(missing, np.nan, materials['total_cost'][choice])
+        kg_co2e_fu = np.where(missing, np.nan, materials['kg_co2e_fu'][choice])
+
+        # every run draws its failure counts from its own stream, depth by depth, so splitting the runs and
+        # depths into blocks below gives the same counts whatever the block size
+        streams = rng.spawn(n)
+        s.rows = total_cost.size
+
+    code = calculations.failure_codes(plan['failure_calculation'])
+    quantity = plan['quantity'].to_numpy(dtype=float)
+    fc = code == 0
+    fc_quantity = quantity[fc].astype(np.int64)
+    members = None if groups is None else [np.flatnonzero(groups == g) for g in range(int(groups.max()) + 1)]
+
+    sum_damage = np.empty((1 if groups is None else len(members), n, n_depths))
+    sum_co2 = np.empty(sum_damage.shape)
+    entries = []
+    run_chunk, depth_chunk = block_shape(n_comp, n, n_depths, memory_budget_mb)
+    for r0 in range(0, n, run_chunk):
+        r1 = min(r0 + run_chunk, n)
+        for d0 in range(0, n_depths, depth_chunk):
+            d1 = min(d0 + depth_chunk, n_depths)
+            shape = (r1 - r0, d1 - d0, n_comp)
+
+            with profiling.stage("flood_structure") as s:
+                # runs x depths x components rows, broadcast rather than resampled, in one fused pass
+                frag = table[:, d0:d1].T
+                draws = np.concatenate([streams[r].binomial(fc_quantity, frag[:, fc]).ravel() for r in range(r0, r1)])
+                _, damage_cost, damage_co2 = calculations.combine_damage(
+                    np.broadcast_to(code, shape).ravel(),
+                    np.broadcast_to(quantity, shape).ravel(),
+                    np.broadcast_to(frag, shape).ravel(),
+                    draws,
+                    np.broadcast_to(total_cost[:, r0:r1].T[:, None, :], shape).ravel(),
+                    np.broadcast_to(kg_co2e_fu[:, r0:r1].T[:, None, :], shape).ravel()
+                )
+                s.rows = damage_cost.shape[0]
+
+            with profiling.stage("aggregation"):
+                # each block is summed over components before the next one; NaN costs (components without
+                # options) are skipped
+                damage_cost = damage_cost.reshape(shape)
+                damage_co2 = damage_co2.reshape(shape)
+                if members is None:
+                    sum_damage[0, r0:r1, d0:d1] = np.nansum(damage_cost, axis=2)
+                    sum_co2[0, r0:r1, d0:d1] = np.nansum(damage_co2, axis=2)
+                else:
+                    for g, idx in enumerate(members):
+                        sum_damage[g, r0:r1, d0:d1] = np.nansum(damage_cost[:, :, idx], axis=2)
+                        sum_co2[g, r0:r1, d0:d1] = np.nansum(damage_co2[:, :, idx], axis=2)
+                if components is not None:
+                    entries.append(sparse_components(damage_cost, damage_co2, r0, d0, components))
+
+    if components is not None:
+        return(sum_damage, sum_co2, {key: np.concatenate([block[key] for block in entries]) for key in entries[0]})
+    return(sum_damage, sum_co2)
+
+
+# Encodings of the per-component damage returned by simulate_plan (see sparse_components)
+COMPONENT_ENCODINGS = ("nonzero", "rle")
+
+
+def sparse_components(damage_cost, damage_co2, r0, d0, encoding="rle"):
+    '''
+    Sparse entries of a runs x depths x components block of per-component damage starting at run r0 and
+    depth index d0: one entry per nonzero value ("nonzero") or per stretch of consecutive depths with the
+    same nonzero values ("rle", e.g. a component that has fully failed), with n_depths giving the length.
+    Zeros are left out; NaN (components without material options) counts as zero, as in the sums.
+    '''
+    if encoding not in COMPONENT_ENCODINGS:
+        raise ValueError(f"Unknown component encoding {encoding!r}, expected one of {COMPONENT_ENCODINGS}")
+    cost = np.nan_to_num(damage_cost.transpose(0, 2, 1))
+    co2 = np.nan_to_num(damage_co2.transpose(0, 2, 1))
+
+    # every runs x components row of depths starts a new stretch
+    start = np.ones(cost.shape, dtype=bool)
+    if encoding == "rle":
+        start[:, :, 1:] = (cost[:, :, 1:] != cost[:, :, :-1]) | (co2[:, :, 1:] != co2[:, :, :-1])
+    first = np.flatnonzero(start)
+    length = np.diff(np.append(first, start.size))
+
+    cost = cost.ravel()[first]
+    co2 = co2.ravel()[first]
+    keep = (cost != 0) | (co2 != 0)
+    run, comp_idx, depth_idx = np.unravel_index(first[keep], start.shape)
+    return({
+        'run': run + r0,
+        'depth_idx': depth_idx + d0,
+        'n_depths': length[keep],
+        'comp_idx': comp_idx,
+        'damage_cost': cost[keep],
+        'damage_co2': co2[keep]
+    })
+
+
+def floorplan_mcs_batch(packed, lca_data, depths, n, seed, chunk_cells=CHUNK_CELLS, summary=False):
+    '''
+    Batched equivalent of main.floorplan_mcs_specific for every packed plan. Yields one frame per
+    block of plans as soon as it is done, so the results can be written while the next block runs:
+    one row per plan, run and flood depth with the same columns as floorplan_mcs_specific or,
+    with summary=True, one row per plan and flood depth with running statistics of the runs
+    (aggregate.summary_frame) without ever holding the per-run results.
+
+    Every plan draws its material options for all n runs and then its failures, run by run, from its
+    own RNG stream (utils.plan_rng), so a plan's results don't depend on the other plans or chunk_cells.
+    '''
+    materials = pack_materials(lca_data, packed['component_join'])
+    n_plans, n_comp = packed['quantity'].shape
+    n_depths = depths.shape[0]
+
+    # size the plan and run blocks so a single fail_count grid stays under chunk_cells
+    run_chunk = int(max(1, min(n, chunk_cells // (n_comp * n_depths))))
+    plan_chunk = int(max(1, chunk_cells // (n_comp * run_chunk * n_depths)))
+
+    for p0 in range(0, n_plans, plan_chunk):
+        plans = np.arange(p0, min(p0 + plan_chunk, n_plans))
+        table = calculations.fragility_table(
+            packed['failure_calculation'], packed['min'][plans], packed['max'][plans], packed['mode'][plans], depths
+        )
+        if summary:
+            damage_stats = aggregate.RunningStats((plans.shape[0], n_depths))
+            co2_stats = aggregate.RunningStats((plans.shape[0], n_depths))
+        else:
+            sum_damage = np.empty((plans.shape[0], n, n_depths))
+            sum_co2 = np.empty((plans.shape[0], n, n_depths))
+
+        rngs = [utils.plan_rng(seed, plan_id) for plan_id in packed['plans']['plan_id'].iloc[plans]]
+        sampled = [sample_materials(materials, 1, n, rng) for rng in rngs]
+
+        for r0 in range(0, n, run_chunk):
+            r1 = min(r0 + run_chunk, n)
+            dmg, co2 = (np.concatenate(arrays) for arrays in zip(*[
+                simulate_chunk(packed, materials, plans[[i]], table[[i]], r1 - r0, rng,
+                               tuple(draws[:, :, r0:r1] for draws in sampled[i]))
+                for i, rng in enumerate(rngs)
+            ]))
+            if summary:
+                with profiling.stage("aggregation"):
+                    damage_stats.update(dmg.transpose(1, 0, 2))
+                    co2_stats.update(co2.transpose(1, 0, 2))
+            else:
+                sum_damage[:, r0:r1] = dmg
+                sum_co2[:, r0:r1] = co2
+
+        if summary:
+            yield aggregate.summary_frame(packed['plans'].iloc[plans], depths, damage_stats, co2_stats)
+        else:
+            with profiling.stage("aggregation") as s:
+                result = batch_to_frame(packed['plans'].iloc[plans], depths, sum_damage, sum_co2)
+                s.rows = result.shape[0]
+            yield result
+
+
+def floorplan_mcs_adaptive(packed, lca_data, depths, seed, tol, min_runs, max_runs, batch, workers=1):
+    '''
+    Adaptive Monte Carlo: simulates each plan in batches of runs and stops simulating a flood depth
+    once the relative 95% confidence interval width of both mean sum_damage and mean sum_co2 is at
+    most tol (after at least min_runs and at most max_runs runs). Depths where the outcome is (nearly)
+    deterministic, e.g. no damage below the floor or total loss above the ridge, stop after min_runs.
+
+    Every plan draws from its own RNG stream (utils.plan_rng), so with more than one worker the plans are
+    split into blocks run on a process pool with the same results. Returns the summary table
+    (aggregate.summary_frame); n_runs records the number of runs used for each plan and depth.
+    '''
+    if workers > 1:
+        n_plans = packed['quantity'].shape[0]
+        blocks = [block for block in np.array_split(np.arange(n_plans), 4 * workers) if block.shape[0] > 0]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            frames = executor.map(
+                floorplan_mcs_adaptive, [select_plans(packed, block) for block in blocks], itertools.repeat(lca_data),
+                itertools.repeat(depths), itertools.repeat(seed), itertools.repeat(tol), itertools.repeat(min_runs),
+                itertools.repeat(max_runs), itertools.repeat(batch)
+            )
+            return(pd.concat(list(frames), ignore_index=True))
+
+    materials = pack_materials(lca_data, packed['component_join'])
+    n_depths = depths.shape[0]
+
+    frames = []
+    for i, plan_id in enumerate(packed['plans']['plan_id']):
+        rng = utils.plan_rng(seed, plan_id)
+        plans = np.array([i])
+        table = calculations.fragility_table(
+            packed['failure_calculation'], packed['min'][plans], packed['max'][plans], packed['mode'][plans], depths
+        )
+        damage_stats = aggregate.RunningStats((1, n_depths))
+        co2_stats = aggregate.RunningStats((1, n_depths))
+
+        active = np.arange(n_depths)
+        n_runs = min(min_runs, max_runs)
+        while active.shape[0] > 0:
+            dmg, co2 = simulate_chunk(packed, materials, plans, table[:, :, active], n_runs, rng)
+            with profiling.stage("aggregation"):
+                damage_stats.update(dmg[0], active)
+                co2_stats.update(co2[0], active)
+
+            count = damage_stats.count[0, active]
+            done = damage_stats.converged(tol)[0, active] & co2_stats.converged(tol)[0, active]
+            done = done | (count >= max_runs)
+            active = active[~done]
+            n_runs = int(min(batch, max_runs - count.min())) if active.shape[0] > 0 else 0
+
+        frames.append(aggregate.summary_frame(packed['plans'].iloc[plans], depths, damage_stats, co2_stats))
+    return(pd.concat(frames, ignore_index=True))
+
+
+def floorplan_mcs_events(packed, lca_data, events, n, seed, summary=False, chunk_cells=CHUNK_CELLS):
+    '''
+    Event mode: simulates only the (plan, depth) cells a flood event needs instead of the full depth grid.
+    events has one row per building with building_id, plan_id and flood_depth (relative to the first floor)
+    or, if a first_floor_elevation column is given, flood_depth above grade; the depth above the first
+    floor is then flood_depth - first_floor_elevation (returned as floor_depth).
+
+    Each plan draws its material options once (from its own RNG stream, utils.plan_rng) and reuses them
+    for all of its depths. Buildings with the same plan and depth share that cell's runs. Returns the
+    events table with run, sum_damage and sum_co2 (one row per building and run) or, with summary=True,
+    n_runs and the aggregate.RunningStats summary columns (one row per building).
+    '''
+    events = events.reset_index(drop=True)
+    depth = events['flood_depth'].to_numpy(dtype=float)
+    if 'first_floor_elevation' in events:
+        depth = depth - events['first_floor_elevation'].to_numpy(dtype=float)
+        events['floor_depth'] = depth
+
+    plan_idx = pd.Index(packed['plans']['plan_id']).get_indexer(events['plan_id'])
+    if (plan_idx < 0).any():
+        raise ValueError(f"Unknown plan_id in events: {events['plan_id'][plan_idx < 0].unique().tolist()}")
+    if np.isnan(depth).any():
+        raise ValueError("Events with missing flood_depth")
+
+    # distinct (plan, depth) cells, sorted by plan then depth
+    cells = pd.DataFrame({'plan': plan_idx, 'depth': depth})
+    cell_idx = cells.groupby(['plan', 'depth'], sort=True).ngroup().to_numpy()
+    cells = cells.drop_duplicates().sort_values(['plan', 'depth']).reset_index(drop=True)
+    bounds = np.flatnonzero(np.diff(cells['plan'].to_numpy(), prepend=-1, append=-1))
+
+    materials = pack_materials(lca_data, packed['component_join'])
+    n_comp = packed['quantity'].shape[1]
+    depth_chunk = int(max(1, chunk_cells // (n_comp * n)))
+
+    sum_damage = np.empty((cells.shape[0], n))
+    sum_co2 = np.empty((cells.shape[0], n))
+    for c0, c1 in zip(bounds[:-1], bounds[1:]):
+        p = cells['plan'].iloc[c0]
+        rng = utils.plan_rng(seed, packed['plans']['plan_id'].iloc[p])
+        plans = np.array([p])
+        sampled = sample_materials(materials, 1, n, rng)
+
+        for d0 in range(c0, c1, depth_chunk):
+            d1 = min(d0 + depth_chunk, c1)
+            table = calculations.fragility_table(
+                packed['failure_calculation'], packed['min'][plans], packed['max'][plans], packed['mode'][plans],
+                cells['depth'].to_numpy()[d0:d1]
+            )
+            dmg, co2 = simulate_chunk(packed, materials, plans, table, n, rng, sampled)
+            sum_damage[d0:d1] = dmg[0].T
+            sum_co2[d0:d1] = co2[0].T
+
+    if summary:
+        result = events.copy()
+        result['n_runs'] = n
+        for values, prefix in [(sum_damage, 'sum_damage'), (sum_co2, 'sum_co2')]:
+            stats = aggregate.RunningStats((cells.shape[0],))
+            stats.update(values.T)
+            for col, cell_values in stats.summary(prefix).items():
+                result[col] = cell_values[cell_idx]
+        return(result)
+
+    result = events.iloc[np.repeat(np.arange(events.shape[0]), n)].reset_index(drop=True)
+    result['run'] = np.tile(np.arange(n), events.shape[0])
+    result['sum_damage'] = sum_damage[cell_idx].reshape(-1)
+    result['sum_co2'] = sum_co2[cell_idx].reshape(-1)
+    return(result)
+
+
+def batch_to_frame(plan_info, depths, sum_damage, sum_co2):
+    '''
+    Converts plans x runs x depths result arrays into the long results table.
+    '''
+    n_plans, n, n_depths = sum_damage.shape
+    rows = np.repeat(np.arange(n_plans), n * n_depths)
+
+    result = plan_info.iloc[rows].reset_index(drop=True)
+    result.insert(0, 'run', np.tile(np.repeat(np.arange(n), n_depths), n_plans))
+    result['flood_depth'] = np.tile(depths, n_plans * n)
+    result['sum_damage'] = sum_damage.reshape(-1)
+    result['sum_co2'] = sum_co2.reshape(-1)
+    return(result)
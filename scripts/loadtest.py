@@ -0,0 +1,56 @@
+'''
+Load test of a running simulation service (service.py): concurrent clients send a mix of cached curve
+requests and fresh multi-plan simulations, and the script reports throughput and latency percentiles.
+
+    python loadtest.py [--url http://127.0.0.1:8765] [--clients 8] [--requests 200] [--n 100]
+'''
+
+import sys
+import time
+import concurrent.futures
+import numpy as np
+import service
+
+
+def run_load(client, plan_ids, clients=8, requests=200, n=100, plans_per_request=2, curve_share=0.5, seed=0):
+    '''
+    Sends requests from concurrent clients: a curve_share of them ask for a curve (repeats hit the result
+    cache), the rest simulate plans_per_request random plans at random depths with n runs. Returns the
+    latency of every request in seconds and the total wall time.
+    '''
+    rng = np.random.default_rng(seed)
+    jobs = []
+    for _ in range(requests):
+        if rng.random() < curve_share:
+            jobs.append(('curve', str(rng.choice(plan_ids[:10]))))
+        else:
+            depths = np.round(np.sort(rng.uniform(-1, 16, rng.integers(1, 10))), 1)
+            jobs.append(('simulate', [str(p) for p in rng.choice(plan_ids, plans_per_request, replace=False)], depths))
+
+    def send(job):
+        start = time.perf_counter()
+        if job[0] == 'curve':
+            client.curve(job[1], n=n)
+        else:
+            client.simulate(job[1], job[2], n=n)
+        return(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=clients) as executor:
+        latencies = np.array(list(executor.map(send, jobs)))
+    return(latencies, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    option = lambda name, default: type(default)(args[args.index(name) + 1]) if name in args else default
+    client = service.ServiceClient(option("--url", f"http://{service.HOST}:{service.PORT}"))
+
+    plan_ids = client.plan_ids()
+    clients, requests = option("--clients", 8), option("--requests", 200)
+    print(f"{clients} clients sending {requests} requests to a service with {len(plan_ids)} plans")
+
+    latencies, elapsed = run_load(client, plan_ids, clients, requests, option("--n", 100))
+    print(f"{requests / elapsed:.1f} requests/s, latency p50 {np.percentile(latencies, 50) * 1000:.1f} ms, "
+          f"p95 {np.percentile(latencies, 95) * 1000:.1f} ms, max {latencies.max() * 1000:.1f} ms")
+    print(client.health())
@@ -4,11 +4,22 @@
 import parse
 import calculations
 import utils
+import engine
+import storage
+import aggregate
+import sampling
+import profiling
+import scenarios
 
 import numpy as np
 import pandas as pd
 import datetime
+import concurrent.futures
+import collections
+import functools
+import itertools
 import os
+import hashlib
 import sys
 
 # What flood depths should be included in the analysis?
@@ -19,22 +30,160 @@ STEP = .1
 # How many simulations should be generated at each flood depth?
 N = 500 #500
 
+# What should be saved?
+#   "raw":     one row per simulation (run) for each floor plan and flood depth
+#   "summary": one row per floor plan and flood depth with the mean, variance, min/max and
+#              P5/P50/P95 of sum_damage and sum_co2, aggregated while the simulation runs
+#   "compact": the raw rows in a normalized directory of plan, depth grid and facts tables with
+#              narrow dtypes (storage.CompactResultWriter, read back with storage.read_compact()).
+#              Only for the "loop" and "batch" engines.
+OUTPUT = "raw"
+
 # Where should the results be saved?
-RESULT_FILENAME = f"../results/mcs_res1-all_{N}iter_specific.parquet"
+if OUTPUT == "raw":
+    RESULT_FILENAME = f"../results/mcs_res1-all_{N}iter_specific.parquet"
+elif OUTPUT == "compact":
+    RESULT_FILENAME = f"../results/mcs_res1-all_{N}iter_compact"
+else:
+    RESULT_FILENAME = f"../results/mcs_res1-all_{N}iter_summary.parquet"
+
+# Also save the damage of every component (not just the totals) to this directory, e.g.
+# f"../results/mcs_res1-all_{N}iter_components", or None. Only nonzero damage is kept ("nonzero"), or one entry per
+# stretch of consecutive depths with the same damage ("rle"); see storage.ComponentWriter and
+# storage.read_components(). Loop engine only, and every plan is simulated since the plan cache holds totals only.
+COMPONENT_FILENAME = None
+COMPONENT_ENCODING = "rle"
+
+# Partition the results by these columns (e.g. ["plan_id"]). RESULT_FILENAME becomes a
+# directory of parquet files. Set to None to write a single parquet file.
+RESULT_PARTITION = None
 
 # RNG Seed for reproducibility 
 SEED = 29705
 RNG = np.random.default_rng(seed = SEED)
 
-def main():
-    # print(os.getcwd())
-    lca_data_path = "../data/component_cost_lca_data.xlsx"
-    floorplan_data_path = "../data/floor_plans_raw.xlsx"
+# How should the simulations be run?
+#   "loop":  one floor plan at a time with floorplan_mcs_specific()
+#   "batch": all floor plans at once with the tensor engine (engine.floorplan_mcs_batch()); every plan has its own
+#            RNG stream, so its results don't depend on the other plans or CHUNK_CELLS, but the draws differ from
+#            "loop", so the two engines agree in distribution, not run by run
+#   "moments": exact mean/variance depth-damage curves per plan without sampling (floorplan_moments()), saved to
+#              MOMENTS_RESULT_FILENAME
+#   "adaptive": batches of ADAPTIVE_BATCH runs per plan until the mean damage/CO2e at each depth converges
+#               (engine.floorplan_mcs_adaptive()); always writes "summary" rows (to the summary RESULT_FILENAME
+#               whatever OUTPUT is), n_runs records the runs used. Plans run on WORKERS processes
+#   "scenarios": every plan simulated once, then re-read for each first floor elevation in SCENARIO_ELEVATIONS
+#                and foundation type in SCENARIO_FOUNDATIONS (scenarios.sweep_plan())
+#   "events": only the (plan, depth) pairs of the buildings in EVENTS_FILENAME (engine.floorplan_mcs_events()),
+#             one row per building and run, or per building with OUTPUT = "summary"
+ENGINE = "loop"
+
+# adaptive results are always summaries, so they never go to the file of raw runs
+if ENGINE == "adaptive":
+    RESULT_FILENAME = f"../results/mcs_res1-all_{N}iter_summary.parquet"
+
+# moments mode writes exact mean/variance rows (one per plan and depth, independent of N) to a file of its own,
+# so it never replaces the Monte Carlo results
+MOMENTS_RESULT_FILENAME = "../results/mcs_res1-all_moments.parquet"
+
+# Event mode: table of buildings (building_id, plan_id, flood_depth[, first_floor_elevation]) as csv, parquet
+# or xlsx, and where to save its results
+EVENTS_FILENAME = "../data/events.csv"
+EVENTS_RESULT_FILENAME = f"../results/mcs_events_{N}iter_{OUTPUT}.parquet"
+
+# Scenario mode: how far the first floor is raised (multiples of STEP; flood_depth stays relative to the
+# original first floor), which foundation types to count components for (parse.FOUNDATION_COLUMNS, None for
+# every component) and where to save the results (one row per plan, foundation, elevation, run and depth)
+SCENARIO_ELEVATIONS = (0, 1, 2, 4)
+SCENARIO_FOUNDATIONS = scenarios.FOUNDATIONS
+SCENARIO_RESULT_FILENAME = f"../results/mcs_scenarios_{N}iter_{OUTPUT}.parquet"
+
+# Adaptive mode: stop simulating a depth once the 95% confidence interval of mean sum_damage and sum_co2
+# is narrower than ADAPTIVE_TOL (relative to the mean), after at least ADAPTIVE_MIN_RUNS and at most N runs
+ADAPTIVE_TOL = 0.02
+ADAPTIVE_MIN_RUNS = 50
+ADAPTIVE_BATCH = 50
+
+# How are material options and failures sampled in floorplan_mcs_specific()?
+#   "mc": independent random draws (the original sampler)
+#   "random", "lhs", "sobol", "antithetic": one uniform per material group and fail_count component per run from
+#   plain random numbers, a Latin hypercube, a scrambled Sobol sequence (N must be a power of 2, e.g. 512) or
+#   antithetic pairs, shared across depths (sampling.sampled_mcs()). sampler_report() shows the error reduction of
+#   each. Only the "loop" engine supports samplers other than "mc".
+SAMPLER = "mc"
+
+# Memory budget (in MB) for a plan's components x runs x depths rows in floorplan_mcs_specific(). The runs and,
+# if needed, the depths are split into blocks that fit (engine.block_shape()) and each block is summed before the
+# next one; the results are identical to a single block. None evaluates all rows at once.
+MEMORY_BUDGET_MB = None
+
+# Use the same random numbers (seeded by SEED) for every plan instead of each plan's own stream, so differences
+# between plans' curves are not blurred by sampling noise. "loop" and "scenarios" engines only.
+COMMON_RANDOM_NUMBERS = False
+
+# Profile the run? None, "cprofile" (saved next to the run manifest) or "tracemalloc" (peak allocations per
+# stage). Set with the MCS_PROFILE environment variable so production runs can be profiled without editing code.
+# Stage timings, config and input hashes are always written to a JSON manifest next to the results.
+PROFILE = os.environ.get("MCS_PROFILE") or None
+
+# Loop engine: every plan's results are cached here under a hash of its inputs (plan row, LCA data, component
+# spec, depth grid, N, seed and sampler) and of the simulation code, so a rerun only simulates new, changed or
+# unfinished plans before assembling RESULT_FILENAME. Only the plans of the latest run are kept. Set to None to
+# simulate every plan on every run.
+PLAN_CACHE_DIR = "../results/.plan_cache"
+
+# Part of the plan cache key. Edits to the modules in CACHE_MODULES invalidate the cache by themselves; bump
+# CACHE_VERSION when a change to this file (e.g. floorplan_mcs_specific or run_plan) changes the results.
+CACHE_VERSION = 1
+CACHE_MODULES = (calculations, engine, parse, sampling, aggregate, utils)
+
+# Input data
+LCA_DATA_PATH = "../data/component_cost_lca_data.xlsx"
+FLOORPLAN_DATA_PATH = "../data/floor_plans_raw.xlsx"
+
+# Number of worker processes used to run floor plans in parallel in "loop" and "adaptive" mode.
+# Every plan draws from its own RNG stream (utils.plan_rng), so results are identical
+# for any number of workers.
+WORKERS = 1
 
+def main():
+    profiler = profiling.Profiler(PROFILE).start()
+    try:
+        result_path = run_simulations()
+    finally:
+        profiler.stop()
+
+    inputs = {path: utils.file_hash(path) for path in [LCA_DATA_PATH, FLOORPLAN_DATA_PATH]}
+    if ENGINE == "events":
+        inputs[EVENTS_FILENAME] = utils.file_hash(EVENTS_FILENAME)
+    manifest = profiler.write_manifest(result_path, run_config(), inputs)
+    print(f"Run manifest saved to {manifest}")
+
+def run_config():
+    '''
+    Settings that determine the results of a run, as saved in the run manifest.
+    '''
+    return({
+        'ENGINE': ENGINE, 'OUTPUT': OUTPUT, 'N': N, 'SEED': SEED,
+        'MIN_DEPTH': MIN_DEPTH, 'MAX_DEPTH': MAX_DEPTH, 'STEP': STEP,
+        'SAMPLER': SAMPLER, 'COMMON_RANDOM_NUMBERS': COMMON_RANDOM_NUMBERS,
+        'ADAPTIVE_TOL': ADAPTIVE_TOL, 'ADAPTIVE_MIN_RUNS': ADAPTIVE_MIN_RUNS, 'ADAPTIVE_BATCH': ADAPTIVE_BATCH,
+        'COMPONENT_FILENAME': COMPONENT_FILENAME, 'COMPONENT_ENCODING': COMPONENT_ENCODING,
+        'SCENARIO_ELEVATIONS': SCENARIO_ELEVATIONS, 'SCENARIO_FOUNDATIONS': SCENARIO_FOUNDATIONS,
+        'RESULT_PARTITION': RESULT_PARTITION, 'WORKERS': WORKERS, 'PROFILE': PROFILE
+    })
+
+def run_simulations():
+    '''
+    Loads the data, runs the simulations for ENGINE and saves the results. Returns the path of the results.
+    '''
+    check_config()
     print("Loading datasets...")
     # cost = load_cost_data(path)
-    lca_data = pd.read_excel(lca_data_path, sheet_name="Cost_LCA_Coupled")
-    plans = pd.read_excel(floorplan_data_path, sheet_name="floor_plans")
+    with profiling.stage("load") as s:
+        lca_data = utils.read_sheet(LCA_DATA_PATH, sheet_name="Cost_LCA_Coupled")
+        plans = utils.read_sheet(FLOORPLAN_DATA_PATH, sheet_name="floor_plans")
+        s.rows = lca_data.shape[0] + plans.shape[0]
 
     ### Below, specify which subset of plans to run the analysis on ###
     plans = plans[(plans['type'] == "Single-Family")]
@@ -49,8 +198,84 @@ def main():
         (plans['n_bath1'] + plans['n_bath2'])
     )
 
-    plan0 = plans.copy(deep=True).iloc[0]
-    plans = plans.iloc[1:]
+    if ENGINE in ("batch", "adaptive"):
+        print(f"Running MCS for all floorplans with the {ENGINE} engine...")
+        start = datetime.datetime.now()
+        with profiling.stage("parse") as s:
+            packed = engine.pack_plan_table(plans)
+            s.rows = packed['quantity'].size
+        if ENGINE == "batch":
+            # one frame per block of plans, each written as soon as it is done
+            results = engine.floorplan_mcs_batch(
+                packed, lca_data, np.arange(MIN_DEPTH,MAX_DEPTH,STEP), N, SEED, summary=(OUTPUT == "summary")
+            )
+        else:
+            results = [engine.floorplan_mcs_adaptive(
+                packed, lca_data, np.arange(MIN_DEPTH,MAX_DEPTH,STEP), SEED,
+                ADAPTIVE_TOL, ADAPTIVE_MIN_RUNS, N, ADAPTIVE_BATCH, WORKERS
+            )]
+
+        # adaptive results are always summaries
+        writer = open_result_writer() if ENGINE == "batch" else storage.ResultWriter(RESULT_FILENAME, RESULT_PARTITION)
+        with writer:
+            for result in results:
+                with profiling.stage("write") as s:
+                    writer.write(result)
+                    s.rows = result.shape[0]
+        print("saving results")
+        end = datetime.datetime.now()
+        print(f"Time elapsed: {end - start}")
+        return(RESULT_FILENAME)
+
+    if ENGINE == "events":
+        print(f"Running MCS for the buildings in {EVENTS_FILENAME}...")
+        start = datetime.datetime.now()
+        with profiling.stage("load") as s:
+            events = utils.read_events(EVENTS_FILENAME)
+            s.rows = events.shape[0]
+        with profiling.stage("parse") as s:
+            packed = engine.pack_plan_table(plans[plans['plan_id'].isin(events['plan_id'])])
+            s.rows = packed['quantity'].size
+        results = engine.floorplan_mcs_events(packed, lca_data, events, N, SEED, summary=(OUTPUT == "summary"))
+        with storage.ResultWriter(EVENTS_RESULT_FILENAME) as writer, profiling.stage("write") as s:
+            writer.write(results)
+            s.rows = results.shape[0]
+        end = datetime.datetime.now()
+        print(f"Time elapsed: {end - start}")
+        return(EVENTS_RESULT_FILENAME)
+
+    if ENGINE == "scenarios":
+        print(f"Running MCS for {len(SCENARIO_ELEVATIONS) * len(SCENARIO_FOUNDATIONS)} scenarios per floorplan...")
+        start = datetime.datetime.now()
+        with storage.ResultWriter(SCENARIO_RESULT_FILENAME, RESULT_PARTITION) as writer:
+            for _, plan in plans.iterrows():
+                with profiling.stage("parse"):
+                    parsed_plan = parse.parse_floorplan(plan.copy(deep=True))
+                result = scenarios.sweep_plan(
+                    parsed_plan, lca_data, MIN_DEPTH, MAX_DEPTH, STEP, N, plan_stream(plan['plan_id']),
+                    SCENARIO_ELEVATIONS, SCENARIO_FOUNDATIONS, MEMORY_BUDGET_MB, summary=(OUTPUT == "summary")
+                )
+                with profiling.stage("write") as s:
+                    writer.write(result)
+                    s.rows = result.shape[0]
+        end = datetime.datetime.now()
+        print(f"Time elapsed: {end - start}")
+        return(SCENARIO_RESULT_FILENAME)
+
+    if ENGINE == "moments":
+        print("Calculating depth-damage moments for all floorplans...")
+        start = datetime.datetime.now()
+        with storage.ResultWriter(MOMENTS_RESULT_FILENAME, RESULT_PARTITION) as writer:
+            for _, plan in plans.iterrows():
+                with profiling.stage("parse"):
+                    parsed_plan = parse.parse_floorplan(plan.copy(deep=True))
+                result = floorplan_moments(parsed_plan, lca_data)
+                with profiling.stage("write") as s:
+                    writer.write(result)
+                    s.rows = result.shape[0]
+        end = datetime.datetime.now()
+        print(f"Time elapsed: {end - start}")
+        return(MOMENTS_RESULT_FILENAME)
 
     print("Iterate through floorplans and run MCS...")
     start = datetime.datetime.now()
@@ -60,25 +285,163 @@ def main():
     #         coupled cost and lca data. I have not tested it but if it does fail there are two solutions:
     #           1. remove the components from the cost and lca spreadsheets
     #           2. uncomment the rows for the removed components from the parse function
-    results = floorplan_mcs_specific(parse.parse_floorplan(plan0), lca_data)
-    # results = generate_component_mcs_results_specific(parse.parse_floorplan(plan0), lca_data)
-    
-    for index, plan in plans.iterrows():
-        i = f"{index}"
-        i =int(i)+1 # the only purpose of this is for printing the statement below. Python won't 
-        #  allow operators to be applied directly to index, and I don't understand why.
-        print(f"Running simulations for floor plan {i} of {plans.shape[0]}")
-        parsed_plan = parse.parse_floorplan(plan.copy(deep=True))
-        results = pd.concat([
-            results,
-            floorplan_mcs_specific(parsed_plan, lca_data)
-            # generate_component_mcs_results_specific(parsed_plan, lca_data)
-        ])
+    # Each plan's results are written as soon as they are done, so memory use stays at
+    # about one plan's worth of rows no matter how many plans are run.
+    writer = open_result_writer()
+    if COMPONENT_FILENAME is not None:
+        # the plan cache only holds the totals, so every plan is simulated for the per-component output
+        with storage.ComponentWriter(COMPONENT_FILENAME, np.arange(MIN_DEPTH,MAX_DEPTH,STEP)) as component_writer:
+            for i, (result, components) in enumerate(simulate_plans(plans, lca_data, components=COMPONENT_ENCODING), start=1):
+                print(f"Finished simulations for floor plan {i} of {plans.shape[0]}")
+                with profiling.stage("write") as s:
+                    writer.write(result)
+                    component_writer.write(components)
+                    s.rows = result.shape[0] + components.shape[0]
+    elif PLAN_CACHE_DIR is None:
+        for i, result in enumerate(simulate_plans(plans, lca_data), start=1):
+            print(f"Finished simulations for floor plan {i} of {plans.shape[0]}")
+            with profiling.stage("write") as s:
+                writer.write(result)
+                s.rows = result.shape[0]
+    else:
+        cache = storage.PlanCache(PLAN_CACHE_DIR)
+        plan_ids = plans['plan_id'].to_numpy()
+        keys = plan_keys(plans, lca_data)
+        todo = np.array([not cache.has(plan_id, key) for plan_id, key in zip(plan_ids, keys)], dtype=bool)
+        print(f"{todo.sum()} of {plans.shape[0]} floor plans are new or changed")
+
+        # every plan is cached as soon as it is done, so an interrupted run picks up where it stopped
+        for i, (plan_id, key, result) in enumerate(zip(plan_ids[todo], keys[todo], simulate_plans(plans[todo], lca_data)), start=1):
+            print(f"Finished simulations for floor plan {i} of {todo.sum()}")
+            with profiling.stage("write") as s:
+                cache.save(plan_id, key, result)
+                s.rows = result.shape[0]
+
+        print("assembling results")
+        for plan_id, key in zip(plan_ids, keys):
+            with profiling.stage("write") as s:
+                result = cache.load(plan_id, key)
+                writer.write(result)
+                s.rows = result.shape[0]
+        removed = cache.prune(plan_ids, keys)
+        if removed:
+            print(f"Removed {removed} stale cached plan results")
     print("saving results")
 
-    results.to_parquet(RESULT_FILENAME) 
+    writer.close()
     end = datetime.datetime.now()
     print(f"Time elapsed: {end - start}")
+    return(RESULT_FILENAME)
+
+def check_config():
+    '''
+    Raises ValueError for settings that ENGINE would otherwise silently ignore.
+    '''
+    if COMMON_RANDOM_NUMBERS and ENGINE not in ("loop", "scenarios"):
+        raise ValueError(f"COMMON_RANDOM_NUMBERS is only supported by the \"loop\" and \"scenarios\" engines, not {ENGINE!r}")
+    if SAMPLER != "mc" and ENGINE != "loop":
+        raise ValueError(f"SAMPLER = {SAMPLER!r} is only supported by the \"loop\" engine, not {ENGINE!r}")
+    if OUTPUT == "compact" and ENGINE in ("events", "scenarios"):
+        raise ValueError(f"OUTPUT = \"compact\" is not supported by the {ENGINE!r} engine; use \"raw\" or \"summary\"")
+    if SAMPLER == "sobol":
+        # fail before any plan is simulated
+        sampling.uniforms(SAMPLER, N, 1, np.random.default_rng(SEED))
+
+def plan_stream(plan_id):
+    '''
+    RNG of a plan: its own stream (utils.plan_rng) or, with COMMON_RANDOM_NUMBERS, the same stream for every plan.
+    '''
+    return(np.random.default_rng(SEED) if COMMON_RANDOM_NUMBERS else utils.plan_rng(SEED, plan_id))
+
+def open_result_writer():
+    '''
+    Returns the result sink for OUTPUT.
+    '''
+    if OUTPUT == "compact":
+        return(storage.CompactResultWriter(RESULT_FILENAME, np.arange(MIN_DEPTH,MAX_DEPTH,STEP)))
+    return(storage.ResultWriter(RESULT_FILENAME, RESULT_PARTITION))
+
+def plan_keys(plans, lca_data):
+    '''
+    Cache key of every plan's results (see PLAN_CACHE_DIR): a hash of the plan's row, the LCA rows of the
+    spec's components, the component spec, depth grid, N, seed and sampler settings, the output format and
+    the code (CACHE_VERSION and the source of CACHE_MODULES).
+    '''
+    joins = parse.COMPILED_SPEC['component_join'].unique()
+    shared = hashlib.sha256()
+    shared.update(repr(CACHE_VERSION).encode("utf-8"))
+    for module in CACHE_MODULES:
+        shared.update(utils.file_hash(module.__file__).encode("utf-8"))
+    shared.update(lca_data[lca_data['component'].isin(joins)].to_csv(index=False).encode("utf-8"))
+    shared.update(repr(parse.COMPONENT_SPEC).encode("utf-8"))
+    shared.update(np.arange(MIN_DEPTH,MAX_DEPTH,STEP).tobytes())
+    shared.update(repr((N, SEED, COMMON_RANDOM_NUMBERS, SAMPLER, OUTPUT == "summary")).encode("utf-8"))
+
+    keys = []
+    for _, plan in plans.iterrows():
+        digest = shared.copy()
+        digest.update(plan.to_json(double_precision=15).encode("utf-8"))
+        keys.append(digest.hexdigest()[:16])
+    return(np.array(keys))
+
+def run_plan(plan, lca_data, components=None):
+    '''
+    Parses and simulates a single floor plan using the plan's own RNG stream. With components ("nonzero" or
+    "rle") returns the results and the sparse per-component table (see floorplan_mcs_specific).
+    '''
+    start = datetime.datetime.now()
+    with profiling.stage("parse") as s:
+        parsed_plan = parse.parse_floorplan(plan.copy(deep=True))
+        s.rows = parsed_plan.shape[0]
+    rng = plan_stream(plan['plan_id'])
+    summary = (OUTPUT == "summary")
+    if components is not None:
+        result, component_table = floorplan_mcs_specific(parsed_plan, lca_data, rng, components=components, summary=summary)
+    else:
+        result = floorplan_mcs_specific(parsed_plan, lca_data, rng, summary=summary)
+    if profiling.active() is not None:
+        profiling.active().plan(plan['plan_id'], (datetime.datetime.now() - start).total_seconds(), result.shape[0])
+    if components is not None:
+        return(result, component_table)
+    return(result)
+
+def _init_worker(lca_data):
+    global _worker_lca_data
+    _worker_lca_data = lca_data
+
+def _run_plan_worker(plan, components=None):
+    # timings are collected per plan in the worker and merged into the parent's profiler
+    profiler = profiling.Profiler().start()
+    result = run_plan(plan, _worker_lca_data, components)
+    profiler.stop()
+    return(result, profiler.stages, profiler.plans)
+
+def simulate_plans(plans, lca_data, workers=None, components=None):
+    '''
+    Yields the results for each plan (see run_plan) in the order of the plans table. With more than one
+    worker the plans are fanned out to a process pool; the output does not depend on the
+    number of workers or the order in which they finish. At most 2 * workers plans are in flight, so
+    finished results never pile up when the consumer (e.g. the result writer) is slower than the workers.
+    '''
+    workers = WORKERS if workers is None else workers
+    rows = (plan for _, plan in plans.iterrows())
+    if workers <= 1:
+        for plan in rows:
+            yield run_plan(plan, lca_data, components)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(lca_data,)
+    ) as executor:
+        run = functools.partial(_run_plan_worker, components=components)
+        pending = collections.deque(executor.submit(run, plan) for plan in itertools.islice(rows, 2 * workers))
+        while pending:
+            # results are handed back in submission order, and the next plan is submitted for each one taken
+            result, stages, plan_timings = pending.popleft().result()
+            pending.extend(executor.submit(run, plan) for plan in itertools.islice(rows, 1))
+            if profiling.active() is not None:
+                profiling.active().merge(stages, plan_timings)
+            yield result
 
 def generate_component_mcs_results(plan, cost, co2):
 
@@ -90,7 +453,7 @@ def generate_component_mcs_results(plan, cost, co2):
     components = components[(components['component_type'] == "structure")]
     
     simulations = utils.generate_simulations(components, MIN_DEPTH, MAX_DEPTH, STEP, N)
-    result = calculations.flood_structure(simulations)
+    result = calculations.flood_structure(simulations, RNG)
     result['unit_cost_triang'] = calculations.calc_unit_cost_co2_triang(
         RNG,
         result['total_cost_min'],
@@ -121,7 +484,7 @@ def generate_component_mcs_results_specific(plan, lca_data):
     floods = calculations.generate_floods(MIN_DEPTH, MAX_DEPTH, STEP, N)
     simulations = floods.merge(components, how = 'outer', on='run')
 
-    result = calculations.flood_structure(simulations)
+    result = calculations.flood_structure(simulations, RNG)
 
     result['damage_cost'] = result['damage_quantity'] * result['unit_cost']
     result['damage_co2'] = result['damage_quantity'] * result['kg_co2e_fu']
@@ -136,7 +499,7 @@ def floorplan_mcs(plan, cost, co2):
     
     simulations = calculations.generate_simulations(components, MIN_DEPTH, MAX_DEPTH, STEP, N) 
 
-    result = calculations.flood_structure(simulations)
+    result = calculations.flood_structure(simulations, RNG)
 
 
     result['unit_cost_triang'] = calculations.calc_unit_cost_co2_triang(
@@ -166,53 +529,157 @@ def floorplan_mcs(plan, cost, co2):
     
 
     # print("Aggregating results...")
-    result = result.groupby(['run', 'plan_id', 'sqft', 'num_floors', 'nbed', 'nbath', 'ncar', 'rs_means_cost', 'flood_depth'], observed=True).agg(
-        sum_damage = ('damage_cost_triang', 'sum'),
-        sum_co2 = ('damage_co2_triang', 'sum')
-    ).reset_index()
+    floods = np.arange(MIN_DEPTH, MAX_DEPTH, STEP)
+    sum_damage, sum_co2 = aggregate.segment_sum(
+        np.zeros(result.shape[0], dtype=np.int64),
+        result['run'].to_numpy().astype(np.int64),
+        pd.Index(floods).get_indexer(result['flood_depth']),
+        (1, N, floods.shape[0]),
+        result['damage_cost_triang'].to_numpy(dtype=float),
+        result['damage_co2_triang'].to_numpy(dtype=float)
+    )
+    result = engine.batch_to_frame(components[engine.PLAN_COLUMNS].iloc[[0]], floods, sum_damage, sum_co2)
 
     return(result)
 
-def floorplan_mcs_specific(plan, lca_data):
-    plan = plan[(plan['component_type'] == "structure")]
+def floorplan_mcs_specific(plan, lca_data, rng=RNG, sampler=None, n=None, memory_budget_mb=None, components=None,
+                           summary=False):
+    '''
+    Simulates n runs of a parsed floor plan's structure components at every flood depth and returns one row
+    per run and depth with the plan attributes, sum_damage and sum_co2, or with summary=True one row per depth
+    with their statistics (aggregate.summarize_sums), computed from the run sums without building the per-run
+    rows. components="nonzero" or "rle" also returns the per-component damage as a sparse table (component_frame()).
+    '''
+    sampler = SAMPLER if sampler is None else sampler
+    n = N if n is None else n
+    memory_budget_mb = MEMORY_BUDGET_MB if memory_budget_mb is None else memory_budget_mb
+    plan = plan[(plan['component_type'] == "structure")].reset_index(drop=True)
     floods = np.arange(MIN_DEPTH,MAX_DEPTH,STEP)
 
-    rep = len(pd.unique(lca_data.component))
-    lca_data_sims = lca_data.groupby('component').sample(N, replace=True, random_state=RNG)
-
-    lca_data_sims['run'] = np.tile(np.arange(N),rep)
-    components = plan.merge(lca_data_sims, how = 'left', left_on = 'component_join', right_on = 'component')
-   
-    
-    components_flooded = components.groupby(['component_x','run']).sample(floods.shape[0],replace=True, random_state=RNG)
-    floods = np.tile(floods,components.shape[0])
-
-    components_flooded['flood_depth'] = floods
-
-    # lca_data_floods = lca_data_sims.groupby(['component','run']).sample(floods.shape[0],replace=True, random_state=RNG)
-    # floods = np.tile(floods,lca_data_sims.shape[0])
-    # lca_data_floods['flood_depth'] = floods
-
-    # plan = plan[(plan['component_type'] == "structure")].groupby('component').sample(N, replace=True, random_state=RNG)
+    # failure probabilities and damage fractions only depend on component and depth
+    table = calculations.plan_fragility_table(plan, floods)
+
+    if sampler != "mc":
+        if components is not None:
+            raise ValueError("Per-component output is only available with the \"mc\" sampler")
+        with profiling.stage("flood_structure") as s:
+            sum_damage, sum_co2 = sampling.sampled_mcs(plan, table, lca_data, floods, n, rng, sampler, memory_budget_mb)
+            sum_damage, sum_co2 = sum_damage[None], sum_co2[None]
+            s.rows = sum_damage.size
+    elif components is None:
+        sum_damage, sum_co2 = engine.simulate_plan(plan, table, lca_data, n, rng, memory_budget_mb)
+    else:
+        sum_damage, sum_co2, entries = engine.simulate_plan(plan, table, lca_data, n, rng, memory_budget_mb,
+                                                            components=components)
+
+    with profiling.stage("aggregation") as s:
+        # plan attributes are attached to the (run, depth) sums rather than used as group keys
+        if summary:
+            result = aggregate.summarize_sums(plan[engine.PLAN_COLUMNS].iloc[[0]], floods, sum_damage, sum_co2)
+        else:
+            result = engine.batch_to_frame(plan[engine.PLAN_COLUMNS].iloc[[0]], floods, sum_damage, sum_co2)
+        s.rows = result.shape[0]
+
+    if components is not None:
+        return(result, component_frame(plan, entries))
+    return(result)
 
-    # floods = calculations.generate_floods(MIN_DEPTH, MAX_DEPTH, STEP, 1)
-    # simulations = floods.merge(components, how = 'left', on='run')
+def component_frame(plan, entries):
+    '''
+    Table of the sparse per-component entries of engine.simulate_plan for a plan: plan_id, run, depth_idx
+    (into the flood depth grid), n_depths (how many consecutive depths the entry covers), component,
+    damage_cost and damage_co2.
+    '''
+    result = pd.DataFrame({
+        'plan_id': np.repeat(plan['plan_id'].iloc[0], entries['run'].shape[0]),
+        'run': entries['run'],
+        'depth_idx': entries['depth_idx'],
+        'n_depths': entries['n_depths'],
+        'component': plan['component'].to_numpy()[entries['comp_idx']],
+        'damage_cost': entries['damage_cost'],
+        'damage_co2': entries['damage_co2']
+    })
+    return(result)
 
-    result = calculations.flood_structure(components_flooded)
+def floorplan_moments(plan, lca_data):
+    '''
+    Deterministic counterpart of floorplan_mcs_specific: returns the exact mean and variance of
+    sum_damage and sum_co2 at each flood depth (one row per depth) instead of N simulations.
+    '''
+    plan = plan[(plan['component_type'] == "structure")].reset_index(drop=True)
+    floods = np.arange(MIN_DEPTH,MAX_DEPTH,STEP)
 
+    table = calculations.plan_fragility_table(plan, floods)
+    moments = calculations.damage_moments(plan, table, lca_data)
 
-    
-    result['damage_cost'] = result['damage_quantity'] * result['total_cost']
-    result['damage_co2'] = result['damage_quantity'] * result['kg_co2e_fu']
-    
-    # print(result[(result['component_x']=="Facade") & (result['plan_id']=='11700HZ')][['run','plan_id', 'flood_depth', 'component_x', 'total_cost','damage_quantity','damage_cost']])
+    result = pd.DataFrame({col: [plan[col].iloc[0]] * floods.shape[0] for col in engine.PLAN_COLUMNS})
+    result['flood_depth'] = floods
+    for col, values in moments.items():
+        result[col] = values
+    return(result)
 
-    result = result.groupby(['run', 'plan_id', 'sqft', 'num_floors', 'nbed', 'nbath', 'ncar', 'rs_means_cost', 'flood_depth'], observed=True).agg(
-        sum_damage = ('damage_cost', 'sum'),
-        sum_co2 = ('damage_co2', 'sum')
-    ).reset_index()
+def check_moments(plan, lca_data, rng=RNG):
+    '''
+    Compares floorplan_moments against the sample mean and variance of floorplan_mcs_specific.
+    z_damage/z_co2 are the differences of the means in standard errors (should mostly be within +/-3);
+    var_ratio_* compare the sample variance with the analytic variance (should be close to 1).
+    '''
+    moments = floorplan_moments(plan, lca_data)
+    mcs = floorplan_mcs_specific(plan, lca_data, rng).groupby('flood_depth', sort=True).agg(
+        mcs_damage_mean = ('sum_damage', 'mean'),
+        mcs_damage_var = ('sum_damage', 'var'),
+        mcs_co2_mean = ('sum_co2', 'mean'),
+        mcs_co2_var = ('sum_co2', 'var')
+    )
 
-    return(result)
+    check = moments[['flood_depth', 'sum_damage_mean', 'sum_damage_var', 'sum_co2_mean', 'sum_co2_var']].copy()
+    for name, col in [('damage', 'sum_damage'), ('co2', 'sum_co2')]:
+        mean = mcs[f'mcs_{name}_mean'].to_numpy()
+        var = mcs[f'mcs_{name}_var'].to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            check[f'z_{name}'] = (mean - check[f'{col}_mean']) / np.sqrt(check[f'{col}_var'] / N)
+            check[f'var_ratio_{name}'] = var / check[f'{col}_var']
+    return(check)
+
+def sampler_report(plan_a, plan_b, lca_data, samplers=sampling.SAMPLERS, n=128, reps=20):
+    '''
+    Effective error reduction of each sampler for two parsed plans. Every sampler is run reps times with
+    independent seeds and n runs; the spread of the estimated mean curves across repetitions is compared
+    with the "mc" sampler:
+      vrf_damage/vrf_co2  variance of the mean sum_damage/sum_co2 curve of plan_a, mc / sampler (summed over depths)
+      equivalent_n        runs the mc sampler would need for the same precision as n runs of the sampler
+      vrf_difference      variance of the difference between the plans' mean damage curves, mc with independent
+                          streams / sampler with common random numbers (both plans seeded alike)
+    '''
+    seeds = np.random.SeedSequence(SEED).spawn(reps)
+
+    def curve(plan, seed, sampler):
+        result = floorplan_mcs_specific(plan, lca_data, np.random.default_rng(seed), sampler, n)
+        return(result.groupby('flood_depth', sort=True)[['sum_damage', 'sum_co2']].mean().to_numpy())
+
+    spread = {}
+    for sampler in samplers:
+        a = np.stack([curve(plan_a, seed, sampler) for seed in seeds])
+        if sampler == "mc":
+            # independent streams for the two plans
+            b = np.stack([curve(plan_b, seed.spawn(1)[0], sampler) for seed in seeds])
+        else:
+            b = np.stack([curve(plan_b, seed, sampler) for seed in seeds])
+        spread[sampler] = (a.var(axis=0, ddof=1).sum(axis=0), (a - b)[:, :, 0].var(axis=0, ddof=1).sum())
+
+    base, base_diff = spread["mc"]
+    report = []
+    for sampler, (var, var_diff) in spread.items():
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vrf = base / var
+            report.append({
+                'sampler': sampler,
+                'vrf_damage': vrf[0],
+                'vrf_co2': vrf[1],
+                'equivalent_n': n * min(vrf),
+                'vrf_difference': base_diff / var_diff
+            })
+    return(pd.DataFrame(report))
 
 def print_components():
     os.chdir(os.path.dirname(os.path.realpath(__file__)))
@@ -220,7 +687,7 @@ def print_components():
     lca_data_path = "../data/component_lca_data.xlsx"
     floorplan_data_path = "../data/floor_plans_raw.xlsx"
 
-    plans = pd.read_excel(floorplan_data_path, sheet_name="floor_plans")
+    plans = utils.read_sheet(floorplan_data_path, sheet_name="floor_plans")
 
     plans = plans[
         (plans['roof_footprint'] > 0) &
@@ -244,8 +711,8 @@ def print_components():
 def test():
     lca_data_path = "../data/component_cost_lca_data.xlsx"
     N = 5
-    plans = pd.read_excel(lca_data_path, sheet_name="test_fp")
-    lca_data = pd.read_excel(lca_data_path, sheet_name="test_comp")
+    plans = utils.read_sheet(lca_data_path, sheet_name="test_fp")
+    lca_data = utils.read_sheet(lca_data_path, sheet_name="test_comp")
 
     rep = len(pd.unique(lca_data.component))
     lca_data_sims = lca_data.groupby('component').sample(N, replace=True, random_state=RNG)
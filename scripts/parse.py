@@ -2,149 +2,204 @@
 Functions to parse data stored in files into dataframes for analysis
 '''
 import math
+import numpy as np
 import pandas as pd
 from calculations import *
 import sys
 
-def parse_floorplan(plan):
-    columns = (
-        'component', 'component_type', 'unit', 'unit_cost',
-        'failure_calculation', 'quantity', 'min', 'max', 'mode',
-        'slab', 'pier', 'crawl', 'basement', 'mobile',
-        'naics_code', 'ecoinvent_id', 'ecoinvent_co2e', 'useeio_co2e'
-    )
-
-    plan['roof_area'] = calc_roof_area(plan['roof_footprint'], plan['roof_pitch'])
-
-    #TODO: There is probably a better way to handle this with a yaml or json schema for each component so these can be read from a csv of xlsx.
-    # this method is used right now because for many components the quantity and/or fragility parameters are dependent on floorplan characteristics
-    components = [
-        ('Underfloor Insulation', 'structure', 'sqft', 0, 'fail_count',  plan['floor_area1'], -0.5, -0.499, -0.5, 'No', 'Yes', 'Yes', 'No', 'No', 0, 0, 0, 0),
-
-        ('Underfloor Ductwork', 'structure', 'ft', 0, 'fail_count',  plan['floor_area1']/10, -0.5, -0.499, -0.5, 'No', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-
-        ('Heating/Cooling Unit or HVAC', 'structure', 'ea', 0, 'fail_count', 1, -1, 1, 0, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Wood Subfloor', 'structure', 'sqft', 0, 'fail_count',  plan['floor_area1'], 0, 0.01, 0, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Finished Floor Underlayment', 'structure', 'sqft', 0, 'fail_count',  plan['floor_area1'], 0, 0.01, 0, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Finished Floor', 'structure', 'sqft', 0, 'fail_count',  plan['floor_area1'], 0, 0.01, 0, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Bottom Cabinets', 'structure', 'ea', 0, 'fail_count', 1, 0, 1, 0, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Top Cabinets', 'structure', 'ea', 0, 'fail_count', 1, 4.5, 5.5, 4.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Bathroom Bottom Cabinets', 'structure', 'ea', 0, 'fail_count', plan['n_bath1'], 0, 1, 0, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        # ('Bathroom Top Cabinets', 'structure', 'ea', 0, 'fail_count', plan['n_bath1'], 4.5, 5.5, 4.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Counter Tops', 'structure', 'ea', 0, 'fail_count', 1, 0, 1, 0, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Water Heater', 'structure', 'ea', 0, 'fail_count', 1, 0, 2, 1.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Wall Paint - Interior', 'structure', 'sqft', 0, 'fail_count',  plan['int_wall_len1']*plan['ceiling_height1'], 0.5, 0.51, 0.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Wall Paint - Exterior', 'structure', 'sqft', 0, 'fail_count',  plan['ext_wall_len1']*plan['ceiling_height1']*plan['num_floors'], 0, 0.01, 0, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Exterior Doors', 'structure', 'ea', 0, 'fail_count',  plan['n_ext_door1'], 1, 4, 2, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Interior Doors', 'structure', 'ea', 0, 'fail_count',  plan['n_int_door1'], 0, 2, 0.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Sheetrock/drywall', 'structure', 'sqft', 0, 'calc_drywall_insulation',  (plan['int_wall_len1'] + plan['int_wall_len_garage'])*plan['ceiling_height1'], 0, 4, 4, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 'https://v391.ecoquery.ecoinvent.org/Details/PDF/9cd6e04e-a5d9-4b1e-a1e4-6e21e959b4cf/290c1f85-4cc4-4fa1-b0c8-2cb7f4276dce', 0.29, 0),
-        ('Wall Insulation', 'structure', 'sqft', 0, 'calc_drywall_insulation',  plan['ext_wall_len1']*plan['ceiling_height1'], 0, 4, 4, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Baseboard', 'structure', 'ft', 0, 'fail_count',  plan['int_wall_len1'], 0, 0.01, 0, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Refrigerator', 'structure', 'ea', 0, 'fail_count', 1, 0.5, 1.5, 1, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Dishwasher', 'structure', 'ea', 0, 'fail_count', 1, 0.5, 1.5, 1, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Microwave', 'structure', 'ea', 0, 'fail_count', 1, 3, 5, 3, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Clothes Washer', 'structure', 'ea', 0, 'fail_count', 1, 0.5, 1.5, 1, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Clothes Dryer', 'structure', 'ea', 0, 'fail_count', 1, 0.5, 1.5, 1, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Oven/stove', 'structure', 'ea', 0, 'fail_count', 1, 0.5, 1.5, 1, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Range hood', 'structure', 'ea', 0, 'fail_count', 1, 4.5, 6, 5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Bottom Outlets', 'structure', 'ea', 0, 'fail_count',  math.ceil(plan['int_wall_len1']/12), 1, 2, 1, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Top Outlets', 'structure', 'ea', 0, 'fail_count',  plan['n_bath1'] + 3, 3, 4, 4, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Light Switches', 'structure', 'ea', 0, 'fail_count',  2 * (plan['n_int_door1'] + plan['n_ext_door1']), 3, 4, 4, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Electrical Panel', 'structure', 'ea', 0, 'fail_count', 1, 3, 5, 4.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Windows', 'structure', 'ea', 0, 'fail_count',  plan['n_window1'], 2, plan['ceiling_height1']-2, (plan['ceiling_height1']/2), 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Ceiling Paint', 'structure', 'sqft', 0, 'fail_count',  plan['floor_area1'], plan['ceiling_height1'], plan['ceiling_height1'] + 0.01, plan['ceiling_height1'], 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Ceiling', 'structure', 'sqft', 0, 'fail_count',  plan['floor_area1'], plan['ceiling_height1'], plan['ceiling_height1'] + 0.01, plan['ceiling_height1'], 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Ceiling Insulation', 'structure', 'sqft', 0, 'fail_count',  (plan['floor_area1'] if plan['num_floors'] == 1 else 0), plan['ceiling_height1'], plan['ceiling_height1'] + 0.01, plan['ceiling_height1'], 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-
-        # ('Roof Cover Underlayment', 'structure', 'sqft', 0, 'fail_count',  plan['roof_area'], plan['roof_height'], plan['roof_height']+.01, plan['roof_height'], 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-
-        # ('Roof Cover', 'structure', 'sqft', 0, 'fail_count',  plan['roof_area'], plan['roof_height'], plan['roof_height']+.01, plan['roof_height'], 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-
-        ('Roof Cover and underlayment combined', 'structure', 'sqft', 0, 'fail_count',  plan['roof_area'], plan['roof_height'], plan['roof_height']+.01, plan['roof_height'], 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-
-        ('Roof Sheathing', 'structure', 'sqft', 0, 'calc_facade',  plan['roof_area'], plan['roof_height'], plan['ridge_height'], plan['roof_height'], 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-
-        ('Facade', 'structure', 'sqft', 0, 'calc_facade',  plan['ext_wall_len1']*plan['ceiling_height1']*plan['num_floors'], 0, plan['roof_height'], 0, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Exterior Wall Sheathing', 'structure', 'sqft', 0, 'calc_facade',  plan['ext_wall_len1']*plan['ceiling_height1']*plan['num_floors'], 0, plan['roof_height'], 0, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Bookcase', 'contents', 'ea', 0, 'fail_count',  plan['n_bed1'] + 1, 0, 6, 0, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Books', 'contents', 'ea', 0, 'fail_count', 103, 0, 20, 4, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Entertainment Center', 'contents', 'ea', 0, 'fail_count', 1, 0, 2, 0, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Couch/Sofa', 'contents', 'ea', 0, 'fail_count', 1, 0, 0.5, 0.25, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Coffee Table/End Table', 'contents', 'ea', 0, 'fail_count', 3, 0, 2, 0, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Lamps', 'contents', 'ea', 0, 'fail_count',  plan['n_bed1'] + 3, 0, 2, 0, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Blinds', 'contents', 'ea', 0, 'fail_count',  plan['n_window1'], 6, 7, 6.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Curtains/Drapes', 'contents', 'ea', 0, 'fail_count',  plan['n_window1'], 0, 8, 4, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('A/V equipment', 'contents', 'ea', 0, 'fail_count', 4, 2, 4, 3, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Television', 'contents', 'ea', 0, 'fail_count', 1, 2, 6, 4, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Dinner Table', 'contents', 'ea', 0, 'fail_count', 1, 2.33, 4, 2.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Dinner Chair', 'contents', 'ea', 0, 'fail_count', 1, 1.5, 3.33, 2, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('China Cabinet/Buffet', 'contents', 'ea', 0, 'fail_count', 1, 0.5, 1.5, 1, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Small Kitchen Appliances', 'contents', 'ea', 0, 'fail_count', 5, 1, 5, 3, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Bed Frame', 'contents', 'ea', 0, 'fail_count',  plan['n_bed1'], 1, 2, 1.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Box Spring and Mattress', 'contents', 'ea', 0, 'fail_count',  plan['n_bed1'], 1, 2, 1.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Bedding', 'contents', 'ea', 0, 'fail_count',  plan['n_bed1'], 1, 2, 1.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Chest of Drawers/Dresser', 'contents', 'ea', 0, 'fail_count',  plan['n_bed1'], 0.5, 1.5, 1, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Night stand', 'contents', 'ea', 0, 'fail_count',  plan['n_bed1'] + 1, 0.5, 1.5, 1, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Bedroom Television', 'contents', 'ea', 0, 'fail_count',  plan['n_bed1'], 3, 5, 4, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Desk', 'contents', 'ea', 0, 'fail_count',  plan['n_bed1'], 0, 3, 1.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Computer', 'contents', 'ea', 0, 'fail_count', 1, 2, 3, 2.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Clothing', 'contents', 'ea', 0, 'fail_count',  100 * (plan['n_bed1'] + 1), 0, 7, 3.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('Towels/Linens', 'contents', 'ea', 0, 'fail_count',  plan['n_bed1'] * 10, 0, 7, 3.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Bed Frame', 'contents', 'ea', 0, 'fail_count',  plan['n_bed2'], plan['ceiling_height1'] + 1 + 1, plan['ceiling_height1'] + 1 + 2, plan['ceiling_height1'] + 1 + 1.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Box Spring and Mattress', 'contents', 'ea', 0, 'fail_count',  plan['n_bed2'], plan['ceiling_height1'] + 1 + 1, plan['ceiling_height1'] + 1 + 2, plan['ceiling_height1'] + 1 + 1.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Bedding', 'contents', 'ea', 0, 'fail_count',  plan['n_bed2'], plan['ceiling_height1'] + 1 + 1, plan['ceiling_height1'] + 1 + 2, plan['ceiling_height1'] + 1 + 1.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Bedding', 'contents', 'ea', 0, 'fail_count',  plan['n_bed2'], plan['ceiling_height1'] + 1 + 1, plan['ceiling_height1'] + 1 + 2, plan['ceiling_height1'] + 1 + 1.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Chest of Drawers/Dresser', 'contents', 'ea', 0, 'fail_count',  plan['n_bed2'], plan['ceiling_height1'] + 1 + 0.5, plan['ceiling_height1'] + 1 + 1.5, plan['ceiling_height1'] + 1 + 1, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Night stand', 'contents', 'ea', 0, 'fail_count',  plan['n_bed2'], plan['ceiling_height1'] + 1 + 0.5, plan['ceiling_height1'] + 1 + 1.5, plan['ceiling_height1'] + 1 + 1, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Bedroom Television', 'contents', 'ea', 0, 'fail_count',  plan['n_bed2'],plan['ceiling_height1'] + 1 + 3, plan['ceiling_height1'] + 1 + 5, plan['ceiling_height1'] + 1 + 4, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Desk', 'contents', 'ea', 0, 'fail_count',  plan['n_bed2'], plan['ceiling_height1'] + 1 + 0, plan['ceiling_height1'] + 1 + 3, plan['ceiling_height1'] + 1 + 1.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Clothing', 'contents', 'ea', 0, 'fail_count',  100 * (plan['n_bed2']), plan['ceiling_height1'] + 1 + 0, plan['ceiling_height1'] + 1 + 7, plan['ceiling_height1'] + 1 + 3.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Towels/Linens', 'contents', 'ea', 0, 'fail_count',  plan['n_bed2'] * 10, plan['ceiling_height1'] + 1 + 0, plan['ceiling_height1'] + 1 + 7, plan['ceiling_height1'] + 1 + 3.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Lamps', 'contents', 'ea', 0, 'fail_count',  plan['n_bed2'], plan['ceiling_height1'] + 1 + 0, plan['ceiling_height1'] + 1 + 2, plan['ceiling_height1'] + 1 + 1, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Blinds', 'contents', 'ea', 0, 'fail_count',  plan['n_bed2'], plan['ceiling_height1'] + 1 + 6, plan['ceiling_height1'] + 1 + 7, plan['ceiling_height1'] + 1 + 6.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Curtains/Drapes', 'contents', 'ea', 0, 'fail_count',  plan['n_window2'], plan['ceiling_height1'] + 1 + 0, plan['ceiling_height1'] + 1 + 8, plan['ceiling_height1'] + 1 + 4, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Bookcase', 'contents', 'ea', 0, 'fail_count',  plan['n_bed2'], plan['ceiling_height1'] + 1 + 0, plan['ceiling_height1'] + 1 + 0.5, plan['ceiling_height1'] + 1 + 0, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Windows', 'structure', 'ea', 0, 'fail_count',  plan['n_window2'], plan['ceiling_height1'] + 1 + 2, plan['ceiling_height1'] + 1 + 6, plan['ceiling_height1'] + 1 + 4, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Ceiling', 'structure', 'ea', 0, 'fail_count',  plan['floor_area2'], plan['ceiling_height1'] + 1 + plan['ceiling_height2'], plan['ceiling_height1'] + 1.01 + plan['ceiling_height2'], plan['ceiling_height1'] + 1 + plan['ceiling_height2'], 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Ceiling Insulation', 'structure', 'ea', 0, 'fail_count',  (plan['floor_area2'] if plan['num_floors'] > 1 else 0), plan['ceiling_height1'] + 1 + plan['ceiling_height2'], plan['ceiling_height1'] + 1.01 + plan['ceiling_height2'], plan['ceiling_height1'] + 1 + plan['ceiling_height2'], 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Bottom Outlets', 'structure', 'ea', 0, 'fail_count',  math.ceil(plan['int_wall_len2']/12), plan['ceiling_height1'] + 1 + 1, plan['ceiling_height1'] + 1 + 2, plan['ceiling_height1'] + 1 + 1.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Top Outlets', 'structure', 'ea', 0, 'fail_count',  plan['n_bath2'], plan['ceiling_height1'] + 1 + 3, plan['ceiling_height1'] + 1 + 4, plan['ceiling_height1'] + 1 + 4, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Light Switches', 'structure', 'ea', 0, 'fail_count',  2 * (plan['n_int_door2'] + plan['n_ext_door2']), plan['ceiling_height1'] + 1 + 3, plan['ceiling_height1'] + 1 + 4, plan['ceiling_height1'] + 1 + 4, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Underfloor Ductwork', 'structure', 'ft', 0, 'fail_count',  plan['floor_area2']/10, plan['ceiling_height1'] + 0.5, plan['ceiling_height1'] + 0.51, plan['ceiling_height1'] + 0.5 , 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Wood Subfloor', 'structure', 'sqft', 0, 'fail_count',  plan['floor_area2'], plan['ceiling_height1'] + 1, plan['ceiling_height1'] + 1.01, plan['ceiling_height1'] + 1 , 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Finished Floor Underlayment', 'structure', 'sqft', 0, 'fail_count',  plan['floor_area2'], plan['ceiling_height1'] + 1, plan['ceiling_height1'] + 1.01, plan['ceiling_height1'] + 1 , 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Finished Floor', 'structure', 'sqft', 0, 'fail_count',  plan['floor_area2'], plan['ceiling_height1'] + 1, plan['ceiling_height1'] + 1.01, plan['ceiling_height1'] + 1 , 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Bathroom Bottom Cabinets', 'structure', 'ea', 0, 'fail_count',  plan['n_bath2'], plan['ceiling_height1'] + 1, plan['ceiling_height1'] + 2, plan['ceiling_height1'] + 1, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        # ('2nd Floor Bathroom Top Cabinets', 'structure', 'ea', 0, 'fail_count',  plan['n_bath2'], plan['ceiling_height1'] + 1+4.5, plan['ceiling_height1'] + 1 + 5.5, plan['ceiling_height1'] + 1 + 4.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Wall Paint - Interior', 'structure', 'sqft', 0, 'fail_count',  plan['int_wall_len2'] * plan['ceiling_height2'], plan['ceiling_height1'] + 1.5, plan['ceiling_height1'] + 1.51, plan['ceiling_height1'] + 1.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Exterior Doors', 'structure', 'ea', 0, 'fail_count',  plan['n_ext_door2'], plan['ceiling_height1'] + 1 + 1, plan['ceiling_height1'] + 1 + 4, plan['ceiling_height1'] + 1 + 2, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Interior Doors', 'structure', 'ea', 0, 'fail_count',  plan['n_int_door2'] , plan['ceiling_height1'] + 1, plan['ceiling_height1'] + 1 + 2, plan['ceiling_height1'] + 1 + 0.5, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Sheetrock/drywall', 'structure', 'sqft', 0, 'calc_drywall_insulation',  plan['int_wall_len2'] * plan['ceiling_height2'], plan['ceiling_height1'] + 1, plan['ceiling_height1'] + 1 + 4, plan['ceiling_height1'] + 1 + 4, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Wall Insulation', 'structure', 'sqft', 0, 'calc_drywall_insulation',  plan['int_wall_len2'] * plan['ceiling_height2'], plan['ceiling_height1'] + 1, plan['ceiling_height1'] + 1 + 4, plan['ceiling_height1'] + 1 + 4, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0),
-        ('2nd Floor Baseboard', 'structure', 'ft', 0, 'fail_count',  plan['int_wall_len2'], plan['ceiling_height1'] + 1, plan['ceiling_height1'] + 1 + .01, plan['ceiling_height1'] + 1, 'Yes', 'Yes', 'Yes', 'Yes', 'Yes', 0, 0, 0, 0)
-    ]
-    df = pd.DataFrame(components, columns = columns)
+# Component schema: one entry per component of a floor plan
+#   (component, component_type, unit, failure_calculation, quantity, min, max, mode, slab, pier, crawl, basement, mobile)
+# quantity, min, max and mode are expressions over the columns of the floor plans table (plus the derived roof_area).
+# They are compiled once and evaluated column-wise for every plan at once; ceil() and where() are numpy's.
+# slab, pier, crawl, basement and mobile flag whether the component applies to each foundation type.
+COMPONENT_SPEC = [
+    ('Underfloor Insulation', 'structure', 'sqft', 'fail_count', "floor_area1", "-0.5", "-0.499", "-0.5", 'No', 'Yes', 'Yes', 'No', 'No'),
+
+    ('Underfloor Ductwork', 'structure', 'ft', 'fail_count', "floor_area1/10", "-0.5", "-0.499", "-0.5", 'No', 'Yes', 'Yes', 'Yes', 'Yes'),
+
+    ('Heating/Cooling Unit or HVAC', 'structure', 'ea', 'fail_count', "1", "-1", "1", "0", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Wood Subfloor', 'structure', 'sqft', 'fail_count', "floor_area1", "0", "0.01", "0", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Finished Floor Underlayment', 'structure', 'sqft', 'fail_count', "floor_area1", "0", "0.01", "0", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Finished Floor', 'structure', 'sqft', 'fail_count', "floor_area1", "0", "0.01", "0", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Bottom Cabinets', 'structure', 'ea', 'fail_count', "1", "0", "1", "0", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Top Cabinets', 'structure', 'ea', 'fail_count', "1", "4.5", "5.5", "4.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Bathroom Bottom Cabinets', 'structure', 'ea', 'fail_count', "n_bath1", "0", "1", "0", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    # ('Bathroom Top Cabinets', 'structure', 'ea', 'fail_count', "n_bath1", "4.5", "5.5", "4.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Counter Tops', 'structure', 'ea', 'fail_count', "1", "0", "1", "0", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Water Heater', 'structure', 'ea', 'fail_count', "1", "0", "2", "1.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Wall Paint - Interior', 'structure', 'sqft', 'fail_count', "int_wall_len1*ceiling_height1", "0.5", "0.51", "0.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Wall Paint - Exterior', 'structure', 'sqft', 'fail_count', "ext_wall_len1*ceiling_height1*num_floors", "0", "0.01", "0", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Exterior Doors', 'structure', 'ea', 'fail_count', "n_ext_door1", "1", "4", "2", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Interior Doors', 'structure', 'ea', 'fail_count', "n_int_door1", "0", "2", "0.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Sheetrock/drywall', 'structure', 'sqft', 'calc_drywall_insulation', "(int_wall_len1 + int_wall_len_garage)*ceiling_height1", "0", "4", "4", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Wall Insulation', 'structure', 'sqft', 'calc_drywall_insulation', "ext_wall_len1*ceiling_height1", "0", "4", "4", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Baseboard', 'structure', 'ft', 'fail_count', "int_wall_len1", "0", "0.01", "0", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Refrigerator', 'structure', 'ea', 'fail_count', "1", "0.5", "1.5", "1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Dishwasher', 'structure', 'ea', 'fail_count', "1", "0.5", "1.5", "1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Microwave', 'structure', 'ea', 'fail_count', "1", "3", "5", "3", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Clothes Washer', 'structure', 'ea', 'fail_count', "1", "0.5", "1.5", "1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Clothes Dryer', 'structure', 'ea', 'fail_count', "1", "0.5", "1.5", "1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Oven/stove', 'structure', 'ea', 'fail_count', "1", "0.5", "1.5", "1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Range hood', 'structure', 'ea', 'fail_count', "1", "4.5", "6", "5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Bottom Outlets', 'structure', 'ea', 'fail_count', "ceil(int_wall_len1/12)", "1", "2", "1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Top Outlets', 'structure', 'ea', 'fail_count', "n_bath1 + 3", "3", "4", "4", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Light Switches', 'structure', 'ea', 'fail_count', "2 * (n_int_door1 + n_ext_door1)", "3", "4", "4", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Electrical Panel', 'structure', 'ea', 'fail_count', "1", "3", "5", "4.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Windows', 'structure', 'ea', 'fail_count', "n_window1", "2", "ceiling_height1-2", "ceiling_height1/2", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Ceiling Paint', 'structure', 'sqft', 'fail_count', "floor_area1", "ceiling_height1", "ceiling_height1 + 0.01", "ceiling_height1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Ceiling', 'structure', 'sqft', 'fail_count', "floor_area1", "ceiling_height1", "ceiling_height1 + 0.01", "ceiling_height1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Ceiling Insulation', 'structure', 'sqft', 'fail_count', "where(num_floors == 1, floor_area1, 0)", "ceiling_height1", "ceiling_height1 + 0.01", "ceiling_height1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+
+    # ('Roof Cover Underlayment', 'structure', 'sqft', 'fail_count', "roof_area", "roof_height", "roof_height+.01", "roof_height", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+
+    # ('Roof Cover', 'structure', 'sqft', 'fail_count', "roof_area", "roof_height", "roof_height+.01", "roof_height", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+
+    ('Roof Cover and underlayment combined', 'structure', 'sqft', 'fail_count', "roof_area", "roof_height", "roof_height+.01", "roof_height", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+
+    ('Roof Sheathing', 'structure', 'sqft', 'calc_facade', "roof_area", "roof_height", "ridge_height", "roof_height", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+
+    ('Facade', 'structure', 'sqft', 'calc_facade', "ext_wall_len1*ceiling_height1*num_floors", "0", "roof_height", "0", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Exterior Wall Sheathing', 'structure', 'sqft', 'calc_facade', "ext_wall_len1*ceiling_height1*num_floors", "0", "roof_height", "0", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Bookcase', 'contents', 'ea', 'fail_count', "n_bed1 + 1", "0", "6", "0", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Books', 'contents', 'ea', 'fail_count', "103", "0", "20", "4", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Entertainment Center', 'contents', 'ea', 'fail_count', "1", "0", "2", "0", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Couch/Sofa', 'contents', 'ea', 'fail_count', "1", "0", "0.5", "0.25", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Coffee Table/End Table', 'contents', 'ea', 'fail_count', "3", "0", "2", "0", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Lamps', 'contents', 'ea', 'fail_count', "n_bed1 + 3", "0", "2", "0", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Blinds', 'contents', 'ea', 'fail_count', "n_window1", "6", "7", "6.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Curtains/Drapes', 'contents', 'ea', 'fail_count', "n_window1", "0", "8", "4", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('A/V equipment', 'contents', 'ea', 'fail_count', "4", "2", "4", "3", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Television', 'contents', 'ea', 'fail_count', "1", "2", "6", "4", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Dinner Table', 'contents', 'ea', 'fail_count', "1", "2.33", "4", "2.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Dinner Chair', 'contents', 'ea', 'fail_count', "1", "1.5", "3.33", "2", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('China Cabinet/Buffet', 'contents', 'ea', 'fail_count', "1", "0.5", "1.5", "1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Small Kitchen Appliances', 'contents', 'ea', 'fail_count', "5", "1", "5", "3", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Bed Frame', 'contents', 'ea', 'fail_count', "n_bed1", "1", "2", "1.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Box Spring and Mattress', 'contents', 'ea', 'fail_count', "n_bed1", "1", "2", "1.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Bedding', 'contents', 'ea', 'fail_count', "n_bed1", "1", "2", "1.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Chest of Drawers/Dresser', 'contents', 'ea', 'fail_count', "n_bed1", "0.5", "1.5", "1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Night stand', 'contents', 'ea', 'fail_count', "n_bed1 + 1", "0.5", "1.5", "1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Bedroom Television', 'contents', 'ea', 'fail_count', "n_bed1", "3", "5", "4", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Desk', 'contents', 'ea', 'fail_count', "n_bed1", "0", "3", "1.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Computer', 'contents', 'ea', 'fail_count', "1", "2", "3", "2.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Clothing', 'contents', 'ea', 'fail_count', "100 * (n_bed1 + 1)", "0", "7", "3.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('Towels/Linens', 'contents', 'ea', 'fail_count', "n_bed1 * 10", "0", "7", "3.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Bed Frame', 'contents', 'ea', 'fail_count', "n_bed2", "ceiling_height1 + 1 + 1", "ceiling_height1 + 1 + 2", "ceiling_height1 + 1 + 1.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Box Spring and Mattress', 'contents', 'ea', 'fail_count', "n_bed2", "ceiling_height1 + 1 + 1", "ceiling_height1 + 1 + 2", "ceiling_height1 + 1 + 1.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Bedding', 'contents', 'ea', 'fail_count', "n_bed2", "ceiling_height1 + 1 + 1", "ceiling_height1 + 1 + 2", "ceiling_height1 + 1 + 1.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Bedding', 'contents', 'ea', 'fail_count', "n_bed2", "ceiling_height1 + 1 + 1", "ceiling_height1 + 1 + 2", "ceiling_height1 + 1 + 1.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Chest of Drawers/Dresser', 'contents', 'ea', 'fail_count', "n_bed2", "ceiling_height1 + 1 + 0.5", "ceiling_height1 + 1 + 1.5", "ceiling_height1 + 1 + 1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Night stand', 'contents', 'ea', 'fail_count', "n_bed2", "ceiling_height1 + 1 + 0.5", "ceiling_height1 + 1 + 1.5", "ceiling_height1 + 1 + 1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Bedroom Television', 'contents', 'ea', 'fail_count', "n_bed2", "ceiling_height1 + 1 + 3", "ceiling_height1 + 1 + 5", "ceiling_height1 + 1 + 4", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Desk', 'contents', 'ea', 'fail_count', "n_bed2", "ceiling_height1 + 1 + 0", "ceiling_height1 + 1 + 3", "ceiling_height1 + 1 + 1.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Clothing', 'contents', 'ea', 'fail_count', "100 * (n_bed2)", "ceiling_height1 + 1 + 0", "ceiling_height1 + 1 + 7", "ceiling_height1 + 1 + 3.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Towels/Linens', 'contents', 'ea', 'fail_count', "n_bed2 * 10", "ceiling_height1 + 1 + 0", "ceiling_height1 + 1 + 7", "ceiling_height1 + 1 + 3.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Lamps', 'contents', 'ea', 'fail_count', "n_bed2", "ceiling_height1 + 1 + 0", "ceiling_height1 + 1 + 2", "ceiling_height1 + 1 + 1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Blinds', 'contents', 'ea', 'fail_count', "n_bed2", "ceiling_height1 + 1 + 6", "ceiling_height1 + 1 + 7", "ceiling_height1 + 1 + 6.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Curtains/Drapes', 'contents', 'ea', 'fail_count', "n_window2", "ceiling_height1 + 1 + 0", "ceiling_height1 + 1 + 8", "ceiling_height1 + 1 + 4", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Bookcase', 'contents', 'ea', 'fail_count', "n_bed2", "ceiling_height1 + 1 + 0", "ceiling_height1 + 1 + 0.5", "ceiling_height1 + 1 + 0", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Windows', 'structure', 'ea', 'fail_count', "n_window2", "ceiling_height1 + 1 + 2", "ceiling_height1 + 1 + 6", "ceiling_height1 + 1 + 4", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Ceiling', 'structure', 'ea', 'fail_count', "floor_area2", "ceiling_height1 + 1 + ceiling_height2", "ceiling_height1 + 1.01 + ceiling_height2", "ceiling_height1 + 1 + ceiling_height2", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Ceiling Insulation', 'structure', 'ea', 'fail_count', "where(num_floors > 1, floor_area2, 0)", "ceiling_height1 + 1 + ceiling_height2", "ceiling_height1 + 1.01 + ceiling_height2", "ceiling_height1 + 1 + ceiling_height2", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Bottom Outlets', 'structure', 'ea', 'fail_count', "ceil(int_wall_len2/12)", "ceiling_height1 + 1 + 1", "ceiling_height1 + 1 + 2", "ceiling_height1 + 1 + 1.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Top Outlets', 'structure', 'ea', 'fail_count', "n_bath2", "ceiling_height1 + 1 + 3", "ceiling_height1 + 1 + 4", "ceiling_height1 + 1 + 4", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Light Switches', 'structure', 'ea', 'fail_count', "2 * (n_int_door2 + n_ext_door2)", "ceiling_height1 + 1 + 3", "ceiling_height1 + 1 + 4", "ceiling_height1 + 1 + 4", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Underfloor Ductwork', 'structure', 'ft', 'fail_count', "floor_area2/10", "ceiling_height1 + 0.5", "ceiling_height1 + 0.51", "ceiling_height1 + 0.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Wood Subfloor', 'structure', 'sqft', 'fail_count', "floor_area2", "ceiling_height1 + 1", "ceiling_height1 + 1.01", "ceiling_height1 + 1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Finished Floor Underlayment', 'structure', 'sqft', 'fail_count', "floor_area2", "ceiling_height1 + 1", "ceiling_height1 + 1.01", "ceiling_height1 + 1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Finished Floor', 'structure', 'sqft', 'fail_count', "floor_area2", "ceiling_height1 + 1", "ceiling_height1 + 1.01", "ceiling_height1 + 1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Bathroom Bottom Cabinets', 'structure', 'ea', 'fail_count', "n_bath2", "ceiling_height1 + 1", "ceiling_height1 + 2", "ceiling_height1 + 1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    # ('2nd Floor Bathroom Top Cabinets', 'structure', 'ea', 'fail_count', "n_bath2", "ceiling_height1 + 1+4.5", "ceiling_height1 + 1 + 5.5", "ceiling_height1 + 1 + 4.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Wall Paint - Interior', 'structure', 'sqft', 'fail_count', "int_wall_len2 * ceiling_height2", "ceiling_height1 + 1.5", "ceiling_height1 + 1.51", "ceiling_height1 + 1.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Exterior Doors', 'structure', 'ea', 'fail_count', "n_ext_door2", "ceiling_height1 + 1 + 1", "ceiling_height1 + 1 + 4", "ceiling_height1 + 1 + 2", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Interior Doors', 'structure', 'ea', 'fail_count', "n_int_door2", "ceiling_height1 + 1", "ceiling_height1 + 1 + 2", "ceiling_height1 + 1 + 0.5", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Sheetrock/drywall', 'structure', 'sqft', 'calc_drywall_insulation', "int_wall_len2 * ceiling_height2", "ceiling_height1 + 1", "ceiling_height1 + 1 + 4", "ceiling_height1 + 1 + 4", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Wall Insulation', 'structure', 'sqft', 'calc_drywall_insulation', "int_wall_len2 * ceiling_height2", "ceiling_height1 + 1", "ceiling_height1 + 1 + 4", "ceiling_height1 + 1 + 4", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+    ('2nd Floor Baseboard', 'structure', 'ft', 'fail_count', "int_wall_len2", "ceiling_height1 + 1", "ceiling_height1 + 1 + .01", "ceiling_height1 + 1", 'Yes', 'Yes', 'Yes', 'Yes', 'Yes'),
+
+]
+
+SPEC_COLUMNS = (
+    'component', 'component_type', 'unit', 'failure_calculation',
+    'quantity', 'min', 'max', 'mode',
+    'slab', 'pier', 'crawl', 'basement', 'mobile'
+)
+EXPRESSION_COLUMNS = ('quantity', 'min', 'max', 'mode')
+FOUNDATION_COLUMNS = ('slab', 'pier', 'crawl', 'basement', 'mobile')
+
+def compile_spec(spec):
+    '''
+    Converts a component spec into a DataFrame with one row per component; the quantity and fragility
+    expressions are replaced by compiled code objects.
+    '''
+    spec = pd.DataFrame(spec, columns=SPEC_COLUMNS)
+    for col in EXPRESSION_COLUMNS:
+        spec[col] = [compile(str(expr), f"<{col}>", "eval") for expr in spec[col]]
+    spec['component_join'] = spec['component'].str.replace("2nd Floor ", "")
+    return(spec)
+
+COMPILED_SPEC = compile_spec(COMPONENT_SPEC)
+
+def component_arrays(plans, spec=COMPILED_SPEC):
+    '''
+    Evaluates the component spec for every row of the floor plans table at once. Returns a dict with the
+    per-component columns of the spec (arrays over components), quantity/min/max/mode arrays shaped
+    plans x components and a 'plans' table with the plan attributes carried into the results.
+    '''
+    n_plans = plans.shape[0]
+    namespace = {col: plans[col].to_numpy() for col in plans.columns}
+    namespace['roof_area'] = calc_roof_area(namespace['roof_footprint'], namespace['roof_pitch'])
+    namespace['ceil'] = np.ceil
+    namespace['where'] = np.where
+
+    arrays = {
+        col: spec[col].to_numpy()
+        for col in ('component', 'component_type', 'unit', 'failure_calculation', 'component_join') + FOUNDATION_COLUMNS
+    }
+    for col in EXPRESSION_COLUMNS:
+        arrays[col] = np.stack([
+            np.broadcast_to(np.asarray(eval(code, {'__builtins__': {}}, namespace), dtype=float), (n_plans,))
+            for code in spec[col]
+        ], axis=1)
+
+    arrays['plans'] = pd.DataFrame({
+        'plan_id': plans['plan_id'].to_numpy(),
+        'sqft': plans['sqft'].to_numpy(),
+        'num_floors': plans['num_floors'].to_numpy(),
+        'nbed': (plans['n_bed1'] + plans['n_bed2']).to_numpy(),
+        'nbath': (plans['n_bath1'] + plans['n_bath2']).to_numpy(),
+        'ncar': plans['Amount_cars'].to_numpy(),
+        'rs_means_cost': plans['rs_means_cost'].to_numpy()
+    })
+    return(arrays)
+
+def parse_floorplans(plans):
+    '''
+    Converts every floor plan in the plans table into the long table of components returned by
+    parse_floorplan, in one call (plans in table order, components in spec order).
+    '''
+    arrays = component_arrays(plans)
+    n_plans, n_components = arrays['quantity'].shape
+
+    df = pd.DataFrame({
+        col: np.tile(arrays[col], n_plans) for col in ('component', 'component_type', 'unit', 'failure_calculation')
+    })
+    for col in EXPRESSION_COLUMNS:
+        df[col] = arrays[col].ravel()
     df['damage_quantity'] = 0.0
-    df['plan_id'] = plan['plan_id']
-    df['sqft'] = plan['sqft']
-    df['num_floors'] = plan['num_floors']
-    df['nbed'] = plan['n_bed1'] + plan['n_bed2']
-    df['nbath'] = plan['n_bath1'] + plan['n_bath2']
-    df['ncar'] = plan['Amount_cars']
-    df['rs_means_cost'] = plan['rs_means_cost']
 
-    df['component_join'] = df['component'].str.replace("2nd Floor ", "")
-    # df[['roof_length', 'roof_pitch', 'roof_height', 'ridge_height', 'roof_area']] = plan[['roof_length', 'roof_pitch', 'roof_height', 'ridge_height', 'roof_area']]
+    plan_info = arrays['plans'].iloc[np.repeat(np.arange(n_plans), n_components)].reset_index(drop=True)
+    df = pd.concat([df, plan_info], axis=1)
+    df['component_join'] = np.tile(arrays['component_join'], n_plans)
+    for col in FOUNDATION_COLUMNS:
+        df[col] = np.tile(arrays[col] == 'Yes', n_plans)
 
     for col in ['component_type', 'unit', 'failure_calculation']:
         df[col] = df[col].astype('category')
-
-    # drop unneeded and deprecated columns
-    df = df.drop(
-        [
-            'unit_cost', 'slab', 'pier', 'crawl', 'basement',
-            'mobile','naics_code', 'ecoinvent_id', 'ecoinvent_co2e', 'useeio_co2e'
-        ],
-        axis=1
-    )
     return(df)
+
+def parse_floorplan(plan):
+    '''
+    Converts the data for a single floor plan (a row of the floor plans table) into a table of components.
+    '''
+    return(parse_floorplans(pd.DataFrame([plan]).infer_objects()))
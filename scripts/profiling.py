@@ -0,0 +1,170 @@
+'''
+Lightweight per-stage instrumentation. Code marks its stages with
+
+    with profiling.stage("flood_structure") as s:
+        result = ...
+        s.rows = result.shape[0]
+
+which records wall time, calls and rows in the active Profiler (and costs next to nothing when no
+profiler is active). Profiler.write_manifest() saves the timings together with the run's configuration
+and input hashes as JSON.
+'''
+
+import os
+import sys
+import json
+import time
+import datetime
+import cProfile
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    # not available on Windows; peak RSS is then left out
+    resource = None
+import numpy as np
+import pandas as pd
+
+# Profilers that can be switched on for a run (see Profiler)
+MODES = (None, "cprofile", "tracemalloc")
+
+_active = None
+
+
+class _Stage:
+    def __init__(self):
+        self.rows = None
+
+
+class Profiler:
+    '''
+    Collects per-stage wall time, calls, rows and process_peak_rss_mb (the process's RSS high-water mark when the
+    stage last ended, not the stage's own use), and per-plan timings. mode="cprofile" also
+    profiles the whole run with cProfile (saved next to the manifest); mode="tracemalloc" records the peak
+    traced Python/NumPy allocation of every stage.
+    '''
+
+    def __init__(self, mode=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode!r}, expected one of {MODES}")
+        self.mode = mode
+        self.stages = {}
+        self.plans = []
+        self.started = datetime.datetime.now()
+        self._start = time.perf_counter()
+        self._cprofile = None
+
+    def start(self):
+        global _active
+        _active = self
+        if self.mode == "cprofile":
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        elif self.mode == "tracemalloc":
+            tracemalloc.start()
+        return(self)
+
+    def stop(self):
+        global _active
+        if _active is self:
+            _active = None
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if self.mode == "tracemalloc" and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.elapsed = time.perf_counter() - self._start
+
+    def record(self, name, seconds, rows=None, traced_peak=None):
+        entry = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'rows': 0})
+        entry['seconds'] += seconds
+        entry['calls'] += 1
+        entry['rows'] += int(rows or 0)
+        peak = peak_rss_mb()
+        if peak is not None:
+            entry['process_peak_rss_mb'] = max(entry.get('process_peak_rss_mb', 0.0), peak)
+        if traced_peak is not None:
+            entry['traced_peak_mb'] = max(entry.get('traced_peak_mb', 0.0), traced_peak / 2**20)
+
+    def merge(self, stages, plans=()):
+        '''
+        Adds the stages and plan timings of another profiler (e.g. from a worker process).
+        '''
+        for name, other in stages.items():
+            entry = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'rows': 0})
+            for key in ('seconds', 'calls', 'rows'):
+                entry[key] += other[key]
+            for key in ('process_peak_rss_mb', 'traced_peak_mb'):
+                if key in other:
+                    entry[key] = max(entry.get(key, 0.0), other[key])
+        self.plans.extend(plans)
+
+    def plan(self, plan_id, seconds, rows=None):
+        self.plans.append({'plan_id': str(plan_id), 'seconds': seconds, 'rows': int(rows or 0)})
+
+    def write_manifest(self, result_path, config, inputs):
+        '''
+        Writes <result_path without extension>.manifest.json with the config, input hashes, stage and
+        per-plan timings. Returns the manifest path.
+        '''
+        path = manifest_path(result_path)
+        manifest = {
+            'result': result_path,
+            'started': self.started.isoformat(timespec='seconds'),
+            'elapsed_seconds': getattr(self, 'elapsed', time.perf_counter() - self._start),
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_rss_children_mb': peak_rss_mb(children=True),
+            'config': config,
+            'inputs': inputs,
+            'versions': {'python': sys.version.split()[0], 'numpy': np.__version__, 'pandas': pd.__version__},
+            'stages': self.stages,
+            'plans': self.plans
+        }
+        if self._cprofile is not None:
+            manifest['cprofile'] = os.path.splitext(path)[0] + ".prof"
+            self._cprofile.dump_stats(manifest['cprofile'])
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=1, default=str)
+        return(path)
+
+
+class stage:
+    '''
+    Context manager that times a block as the named stage of the active profiler. Set .rows on the
+    returned object to record the rows it processed.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.record = _Stage()
+
+    def __enter__(self):
+        if _active is not None:
+            if _active.mode == "tracemalloc":
+                tracemalloc.reset_peak()
+            self.start = time.perf_counter()
+        return(self.record)
+
+    def __exit__(self, *exc):
+        if _active is not None:
+            traced_peak = tracemalloc.get_traced_memory()[1] if _active.mode == "tracemalloc" else None
+            _active.record(self.name, time.perf_counter() - self.start, self.record.rows, traced_peak)
+
+
+def active():
+    return(_active)
+
+
+def peak_rss_mb(children=False):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS; RUSAGE_CHILDREN covers (finished) worker processes.
+    # None where the resource module is missing (Windows)
+    if resource is None:
+        return(None)
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return(peak / 2**20 if sys.platform == "darwin" else peak / 2**10)
+
+
+def manifest_path(result_path):
+    root, ext = os.path.splitext(result_path.rstrip("/"))
+    return((root if ext == ".parquet" else result_path.rstrip("/")) + ".manifest.json")
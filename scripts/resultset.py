@@ -0,0 +1,199 @@
+'''
+Lazy access to result datasets written by main.py (a parquet file, a partitioned parquet directory or a
+compact directory, see storage.py). Only the requested columns are read, and filters on plan_id, run and
+flood_depth are pushed down to pyarrow so row groups and partitions that cannot match are skipped. Small
+per-plan percentile tables of the damage ratio sum_damage / rs_means_cost are built in one pass and cached,
+so plots don't have to load the full results.
+'''
+
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import aggregate
+import storage
+
+# Flood depths are matched within this tolerance (np.arange grids are not exact decimals)
+DEPTH_TOL = 1e-6
+
+# Where percentile tables are cached, keyed by the result files (name, size, modification time) and quantiles
+SUMMARY_CACHE_DIR = "../results/.summary_cache"
+
+
+class ResultSet:
+    '''
+    A result dataset opened lazily.
+
+    Usage:
+        results = ResultSet("../results/mcs_res1-all_500iter_specific.parquet")
+        run0 = results.read(['plan_id', 'flood_depth', 'sum_damage', 'rs_means_cost'], run=0)
+        plan = results.read(plan_id='11700HZ')
+        curves = results.percentiles()
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.compact = os.path.isdir(path) and os.path.exists(os.path.join(path, storage.COMPACT_FACTS))
+        if self.compact:
+            self.dataset = ds.dataset(os.path.join(path, storage.COMPACT_FACTS), format="parquet")
+            self.plans = pd.read_parquet(os.path.join(path, storage.COMPACT_PLANS))
+            self.depths = pd.read_parquet(os.path.join(path, storage.COMPACT_DEPTHS))['flood_depth'].to_numpy()
+        else:
+            # partition columns (RESULT_PARTITION) are read as strings, like plan_id in a single file
+            partitioning = ds.HivePartitioning.discover(infer_dictionary=True) if os.path.isdir(path) else None
+            self.dataset = ds.dataset(path, format="parquet", partitioning=partitioning)
+
+    @property
+    def columns(self):
+        if self.compact:
+            return(['run'] + list(self.plans.columns) + ['flood_depth', 'sum_damage', 'sum_co2'])
+        return(self.dataset.schema.names)
+
+    def filter(self, plan_id=None, run=None, flood_depth=None):
+        '''
+        pyarrow filter expression for the given values (None matches everything): a single value or a list
+        of plan_ids and runs, and a single depth, a list of depths or a (min, max) range of flood_depth.
+        '''
+        expr = None
+        terms = [_match('plan_id', plan_id), _match('run', run)]
+        if flood_depth is not None:
+            if self.compact:
+                terms.append(_match('depth_idx', self.depth_index(flood_depth).tolist()))
+            else:
+                terms.append(_depth_match('flood_depth', flood_depth))
+        for term in terms:
+            if term is not None:
+                expr = term if expr is None else expr & term
+        return(expr)
+
+    def depth_index(self, flood_depth):
+        '''
+        Grid indices of the depths selected by flood_depth (compact datasets only).
+        '''
+        if isinstance(flood_depth, tuple):
+            lo, hi = flood_depth
+            return(np.flatnonzero((self.depths >= lo - DEPTH_TOL) & (self.depths <= hi + DEPTH_TOL)))
+        values = np.atleast_1d(np.asarray(flood_depth, dtype=float))
+        near = np.abs(self.depths[:, None] - values[None, :]) <= DEPTH_TOL
+        return(np.flatnonzero(near.any(axis=1)))
+
+    def read(self, columns=None, plan_id=None, run=None, flood_depth=None):
+        '''
+        Reads the given columns (all if None) of the rows matching plan_id, run and flood_depth (see filter)
+        into a DataFrame.
+        '''
+        expr = self.filter(plan_id, run, flood_depth)
+        if not self.compact:
+            table = self.dataset.to_table(columns=columns, filter=expr)
+            return(_strings(table.to_pandas()))
+
+        facts = _strings(self.dataset.to_table(filter=expr).to_pandas())
+        plans = self.plans.set_index('plan_id').loc[facts['plan_id']].reset_index()
+        result = plans
+        result.insert(0, 'run', facts['run'].to_numpy())
+        result['flood_depth'] = self.depths[facts['depth_idx'].to_numpy()]
+        result['sum_damage'] = facts['sum_damage'].to_numpy()
+        result['sum_co2'] = facts['sum_co2'].to_numpy()
+        return(result if columns is None else result[list(columns)])
+
+    def plan_ids(self):
+        '''
+        Distinct plan_ids in the dataset, reading only the plan_id column.
+        '''
+        if self.compact:
+            return(self.plans['plan_id'].astype(str).to_numpy())
+        values = self.dataset.to_table(columns=['plan_id']).column('plan_id').unique()
+        if pa.types.is_dictionary(values.type):
+            values = values.cast(values.type.value_type)
+        return(np.sort(np.asarray(values.to_pylist(), dtype=object).astype(str)))
+
+    def files(self):
+        if self.compact:
+            return([os.path.join(self.path, name) for name in (storage.COMPACT_FACTS, storage.COMPACT_PLANS)])
+        return(list(self.dataset.files))
+
+    def percentiles(self, quantiles=aggregate.QUANTILES, cache_dir=SUMMARY_CACHE_DIR):
+        '''
+        Per-plan percentile curves of the damage ratio sum_damage / rs_means_cost: one row per plan and flood
+        depth with pct_dmg_mean and pct_dmg_p<q> columns. Raw results are read one plan at a time (a pruned
+        row group or partition each); summary results (OUTPUT = "summary") use their own sum_damage_mean and
+        sum_damage_p<q> columns, in which case quantiles must be among the summarized ones. The table is
+        cached in cache_dir (None disables the cache) until the result files change.
+        '''
+        path = None
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, f"{self.cache_key(quantiles)}.parquet")
+            if os.path.exists(path):
+                return(pd.read_parquet(path))
+
+        names = [f'p{round(q * 100):g}' for q in quantiles]
+        if 'sum_damage_mean' in self.columns:
+            summary = self.read(['plan_id', 'flood_depth', 'rs_means_cost', 'sum_damage_mean'] + [f'sum_damage_{name}' for name in names])
+            table = summary[['plan_id', 'flood_depth']].copy()
+            for name in ['mean'] + names:
+                table[f'pct_dmg_{name}'] = summary[f'sum_damage_{name}'] / summary['rs_means_cost']
+        else:
+            table = pd.concat([self._plan_percentiles(plan_id, quantiles, names) for plan_id in self.plan_ids()], ignore_index=True)
+
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            table.to_parquet(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+        return(table)
+
+    def _plan_percentiles(self, plan_id, quantiles, names):
+        runs = self.read(['flood_depth', 'sum_damage', 'rs_means_cost'], plan_id=plan_id)
+        flood_depth = runs['flood_depth'].to_numpy()
+        _, depth_idx = np.unique(np.round(flood_depth / DEPTH_TOL).astype(np.int64), return_inverse=True)
+        order = np.argsort(depth_idx.ravel(), kind='stable')
+        counts = np.bincount(depth_idx.ravel())
+        ratio = (runs['sum_damage'] / runs['rs_means_cost']).to_numpy()[order]
+
+        table = pd.DataFrame({'plan_id': plan_id, 'flood_depth': flood_depth[order][np.cumsum(counts) - counts]})
+        if np.all(counts == counts[0]):
+            # every depth has the same runs: one vectorized quantile over a depths x runs array
+            ratio = ratio.reshape(counts.shape[0], counts[0])
+            table['pct_dmg_mean'] = ratio.mean(axis=1)
+            for name, values in zip(names, np.quantile(ratio, quantiles, axis=1)):
+                table[f'pct_dmg_{name}'] = values
+        else:
+            groups = np.split(ratio, np.cumsum(counts)[:-1])
+            table['pct_dmg_mean'] = [g.mean() for g in groups]
+            for k, name in enumerate(names):
+                table[f'pct_dmg_{name}'] = [np.quantile(g, quantiles[k]) for g in groups]
+        return(table)
+
+    def cache_key(self, quantiles):
+        digest = hashlib.sha256(repr(tuple(quantiles)).encode("utf-8"))
+        for name in sorted(self.files()):
+            stat = os.stat(name)
+            digest.update(f"{os.path.abspath(name)}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+        return(digest.hexdigest()[:16])
+
+
+def _match(column, value):
+    if value is None:
+        return(None)
+    if np.ndim(value) == 0:
+        return(ds.field(column) == value)
+    return(ds.field(column).isin(list(value)))
+
+
+def _depth_match(column, flood_depth):
+    if isinstance(flood_depth, tuple):
+        lo, hi = flood_depth
+        return((ds.field(column) >= lo - DEPTH_TOL) & (ds.field(column) <= hi + DEPTH_TOL))
+    expr = None
+    for depth in np.atleast_1d(flood_depth):
+        term = (ds.field(column) >= depth - DEPTH_TOL) & (ds.field(column) <= depth + DEPTH_TOL)
+        expr = term if expr is None else expr | term
+    return(expr)
+
+
+def _strings(df):
+    # dictionary-encoded plan_ids (compact facts, hive partitions) come back as categoricals
+    if 'plan_id' in df and isinstance(df['plan_id'].dtype, pd.CategoricalDtype):
+        df['plan_id'] = df['plan_id'].astype(str)
+    return(df)
@@ -0,0 +1,96 @@
+'''
+Variance-reduction samplers for floorplan_mcs_specific. Instead of independent draws, every run gets
+one uniform per material group (which option is used) and one per fail_count component (how many units
+fail), taken from a Latin hypercube, a scrambled Sobol sequence, antithetic pairs or plain random numbers.
+Failures are drawn by inverting the binomial CDF with the component's uniform, so the same uniform drives
+a component at every depth (common random numbers across depths) and the damage curve of a run never
+decreases with depth.
+'''
+
+import numpy as np
+from scipy.stats import binom, qmc
+import engine
+
+# "mc" is the original sampler of floorplan_mcs_specific (groupby sample + independent binomials)
+SAMPLERS = ("mc", "random", "lhs", "sobol", "antithetic")
+
+# Keeps uniforms inside (0, 1) so the inverse CDFs stay finite
+EPS = 1e-12
+
+
+def uniforms(sampler, n, d, rng):
+    '''
+    Returns n x d uniforms from the given sampler, seeded from rng. Sobol sequences are only
+    balanced for powers of two, so the "sobol" sampler rejects any other n.
+    '''
+    if sampler == "sobol" and (n < 1 or n & (n - 1)):
+        raise ValueError(f"The sobol sampler needs the number of runs to be a power of 2 (e.g. {1 << max(0, n - 1).bit_length()}), got {n}")
+    if sampler == "random":
+        u = rng.random((n, d))
+    elif sampler == "lhs":
+        u = qmc.LatinHypercube(d=d, seed=rng).random(n)
+    elif sampler == "sobol":
+        u = qmc.Sobol(d=d, scramble=True, seed=rng).random(n)
+    elif sampler == "antithetic":
+        half = rng.random(((n + 1) // 2, d))
+        u = np.concatenate([half, 1 - half])[:n]
+    else:
+        raise ValueError(f"Unknown sampler {sampler!r}, expected one of {SAMPLERS[1:]}")
+    return(np.clip(u, EPS, 1 - EPS))
+
+
+def binomial_ppf(u, n, p):
+    '''
+    Inverse binomial CDF for uniforms u (runs x components), unit counts n (components) and
+    probabilities p (components x depths). Returns runs x components x depths. Only cells with
+    0 < p < 1 need scipy; the rest are 0 or n.
+    '''
+    shape = (u.shape[0],) + p.shape
+    n = np.broadcast_to(n[None, :, None], shape)
+    p = np.broadcast_to(p[None], shape)
+    result = np.where(p >= 1, n, 0).astype(float)
+
+    interior = np.nonzero((p > 0) & (p < 1) & (n > 0))
+    result[interior] = binom.ppf(np.broadcast_to(u[:, :, None], shape)[interior], n[interior], p[interior])
+    return(result)
+
+
+def sampled_mcs(plan, table, lca_data, depths, n, rng, sampler, memory_budget_mb=None):
+    '''
+    Simulates n runs of one plan's structure components (rows of plan, aligned with its fragility table
+    components x depths) with the given sampler. Returns sum_damage and sum_co2 shaped runs x depths.
+
+    The uniforms are laid out over all material groups in lca_data and all fail_count components of the
+    spec, so plans simulated with identically seeded rngs share their random numbers (common random numbers
+    across plans). They are drawn up front, so the runs x components x depths damage can be evaluated in
+    blocks under memory_budget_mb (engine.block_shape) with the same results.
+    '''
+    materials = engine.pack_materials(lca_data, plan['component_join'].to_numpy())
+    fc = (plan['failure_calculation'] == 'fail_count').to_numpy()
+    quantity = np.nan_to_num(plan['quantity'].to_numpy(dtype=float))
+    counts = materials['counts']
+    n_groups = counts.shape[0]
+
+    u = uniforms(sampler, n, n_groups + fc.sum(), rng)
+
+    # option of every material group per run; components that share a component_join share it
+    choice = materials['offsets'] + np.minimum((u[:, :n_groups] * counts).astype(np.int64), counts - 1)
+    join_idx = materials['join_idx']
+    choice = choice[:, np.maximum(join_idx, 0)]
+    cost = np.nan_to_num(np.where(join_idx < 0, 0.0, materials['total_cost'][choice]))
+    co2 = np.nan_to_num(np.where(join_idx < 0, 0.0, materials['kg_co2e_fu'][choice]))
+
+    sum_damage = np.empty((n, depths.shape[0]))
+    sum_co2 = np.empty((n, depths.shape[0]))
+    run_chunk, depth_chunk = engine.block_shape(table.shape[0], n, depths.shape[0], memory_budget_mb)
+    for r0 in range(0, n, run_chunk):
+        r1 = min(r0 + run_chunk, n)
+        for d0 in range(0, depths.shape[0], depth_chunk):
+            d1 = min(d0 + depth_chunk, depths.shape[0])
+            block = table[:, d0:d1]
+            damage = np.broadcast_to(block * quantity[:, None], (r1 - r0,) + block.shape).copy()
+            damage[:, fc, :] = binomial_ppf(u[r0:r1, n_groups:], quantity[fc].astype(np.int64), block[fc])
+
+            sum_damage[r0:r1, d0:d1] = np.einsum('rcd,rc->rd', damage, cost[r0:r1])
+            sum_co2[r0:r1, d0:d1] = np.einsum('rcd,rc->rd', damage, co2[r0:r1])
+    return(sum_damage, sum_co2)
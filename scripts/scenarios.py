@@ -0,0 +1,81 @@
+'''
+Mitigation scenarios from one simulation per floor plan. Raising the first floor by e shifts a flood
+depth d (relative to the original first floor) to d - e above the new one, and a foundation type only
+counts the components that apply to it (the parse.FOUNDATION_COLUMNS flags of the component spec).
+Each plan is simulated once over the depth range all elevations need, with its damage summed per group
+of components sharing the same foundation flags, and every scenario is read off those per-run sums by
+shifting and masking instead of being resampled.
+'''
+
+import numpy as np
+import pandas as pd
+import calculations
+import aggregate
+import engine
+import parse
+
+# None keeps every component, as floorplan_mcs_specific does
+FOUNDATIONS = (None,) + parse.FOUNDATION_COLUMNS
+
+
+def foundation_groups(plan, foundations):
+    '''
+    Groups the components of a parsed plan by their flags for the given foundations. Returns the group
+    of every component and a groups x foundations bool matrix of the groups each foundation counts.
+    '''
+    flags = np.stack([
+        np.ones(plan.shape[0], dtype=bool) if foundation is None else plan[foundation].to_numpy(dtype=bool)
+        for foundation in foundations
+    ], axis=1)
+    patterns, groups = np.unique(flags, axis=0, return_inverse=True)
+    return(groups.ravel(), patterns)
+
+
+def scenario_depths(min_depth, max_depth, step, elevations):
+    '''
+    Returns the flood depth grid np.arange(min_depth, max_depth, step), the extended grid of depths above
+    the first floor that the elevations need, and where each elevation's window starts in it. Elevations
+    must be multiples of step so every scenario falls on the simulated grid.
+    '''
+    depths = np.arange(min_depth, max_depth, step)
+    shifts = np.asarray(elevations, dtype=float) / step
+    k = np.round(shifts).astype(np.int64)
+    if not np.allclose(shifts, k, rtol=0, atol=1e-6):
+        raise ValueError(f"Elevations {list(elevations)} must be multiples of the depth step {step}")
+
+    i = np.arange(-k.max(), depths.shape[0] - k.min())
+    extended = min_depth + i * step
+    return(depths, extended, k.max() - k)
+
+
+def sweep_plan(plan, lca_data, min_depth, max_depth, step, n, rng, elevations=(0,), foundations=FOUNDATIONS,
+               memory_budget_mb=None, summary=False):
+    '''
+    Simulates a parsed plan once and returns the results of floorplan_mcs_specific for every combination
+    of foundation (a parse.FOUNDATION_COLUMNS name, or None for all components) and elevation (how far the
+    first floor is raised, in the units of flood_depth), with foundation and elevation columns. flood_depth
+    stays relative to the original first floor. summary=True returns aggregate.summarize_sums rows instead.
+    '''
+    plan = plan[(plan['component_type'] == "structure")].reset_index(drop=True)
+    depths, extended, offsets = scenario_depths(min_depth, max_depth, step, elevations)
+
+    table = calculations.plan_fragility_table(plan, extended)
+    groups, patterns = foundation_groups(plan, foundations)
+    sum_damage, sum_co2 = engine.simulate_plan(plan, table, lca_data, n, rng, memory_budget_mb, groups)
+
+    plan_info = plan[engine.PLAN_COLUMNS].iloc[[0]]
+    frames = []
+    for f, foundation in enumerate(foundations):
+        damage = sum_damage[patterns[:, f]].sum(axis=0)
+        co2 = sum_co2[patterns[:, f]].sum(axis=0)
+        for elevation, offset in zip(elevations, offsets):
+            window = slice(offset, offset + depths.shape[0])
+            if summary:
+                info = plan_info.assign(foundation="all" if foundation is None else foundation, elevation=elevation)
+                frames.append(aggregate.summarize_sums(info, depths, damage[None, :, window], co2[None, :, window]))
+                continue
+            result = engine.batch_to_frame(plan_info, depths, damage[None, :, window], co2[None, :, window])
+            result.insert(len(engine.PLAN_COLUMNS) + 1, 'foundation', "all" if foundation is None else foundation)
+            result.insert(len(engine.PLAN_COLUMNS) + 2, 'elevation', elevation)
+            frames.append(result)
+    return(pd.concat(frames, ignore_index=True))
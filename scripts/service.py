@@ -0,0 +1,414 @@
+'''
+Warm simulation service. Loads the LCA data, parses every floor plan and packs its material options once,
+then answers simulation requests over localhost HTTP (JSON) from memory:
+
+    POST /simulate  {"plan_ids": ["11700HZ", ...], "depths": [0, 0.5, 2], "n": 100, "seed": 29705, "runs": false}
+    GET  /curve?plan_id=11700HZ     mean and P5/P50/P95 curves on main.py's depth grid with N runs
+    GET  /plans                     plan_ids that can be simulated
+    GET  /health                    plans loaded, cache and batch statistics
+
+Simulated (plan, depths, n, seed) results are kept in a size-bounded LRU cache, next to the per-plan
+fragility tables (calculations.FRAGILITY_CACHE). Requests are queued and gathered into batches, identical
+jobs within a batch are simulated once, and the batch runs on a thread pool. Every plan uses its own stream
+(utils.plan_rng), so the service returns the same numbers as main.py for the same seed, depths and N.
+
+    python service.py [--port 8765] [--workers 4]
+
+ServiceClient talks to a running service; loadtest.py measures its throughput and latency.
+'''
+
+import os
+import sys
+import json
+import time
+import queue
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+import concurrent.futures
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import pandas as pd
+import calculations
+import aggregate
+import engine
+import parse
+import utils
+import main
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+# Simulated results kept in memory (per-run sums, float64), least recently used first out
+RESULT_CACHE_MB = 512
+
+# Jobs that arrive within BATCH_WINDOW seconds of each other (up to MAX_BATCH) are run as one batch
+BATCH_WINDOW = 0.005
+MAX_BATCH = 64
+WORKERS = 4
+
+# Largest request accepted: runs per plan, flood depths and plans per request
+MAX_N = 10_000
+MAX_DEPTHS = 2_000
+MAX_PLANS = 1_000
+
+
+class ResultCache:
+    '''
+    Thread-safe LRU cache of simulated (sum_damage, sum_co2) arrays, bounded by their total size in MB.
+    '''
+
+    def __init__(self, max_mb=RESULT_CACHE_MB):
+        self.max_bytes = max_mb * 2**20
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return(None)
+            self._items.move_to_end(key)
+            self.hits += 1
+            return(value)
+
+    def put(self, key, value):
+        size = sum(array.nbytes for array in value)
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = value
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self._items) > 1:
+                _, old = self._items.popitem(last=False)
+                self.bytes -= sum(array.nbytes for array in old)
+
+    def stats(self):
+        with self._lock:
+            return({'entries': len(self._items), 'mb': self.bytes / 2**20, 'hits': self.hits, 'misses': self.misses})
+
+
+class SimulationService:
+    '''
+    In-memory state of the service: lca_data, the parsed structure components and packed material options of
+    every plan, and the caches.
+    simulate() queues one job per plan for the batcher and waits for the results.
+    '''
+
+    def __init__(self, lca_path=main.LCA_DATA_PATH, floorplan_path=main.FLOORPLAN_DATA_PATH, workers=WORKERS,
+                 cache_mb=RESULT_CACHE_MB, batch_window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.lca_data = utils.read_sheet(lca_path, sheet_name="Cost_LCA_Coupled")
+        plans = utils.read_sheet(floorplan_path, sheet_name="floor_plans")
+        plans = plans[(plans['type'] == "Single-Family")]
+        plans['rs_means_cost'] = calculations.calc_rs_means_cost(
+            plans['num_floors'],
+            plans['sqft'],
+            (plans['n_bath1'] + plans['n_bath2'])
+        )
+
+        parsed = parse.parse_floorplans(plans)
+        parsed = parsed[(parsed['component_type'] == "structure")]
+        self.plans = {
+            str(plan_id): plan.reset_index(drop=True)
+            for plan_id, plan in parsed.groupby('plan_id', sort=False, observed=True)
+        }
+        # material options of every plan's components, packed once
+        self.materials = {
+            plan_id: engine.pack_materials(self.lca_data, plan['component_join'].to_numpy())
+            for plan_id, plan in self.plans.items()
+        }
+
+        self.cache = ResultCache(cache_mb)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.jobs = 0
+        self._queue = queue.Queue()
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        # the fragility table cache is a plain OrderedDict shared by the worker threads
+        self._table_lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        threading.Thread(target=self._batcher, daemon=True).start()
+
+    def simulate(self, plan_ids, depths, n, seed=main.SEED):
+        '''
+        Returns {plan_id: (sum_damage, sum_co2)} with runs x depths arrays for every requested plan.
+        '''
+        depths = np.asarray(depths, dtype=float)
+        missing = [plan_id for plan_id in plan_ids if str(plan_id) not in self.plans]
+        if missing:
+            raise KeyError(f"Unknown plan_ids: {missing}")
+
+        futures = {}
+        for plan_id in plan_ids:
+            key = (str(plan_id), depths.tobytes(), int(n), int(seed))
+            future = concurrent.futures.Future()
+            self._queue.put((key, future))
+            futures[str(plan_id)] = future
+        return({plan_id: future.result() for plan_id, future in futures.items()})
+
+    def curve(self, plan_id, n=main.N, seed=main.SEED):
+        '''
+        Mean and P5/P50/P95 of sum_damage and sum_co2 over n runs at every depth of main.py's grid.
+        '''
+        depths = np.arange(main.MIN_DEPTH,main.MAX_DEPTH,main.STEP)
+        sum_damage, sum_co2 = self.simulate([plan_id], depths, n, seed)[str(plan_id)]
+        return(curve_summary(plan_id, depths, sum_damage, sum_co2))
+
+    def stats(self):
+        return({
+            'plans': len(self.plans), 'cache': self.cache.stats(), 'fragility_tables': len(calculations.FRAGILITY_CACHE),
+            'batches': self.batches, 'jobs': self.jobs, 'queued': self._queue.qsize()
+        })
+
+    def _batcher(self):
+        # gathers queued jobs into batches of up to max_batch jobs arriving within batch_window
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.perf_counter())))
+                except queue.Empty:
+                    break
+            self.batches += 1
+            self.jobs += len(batch)
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        # resolves cached jobs and submits every distinct uncached (key, future) job of a batch once
+        waiting = {}
+        for key, future in batch:
+            waiting.setdefault(key, []).append(future)
+        for key, futures in waiting.items():
+            cached = self.cache.get(key)
+            if cached is not None:
+                for future in futures:
+                    future.set_result(cached)
+                continue
+            # a job that is still running from an earlier batch answers these requests too
+            with self._inflight_lock:
+                running = key in self._inflight
+                self._inflight.setdefault(key, []).extend(futures)
+            if not running:
+                self._pool.submit(self._run_job, key)
+
+    def _run_job(self, key):
+        try:
+            plan_id, depths, n, seed = key
+            plan = self.plans[plan_id]
+            depths = np.frombuffer(depths, dtype=float)
+            with self._table_lock:
+                table = calculations.plan_fragility_table(plan, depths)
+            sum_damage, sum_co2 = engine.simulate_plan(
+                plan, table, self.lca_data, n, utils.plan_rng(seed, plan_id), materials=self.materials[plan_id]
+            )
+            result = (sum_damage[0], sum_co2[0])
+            self.cache.put(key, result)
+            with self._inflight_lock:
+                futures = self._inflight.pop(key)
+            for future in futures:
+                future.set_result(result)
+        except Exception as e:
+            with self._inflight_lock:
+                futures = self._inflight.pop(key, [])
+            for future in futures:
+                future.set_exception(e)
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+
+def curve_summary(plan_id, depths, sum_damage, sum_co2, quantiles=aggregate.QUANTILES):
+    '''
+    JSON-ready mean and quantile curves of runs x depths sum_damage and sum_co2.
+    '''
+    result = {'plan_id': str(plan_id), 'depths': depths.tolist(), 'n_runs': int(sum_damage.shape[0])}
+    for name, values in [('sum_damage', sum_damage), ('sum_co2', sum_co2)]:
+        result[f'{name}_mean'] = values.mean(axis=0).tolist()
+        for q, curve in zip(quantiles, np.quantile(values, quantiles, axis=0)):
+            result[f'{name}_p{round(q * 100):g}'] = curve.tolist()
+    return(result)
+
+
+def check_n(n):
+    '''
+    Number of runs of a request as an int, 1 <= n <= MAX_N.
+    '''
+    if isinstance(n, bool) or not isinstance(n, (int, str)):
+        raise ValueError(f"n must be an integer, got {n!r}")
+    n = int(n)
+    if not 1 <= n <= MAX_N:
+        raise ValueError(f"n must be between 1 and {MAX_N}, got {n}")
+    return(n)
+
+
+def simulate_request(request):
+    '''
+    Validated (plan_ids, depths, n, seed) of a /simulate request body; raises ValueError for a missing or
+    invalid field.
+    '''
+    if not isinstance(request, dict):
+        raise ValueError("The request body must be a JSON object")
+    plan_ids = request.get('plan_ids')
+    if not isinstance(plan_ids, list) or not plan_ids:
+        raise ValueError("plan_ids must be a non-empty list of plan_ids")
+    if len(plan_ids) > MAX_PLANS:
+        raise ValueError(f"At most {MAX_PLANS} plan_ids per request, got {len(plan_ids)}")
+
+    depths = request.get('depths', np.arange(main.MIN_DEPTH,main.MAX_DEPTH,main.STEP))
+    try:
+        depths = np.asarray(depths, dtype=float)
+    except (TypeError, ValueError):
+        raise ValueError("depths must be a list of numbers") from None
+    if depths.ndim != 1 or not 1 <= depths.shape[0] <= MAX_DEPTHS:
+        raise ValueError(f"depths must be a list of 1 to {MAX_DEPTHS} numbers")
+    if not np.isfinite(depths).all():
+        raise ValueError("depths must be finite")
+
+    seed = request.get('seed', main.SEED)
+    if isinstance(seed, bool) or not isinstance(seed, int) or seed < 0:
+        raise ValueError(f"seed must be a non-negative integer, got {seed!r}")
+    return([str(plan_id) for plan_id in plan_ids], depths, check_n(request.get('n', main.N)), seed)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if url.path == "/health":
+            self._reply(200, self.service.stats())
+        elif url.path == "/plans":
+            self._reply(200, {'plan_ids': list(self.service.plans)})
+        elif url.path == "/curve" and 'plan_id' in query:
+            self._handle(lambda: self.service.curve(
+                query['plan_id'], check_n(query.get('n', main.N)), int(query.get('seed', main.SEED))
+            ))
+        else:
+            self._reply(404, {'error': f"Unknown request {self.path}"})
+
+    def do_POST(self):
+        if urllib.parse.urlparse(self.path).path != "/simulate":
+            self._reply(404, {'error': f"Unknown request {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+        except ValueError as e:
+            self._reply(400, {'error': f"Invalid JSON: {e}"})
+            return
+        self._handle(lambda: self._simulate(request))
+
+    def _simulate(self, request):
+        plan_ids, depths, n, seed = simulate_request(request)
+        results = self.service.simulate(plan_ids, depths, n, seed)
+        response = []
+        for plan_id, (sum_damage, sum_co2) in results.items():
+            entry = curve_summary(plan_id, depths, sum_damage, sum_co2)
+            if request.get('runs', False):
+                entry['runs_sum_damage'] = sum_damage.tolist()
+                entry['runs_sum_co2'] = sum_co2.tolist()
+            response.append(entry)
+        return({'results': response})
+
+    def _handle(self, respond):
+        try:
+            self._reply(200, respond())
+        except KeyError as e:
+            self._reply(404, {'error': str(e)})
+        except (TypeError, ValueError) as e:
+            self._reply(400, {'error': str(e)})
+        except Exception as e:
+            # e.g. MemoryError: the client still gets an answer instead of a dropped connection
+            self._reply(500, {'error': f"{type(e).__name__}: {e}"})
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host=HOST, port=PORT, workers=WORKERS):
+    start = time.perf_counter()
+    ServiceHandler.service = SimulationService(workers=workers)
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    print(f"Loaded {len(ServiceHandler.service.plans)} plans in {time.perf_counter() - start:.1f}s, "
+          f"serving on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        ServiceHandler.service.close()
+
+
+class ServiceClient:
+    '''
+    Client of a running service.
+
+    Usage:
+        client = ServiceClient()
+        curves = client.simulate(["11700HZ"], depths=[0, 1, 2], n=200)
+        curve = client.curve("11700HZ")
+    '''
+
+    def __init__(self, url=f"http://{HOST}:{PORT}", timeout=60):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def simulate(self, plan_ids, depths=None, n=None, seed=None, runs=False):
+        request = {'plan_ids': [str(plan_id) for plan_id in plan_ids], 'runs': runs}
+        if depths is not None:
+            request['depths'] = np.asarray(depths, dtype=float).tolist()
+        if n is not None:
+            request['n'] = int(n)
+        if seed is not None:
+            request['seed'] = int(seed)
+        return(self._request("/simulate", json.dumps(request).encode("utf-8"))['results'])
+
+    def curve(self, plan_id, n=None, seed=None):
+        query = {'plan_id': plan_id}
+        if n is not None:
+            query['n'] = n
+        if seed is not None:
+            query['seed'] = seed
+        return(self._request("/curve?" + urllib.parse.urlencode(query)))
+
+    def health(self):
+        return(self._request("/health"))
+
+    def plan_ids(self):
+        return(self._request("/plans")['plan_ids'])
+
+    def _request(self, path, data=None):
+        request = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return(json.loads(response.read()))
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"{e.code}: {json.loads(e.read()).get('error')}") from None
+
+
+if __name__ == "__main__":
+    # python service.py [--port 8765] [--workers 4]
+    args = sys.argv[1:]
+    port = int(args[args.index("--port") + 1]) if "--port" in args else PORT
+    workers = int(args[args.index("--workers") + 1]) if "--workers" in args else WORKERS
+    # the data and results paths (main.LCA_DATA_PATH, ...) are relative to this directory
+    os.chdir(os.path.dirname(os.path.realpath(__file__)))
+    serve(port=port, workers=workers)
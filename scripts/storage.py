@@ -0,0 +1,325 @@
+'''
+Result sinks that write simulation results to disk as they are produced, so the
+full result set never has to be held in memory.
+'''
+
+import os
+import re
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class ResultWriter:
+    '''
+    Streams result tables to a parquet file (one row group per write) or, if
+    partition_cols is given, to a hive-partitioned parquet dataset directory.
+
+    Usage:
+        with ResultWriter(path) as writer:
+            for plan in plans:
+                writer.write(floorplan_mcs_specific(plan, lca_data))
+    '''
+
+    def __init__(self, path, partition_cols=None):
+        self.path = path
+        self.partition_cols = partition_cols
+        self.schema = None
+        self.rows = 0
+        self._writer = None
+
+        # never mix the output of a previous run into this one
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def write(self, df):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.schema is None:
+            self.schema = table.schema
+        else:
+            table = table.cast(self.schema)
+
+        if self.partition_cols:
+            pq.write_to_dataset(
+                table, self.path, partition_cols=self.partition_cols,
+                basename_template=f"part-{self.rows}-{{i}}.parquet"
+            )
+        else:
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, self.schema)
+            self._writer.write_table(table)
+        self.rows += table.num_rows
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Files of a compact result dataset (see CompactResultWriter)
+COMPACT_PLANS = "plans.parquet"
+COMPACT_DEPTHS = "depths.parquet"
+COMPACT_FACTS = "facts.parquet"
+
+FACT_SCHEMA = pa.schema([
+    ('plan_id', pa.dictionary(pa.int32(), pa.string())),
+    ('run', pa.int32()),
+    ('depth_idx', pa.int16()),
+    ('sum_damage', pa.float32()),
+    ('sum_co2', pa.float32())
+])
+
+
+class CompactResultWriter:
+    '''
+    Writes raw results (one row per plan, run and flood depth) in a compact normalized layout:
+    a directory with
+
+        plans.parquet   one row per plan: plan_id and the plan attributes (sqft, num_floors, ...)
+        depths.parquet  the depth grid: depth_idx and the exact float64 flood_depth
+        facts.parquet   dictionary-encoded plan_id, int32 run, int16 depth_idx, float32 sum_damage/sum_co2
+
+    Rows are matched to the depth grid by index, so flood depths never have to be compared as floats.
+    read_compact() joins the tables back into the raw layout.
+    '''
+
+    def __init__(self, path, depths):
+        self.path = path
+        self.depths = pd.Index(np.asarray(depths, dtype=float))
+        self.depth_idx = narrow(np.arange(self.depths.shape[0]), np.int16, 'depth_idx')
+        self.plans = []
+        self.rows = 0
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        os.makedirs(path)
+        self._writer = pq.ParquetWriter(os.path.join(path, COMPACT_FACTS), FACT_SCHEMA)
+
+    def write(self, df):
+        plan_columns = [col for col in df.columns if col not in ('run', 'flood_depth', 'sum_damage', 'sum_co2')]
+        self.plans.append(df[plan_columns].drop_duplicates('plan_id'))
+
+        depth_idx = self.depths.get_indexer(df['flood_depth'].to_numpy(), method='nearest')
+        table = pa.Table.from_arrays([
+            pa.array(df['plan_id'].astype(str).to_numpy()).dictionary_encode().cast(FACT_SCHEMA.field('plan_id').type),
+            pa.array(narrow(df['run'].to_numpy(), np.int32, 'run')),
+            pa.array(narrow(depth_idx, np.int16, 'depth_idx')),
+            pa.array(df['sum_damage'].to_numpy().astype(np.float32)),
+            pa.array(df['sum_co2'].to_numpy().astype(np.float32))
+        ], schema=FACT_SCHEMA)
+        self._writer.write_table(table)
+        self.rows += table.num_rows
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+
+        plans = pd.concat(self.plans, ignore_index=True).drop_duplicates('plan_id') if self.plans else pd.DataFrame()
+        plans.to_parquet(os.path.join(self.path, COMPACT_PLANS), index=False)
+        pd.DataFrame({
+            'depth_idx': self.depth_idx,
+            'flood_depth': self.depths.to_numpy()
+        }).to_parquet(os.path.join(self.path, COMPACT_DEPTHS), index=False)
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_compact(path, join_plans=True):
+    '''
+    Reads a compact result dataset. With join_plans=True the plan attributes and flood depths are joined
+    back on, giving the raw layout; otherwise the facts table is returned with plan_id and depth_idx keys.
+    '''
+    facts = pd.read_parquet(os.path.join(path, COMPACT_FACTS))
+    if not join_plans:
+        return(facts)
+
+    plans = pd.read_parquet(os.path.join(path, COMPACT_PLANS))
+    depths = pd.read_parquet(os.path.join(path, COMPACT_DEPTHS))['flood_depth'].to_numpy()
+
+    result = plans.set_index('plan_id').loc[facts['plan_id'].astype(str)].reset_index()
+    result.insert(0, 'run', facts['run'].to_numpy())
+    result['flood_depth'] = depths[facts['depth_idx'].to_numpy()]
+    result['sum_damage'] = facts['sum_damage'].to_numpy()
+    result['sum_co2'] = facts['sum_co2'].to_numpy()
+    return(result)
+
+
+# Files of a per-component result dataset (see ComponentWriter)
+COMPONENT_ENTRIES = "components.parquet"
+
+COMPONENT_SCHEMA = pa.schema([
+    ('plan_id', pa.dictionary(pa.int32(), pa.string())),
+    ('run', pa.int32()),
+    ('depth_idx', pa.int16()),
+    ('n_depths', pa.int16()),
+    ('component', pa.dictionary(pa.int32(), pa.string())),
+    ('damage_cost', pa.float32()),
+    ('damage_co2', pa.float32())
+])
+
+
+class ComponentWriter:
+    '''
+    Writes the sparse per-component damage of main.floorplan_mcs_specific(..., components=...) to a directory:
+
+        depths.parquet      the depth grid: depth_idx and the exact float64 flood_depth
+        components.parquet  one row per nonzero entry: plan_id, run, depth_idx, n_depths, component,
+                            damage_cost, damage_co2
+
+    An entry covers n_depths consecutive depths from depth_idx with the same damage (always 1 with
+    the "nonzero" encoding); every (plan, run, depth, component) without an entry has no damage.
+    read_components() reads it back.
+    '''
+
+    def __init__(self, path, depths):
+        self.path = path
+        self.depths = np.asarray(depths, dtype=float)
+        self.depth_idx = narrow(np.arange(self.depths.shape[0]), np.int16, 'depth_idx')
+        self.rows = 0
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        os.makedirs(path)
+        self._writer = pq.ParquetWriter(os.path.join(path, COMPONENT_ENTRIES), COMPONENT_SCHEMA)
+
+    def write(self, df):
+        table = pa.Table.from_arrays([
+            pa.array(df['plan_id'].astype(str).to_numpy()).dictionary_encode().cast(COMPONENT_SCHEMA.field('plan_id').type),
+            pa.array(narrow(df['run'].to_numpy(), np.int32, 'run')),
+            pa.array(narrow(df['depth_idx'].to_numpy(), np.int16, 'depth_idx')),
+            pa.array(narrow(df['n_depths'].to_numpy(), np.int16, 'n_depths')),
+            pa.array(df['component'].astype(str).to_numpy()).dictionary_encode().cast(COMPONENT_SCHEMA.field('component').type),
+            pa.array(df['damage_cost'].to_numpy().astype(np.float32)),
+            pa.array(df['damage_co2'].to_numpy().astype(np.float32))
+        ], schema=COMPONENT_SCHEMA)
+        self._writer.write_table(table)
+        self.rows += table.num_rows
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        pd.DataFrame({
+            'depth_idx': self.depth_idx,
+            'flood_depth': self.depths
+        }).to_parquet(os.path.join(self.path, COMPACT_DEPTHS), index=False)
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_components(path, flood_depth=None, expand=False):
+    '''
+    Reads a per-component result dataset. flood_depth selects the entries covering the grid depth nearest
+    to it (e.g. which components drive cost at 2 ft); expand=True repeats every entry for each depth it
+    covers, giving one row per plan, run, depth and damaged component with its flood_depth.
+    '''
+    entries = pd.read_parquet(os.path.join(path, COMPONENT_ENTRIES))
+    depths = pd.read_parquet(os.path.join(path, COMPACT_DEPTHS))['flood_depth'].to_numpy()
+    start = entries['depth_idx'].to_numpy().astype(np.int64)
+    length = entries['n_depths'].to_numpy().astype(np.int64)
+
+    if flood_depth is not None:
+        k = int(np.argmin(np.abs(depths - flood_depth)))
+        entries = entries[(start <= k) & (k < start + length)].reset_index(drop=True)
+        start = np.full(entries.shape[0], k)
+        length = np.ones(entries.shape[0], dtype=np.int64)
+
+    if expand or flood_depth is not None:
+        rows = np.repeat(np.arange(entries.shape[0]), length)
+        offset = np.arange(rows.shape[0]) - np.repeat(np.cumsum(length) - length, length)
+        entries = entries.iloc[rows].reset_index(drop=True)
+        depth_idx = start[rows] + offset
+        entries['depth_idx'] = depth_idx.astype(np.int16)
+        entries['flood_depth'] = depths[depth_idx]
+        entries = entries.drop(columns='n_depths')
+    return(entries)
+
+
+class PlanCache:
+    '''
+    Directory of per-plan results, one parquet file per plan named <plan_id>-<key>.parquet. The key is a
+    hash of everything the plan's results depend on (main.plan_keys), so a changed plan, LCA data, spec,
+    depth grid, N, seed or simulation code gives a new key and the old file is treated as stale.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def file(self, plan_id, key):
+        return(os.path.join(self.path, f"{safe_name(plan_id)}-{key}.parquet"))
+
+    def has(self, plan_id, key):
+        return(os.path.exists(self.file(plan_id, key)))
+
+    def load(self, plan_id, key):
+        return(pd.read_parquet(self.file(plan_id, key)))
+
+    def save(self, plan_id, key, df):
+        '''
+        Writes a plan's results (atomically, so an interrupted run never leaves a partial file behind)
+        and removes the plan's stale results.
+        '''
+        path = self.file(plan_id, key)
+        df.to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+
+        pattern = re.compile(re.escape(safe_name(plan_id)) + r"-[0-9a-f]+\.parquet$")
+        for name in os.listdir(self.path):
+            if pattern.fullmatch(name) and os.path.join(self.path, name) != path:
+                os.remove(os.path.join(self.path, name))
+
+
+    def prune(self, plan_ids, keys):
+        '''
+        Removes every cached result other than the given plans' current keys (stale keys, plans that are no
+        longer run and leftover .tmp files). Returns the number of files removed.
+        '''
+        keep = {os.path.basename(self.file(plan_id, key)) for plan_id, key in zip(plan_ids, keys)}
+        removed = 0
+        for name in os.listdir(self.path):
+            if name not in keep and (name.endswith(".parquet") or name.endswith(".parquet.tmp")):
+                os.remove(os.path.join(self.path, name))
+                removed += 1
+        return(removed)
+
+
+def narrow(values, dtype, name):
+    '''
+    Casts integer values to a narrow dtype, raising ValueError instead of wrapping around when they don't fit
+    (e.g. more than 32767 depths in an int16 depth_idx).
+    '''
+    info = np.iinfo(dtype)
+    if values.shape[0] > 0 and (values.min() < info.min or values.max() > info.max):
+        raise ValueError(f"{name} values from {values.min()} to {values.max()} don't fit in {np.dtype(dtype).name}")
+    return(values.astype(dtype))
+
+
+def safe_name(value):
+    return(re.sub(r'[^\w.-]', '_', str(value)))
+
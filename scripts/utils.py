@@ -2,9 +2,85 @@ import numpy as np
 import pandas as pd
 from parse import *
 import os
+import re
+import zlib
+import hashlib
+import tempfile
+
+# Parquet snapshots of the Excel sheets are stored here (relative to the workbook) by read_sheet()
+SNAPSHOT_DIR = ".cache"
+
+_file_hashes = {}
+
+def file_hash(path):
+    '''
+    SHA-256 of a file's contents. Memoized on (path, size, mtime) so repeated calls don't re-read the file.
+    '''
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        _file_hashes[key] = digest.hexdigest()
+    return(_file_hashes[key])
+
+def read_sheet(path, sheet_name, snapshot_dir=None):
+    '''
+    Drop-in replacement for pd.read_excel(path, sheet_name=sheet_name). The first read converts the sheet to a
+    parquet snapshot keyed by the workbook's content hash and the sheet name; later reads load the snapshot.
+    Editing the workbook changes its hash, so stale snapshots are never used.
+    '''
+    snapshot_dir = snapshot_dir or os.path.join(os.path.dirname(path), SNAPSHOT_DIR)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    sheet = re.sub(r'[^\w.-]', '_', sheet_name)
+    snapshot = os.path.join(snapshot_dir, f"{stem}-{sheet}-{file_hash(path)[:16]}.parquet")
+
+    if os.path.exists(snapshot):
+        return(pd.read_parquet(snapshot))
+
+    df = pd.read_excel(path, sheet_name=sheet_name)
+    tmp = None
+    try:
+        os.makedirs(snapshot_dir, exist_ok=True)
+        # a temporary file of its own, so processes that snapshot the same sheet at once (e.g. service.py and
+        # main.py) never replace the snapshot with each other's half-written file
+        fd, tmp = tempfile.mkstemp(dir=snapshot_dir, prefix=os.path.basename(snapshot) + ".", suffix=".tmp")
+        os.close(fd)
+        df.to_parquet(tmp)
+        os.replace(tmp, snapshot)
+    except Exception as e:
+        # e.g. a column with mixed types that parquet can't store; just skip the snapshot
+        print(f"Could not snapshot sheet {sheet_name} of {path}: {e}")
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+    return(df)
+
+# Columns required in an event table (engine.floorplan_mcs_events)
+EVENT_COLUMNS = ['building_id', 'plan_id', 'flood_depth']
+
+def read_events(path):
+    '''
+    Reads a table of buildings affected by a flood event (csv, parquet or the first sheet of an xlsx) with
+    building_id, plan_id, flood_depth and optionally first_floor_elevation.
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        events = pd.read_parquet(path)
+    elif ext in (".xlsx", ".xls"):
+        events = pd.read_excel(path)
+    else:
+        events = pd.read_csv(path)
+
+    missing = [col for col in EVENT_COLUMNS if col not in events.columns]
+    if missing:
+        raise ValueError(f"Event table {path} is missing columns {missing}")
+    events['plan_id'] = events['plan_id'].astype(str)
+    return(events)
 
 def load_cost_data(path):
-    cost = pd.read_excel(path, sheet_name="Cost Data")
+    cost = read_sheet(path, sheet_name="Cost Data")
 
     cost['total_cost'] = cost['unit_cost']
     
@@ -20,7 +96,7 @@ def load_cost_data(path):
     return(cost)
 
 def load_rs_means_cost_data(path):
-    cost = pd.read_excel(path, sheet_name="RS Means Cost Data")
+    cost = read_sheet(path, sheet_name="RS Means Cost Data")
 
     cost = cost.groupby(['component', 'functional_unit'], as_index=False).agg(
         unit_cost_mean = ('unit_cost', 'mean'),
@@ -52,7 +128,7 @@ def load_rs_means_cost_data(path):
 
 
 def load_co2_data(path):
-    co2 = pd.read_excel(path, sheet_name="All LCA Data")
+    co2 = read_sheet(path, sheet_name="All LCA Data")
 
     co2 = co2.groupby(['component', 'functional_unit'], as_index=False).agg(
         unit_co2_mean = ('kg_co2e_fu', 'mean'),
@@ -68,4 +144,13 @@ def load_co2_data(path):
 
 
     co2['unit_co2_max'] = co2['unit_co2_max'] + 0.000001 # Negligible difference that prevents divide by 0 error in triangular distribution calculations
-    return(co2)
\ No newline at end of file
+    return(co2)
+
+def plan_rng(seed, plan_id):
+    '''
+    Returns an independent random Generator for a single floor plan. The stream is a child of
+    the global seed keyed by plan_id, so a plan's simulations don't depend on which other plans
+    are run or in what order.
+    '''
+    key = zlib.crc32(str(plan_id).encode("utf-8"))
+    return(np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(key,))))
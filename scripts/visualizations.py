@@ -3,22 +3,31 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
+import resultset
 
 def main():
     res_path = "../results/mcs_res1-all_500iter_specific.parquet"
-    results = pd.read_parquet(res_path)
-    results['pct_dmg'] = results['sum_damage']/results['rs_means_cost']
-    
+    # only the rows and columns each plot needs are read (see resultset.ResultSet)
+    results = resultset.ResultSet(res_path)
+    columns = ['plan_id', 'run', 'flood_depth', 'sum_damage', 'rs_means_cost']
 
-    run0 = results.loc[results['run'] == 0]
-    plan0 = results.loc[results['plan_id']=='11700HZ']
+    run0 = results.read(columns, run=0)
+    plan0 = results.read(columns, plan_id='11700HZ')
+    for df in (run0, plan0):
+        df['pct_dmg'] = df['sum_damage']/df['rs_means_cost']
 
-    fig, ax = plt.subplots(1,2)
+    # cached per-plan percentile curves of pct_dmg
+    curves = results.percentiles()
+
+    fig, ax = plt.subplots(1,3)
 
     sns.scatterplot(run0, x = 'flood_depth', y = 'pct_dmg', hue='plan_id', ax=ax[0])
     sns.scatterplot(plan0, x = 'flood_depth', y = 'pct_dmg', hue='run', ax=ax[1])
+    sns.lineplot(curves, x = 'flood_depth', y = 'pct_dmg_p50', hue='plan_id', legend=False, ax=ax[2])
+    curve0 = curves.loc[curves['plan_id']=='11700HZ']
+    ax[2].fill_between(curve0['flood_depth'], curve0['pct_dmg_p5'], curve0['pct_dmg_p95'], color='black', alpha=0.2)
     plt.show()
 
 if __name__ == '__main__':
     os.chdir(os.path.dirname(os.path.realpath(__file__)))
-    main()
\ No newline at end of file
+    main()
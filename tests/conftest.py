@@ -0,0 +1,26 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# the scripts import each other as top-level modules (import calculations, import engine, ...)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "scripts"))
+
+import bench
+import parse
+
+
+@pytest.fixture(scope="session")
+def plans():
+    # synthetic Single-Family rows of the floor_plans sheet with rs_means_cost, as in bench.py
+    return(bench.synthetic_plans(4, np.random.default_rng(29705)))
+
+
+@pytest.fixture(scope="session")
+def lca_data():
+    return(bench.synthetic_lca(np.random.default_rng(29705)))
+
+
+@pytest.fixture(scope="session")
+def parsed_plan(plans):
+    return(parse.parse_floorplan(plans.iloc[0].copy(deep=True)))
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+import calculations
+
+
+def kernel_rows(size, seed=29705):
+    # random failure codes (including -1, an unknown failure_calculation), NaN parameters and degenerate
+    # min == mode == max rows
+    rng = np.random.default_rng(seed)
+    code = rng.integers(-1, 3, size=size).astype(np.int8)
+    lo = rng.uniform(-1, 4, size=size)
+    hi = lo + rng.uniform(0, 6, size=size)
+    mode = lo + rng.uniform(0, 1, size=size) * (hi - lo)
+    degenerate = rng.random(size) < 0.1
+    hi[degenerate] = mode[degenerate] = lo[degenerate]
+    for values in (lo, hi, mode):
+        values[rng.random(size) < 0.05] = np.nan
+    depth = rng.uniform(-2, 12, size=size)
+    depth[degenerate] = np.where(rng.random(degenerate.sum()) < 0.5, lo[degenerate], depth[degenerate])
+    quantity = rng.integers(0, 50, size=size).astype(float)
+    return(code, quantity, lo, hi, mode, depth)
+
+
+def test_numba_fragility_matches_numpy():
+    pytest.importorskip("numba")
+    code, _, lo, hi, mode, depth = kernel_rows(100_000)
+    expected = calculations._fragility_numpy(code, lo, hi, mode, depth)
+    frag = np.empty(code.shape[0])
+    calculations._fragility_numba(code, lo, hi, mode, depth, frag)
+    np.testing.assert_array_equal(frag, expected)
+
+
+@pytest.mark.parametrize("costs", [False, True])
+def test_numba_combine_matches_numpy(monkeypatch, costs):
+    pytest.importorskip("numba")
+    code, quantity, lo, hi, mode, depth = kernel_rows(100_000)
+    rng = np.random.default_rng(1)
+    frag = calculations._fragility_numpy(code, lo, hi, mode, depth)
+    draws = rng.binomial(quantity[code == 0].astype(np.int64), frag[code == 0])
+    unit = (rng.uniform(1, 100, size=code.shape[0]), rng.uniform(1, 10, size=code.shape[0])) if costs else (None, None)
+
+    results = []
+    for use_numba in (False, True):
+        monkeypatch.setattr(calculations, "USE_NUMBA", use_numba)
+        results.append(calculations.combine_damage(code, quantity, frag, draws, *unit))
+    numpy_result, numba_result = (np.atleast_2d(r) for r in results)
+    np.testing.assert_array_equal(numba_result, numpy_result)
+
+
+def test_flood_damage_matches_numpy(monkeypatch):
+    pytest.importorskip("numba")
+    code, quantity, lo, hi, mode, depth = kernel_rows(10_000)
+
+    results = []
+    for use_numba in (False, True):
+        monkeypatch.setattr(calculations, "USE_NUMBA", use_numba)
+        results.append(calculations.flood_damage(code, quantity, lo, hi, mode, depth, np.random.default_rng(7)))
+    np.testing.assert_array_equal(results[1], results[0])
+
+
+def test_triang_cdf_matches_scipy():
+    from scipy.stats import triang
+    rng = np.random.default_rng(29705)
+    size = 100_000
+    lo = rng.uniform(-1, 4, size=size)
+    hi = lo + rng.uniform(0.1, 6, size=size)
+    mode = lo + rng.uniform(0, 1, size=size) * (hi - lo)
+    # peak at either end
+    mode[:1000] = lo[:1000]
+    mode[1000:2000] = hi[1000:2000]
+    x = rng.uniform(-2, 12, size=size)
+    expected = triang.cdf(x, (mode - lo) / (hi - lo), loc=lo, scale=hi - lo)
+    np.testing.assert_allclose(calculations.triang_cdf(x, lo, hi, mode), expected, rtol=1e-12, atol=1e-12)
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+import pytest
+import curves
+
+
+@pytest.fixture
+def index(tmp_path):
+    # 2 plans x 3 runs x 4 depths; every value encodes its plan and run
+    depths = np.arange(4.0)
+    results = pd.DataFrame([
+        {'plan_id': plan_id, 'run': run, 'flood_depth': depth, 'sum_damage': 100 * p + 10 * run + depth,
+         'sum_co2': p + run + depth}
+        for p, plan_id in enumerate(["A", "B"]) for run in range(3) for depth in depths
+    ])
+    return(curves.DamageCurveIndex.from_results(results, str(tmp_path / "curves"), runs=True))
+
+
+def test_lookup_run(index):
+    damage, _ = index.query(["A", "B", "B"], [1.5, 2.0, 0.0], run=np.array([2, 0, 1]))
+    np.testing.assert_allclose(damage, [21.5, 102.0, 110.0])
+
+
+@pytest.mark.parametrize("run", [3, -1, np.array([0, 3])])
+def test_lookup_rejects_runs_out_of_range(index, run):
+    plan_ids = ["A", "A"] if np.ndim(run) else ["A"]
+    with pytest.raises(ValueError):
+        index.query(plan_ids, np.ones(len(plan_ids)), run=run)
@@ -0,0 +1,13 @@
+import numpy as np
+import pytest
+import engine
+
+
+@pytest.mark.parametrize("min_runs, max_runs", [(50, 8), (10, 40)])
+def test_adaptive_never_exceeds_max_runs(plans, lca_data, min_runs, max_runs):
+    depths = np.arange(-1, 16, 0.5)
+    result = engine.floorplan_mcs_adaptive(engine.pack_plan_table(plans), lca_data, depths, 29705, 0.001,
+                                           min_runs, max_runs, 10)
+    assert result.shape[0] == plans.shape[0] * depths.shape[0]
+    assert result['n_runs'].max() <= max_runs
+    assert result['n_runs'].min() >= min(min_runs, max_runs)
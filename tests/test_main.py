@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+import bench
+import main
+
+
+@pytest.mark.parametrize("memory_budget_mb", [1, 0.05, 8])
+def test_memory_budget_gives_identical_results(parsed_plan, lca_data, memory_budget_mb):
+    # 0.05 MB is less than one run of the plan, so the depths are split too
+    expected = main.floorplan_mcs_specific(parsed_plan, lca_data, np.random.default_rng(1), n=60)
+    result = main.floorplan_mcs_specific(parsed_plan, lca_data, np.random.default_rng(1), n=60,
+                                         memory_budget_mb=memory_budget_mb)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_moments_match_monte_carlo_mean(parsed_plan, lca_data):
+    check = main.check_moments(parsed_plan, lca_data, np.random.default_rng(1))
+    for name in ('damage', 'co2'):
+        # differences of the means in standard errors, where the damage is random at all
+        z = check[f'z_{name}'].to_numpy()
+        z = z[np.isfinite(z)]
+        assert z.shape[0] > 0
+        assert np.all(np.abs(z) < 5)
+
+
+def test_workers_give_identical_results(lca_data):
+    # more plans than the 2 * workers kept in flight, so plans are submitted as results are taken
+    plans = bench.synthetic_plans(6, np.random.default_rng(3))
+    expected = pd.concat(main.simulate_plans(plans, lca_data, workers=1), ignore_index=True)
+    result = pd.concat(main.simulate_plans(plans, lca_data, workers=2), ignore_index=True)
+    assert expected['plan_id'].unique().tolist() == plans['plan_id'].tolist()
+    pd.testing.assert_frame_equal(result, expected)
@@ -0,0 +1,154 @@
+import threading
+import concurrent.futures
+import numpy as np
+import pytest
+import engine
+import service
+import main
+
+
+def entry(n_bytes):
+    return((np.zeros(n_bytes // 8), np.zeros(0)))
+
+
+def test_result_cache_evicts_least_recently_used():
+    cache = service.ResultCache(max_mb=3 / 2**20 * 1024)
+    for key in "abc":
+        cache.put(key, entry(1024))
+    assert cache.stats()['entries'] == 3
+
+    assert cache.get("a") is not None
+    cache.put("d", entry(1024))
+    # "b" was the least recently used once "a" was read
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in "acd")
+    assert cache.bytes == 3 * 1024
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (4, 1)
+
+
+def test_result_cache_keeps_an_entry_larger_than_its_bound():
+    cache = service.ResultCache(max_mb=1024 / 2**20)
+    cache.put("small", entry(512))
+    cache.put("large", entry(4096))
+    assert cache.get("small") is None
+    assert cache.get("large") is not None
+    assert cache.bytes == 4096
+
+
+def test_simulate_request_defaults():
+    plan_ids, depths, n, seed = service.simulate_request({'plan_ids': ["11700HZ", 3]})
+    assert plan_ids == ["11700HZ", "3"]
+    assert np.array_equal(depths, np.arange(main.MIN_DEPTH,main.MAX_DEPTH,main.STEP))
+    assert (n, seed) == (main.N, main.SEED)
+
+
+@pytest.mark.parametrize("request_body", [
+    ["11700HZ"],
+    {},
+    {'plan_ids': []},
+    {'plan_ids': "11700HZ"},
+    {'plan_ids': ["p"] * (service.MAX_PLANS + 1)},
+    {'plan_ids': ["p"], 'n': 0},
+    {'plan_ids': ["p"], 'n': service.MAX_N + 1},
+    {'plan_ids': ["p"], 'n': 1.5},
+    {'plan_ids': ["p"], 'n': True},
+    {'plan_ids': ["p"], 'depths': []},
+    {'plan_ids': ["p"], 'depths': [0.0] * (service.MAX_DEPTHS + 1)},
+    {'plan_ids': ["p"], 'depths': ["deep"]},
+    {'plan_ids': ["p"], 'depths': [[0, 1]]},
+    {'plan_ids': ["p"], 'depths': [0, float("nan")]},
+    {'plan_ids': ["p"], 'seed': -1},
+    {'plan_ids': ["p"], 'seed': "29705"},
+])
+def test_simulate_request_rejects_invalid_bodies(request_body):
+    with pytest.raises(ValueError):
+        service.simulate_request(request_body)
+
+
+class RecordingHandler(service.ServiceHandler):
+    def __init__(self):
+        self.replies = []
+
+    def _reply(self, status, body):
+        self.replies.append((status, body))
+
+
+def fail(exception):
+    def respond():
+        raise exception
+    return(respond)
+
+
+@pytest.mark.parametrize("respond, status", [
+    (lambda: {'ok': True}, 200),
+    (fail(KeyError("Unknown plan_ids: ['p']")), 404),
+    (fail(ValueError("n must be between 1 and 10000, got 0")), 400),
+    (fail(TypeError("bad type")), 400),
+    (fail(MemoryError("out of memory")), 500),
+])
+def test_handle_maps_errors_to_status(respond, status):
+    handler = RecordingHandler()
+    handler._handle(respond)
+    assert [reply[0] for reply in handler.replies] == [status]
+
+
+class RecordingPool:
+    def __init__(self):
+        self.keys = []
+
+    def submit(self, fn, key):
+        self.keys.append(key)
+
+
+@pytest.fixture
+def idle_service(parsed_plan, lca_data):
+    # service state without the data files or the batcher thread; jobs are dispatched by hand
+    svc = service.SimulationService.__new__(service.SimulationService)
+    svc.lca_data = lca_data
+    svc.plans = {"p": parsed_plan}
+    svc.materials = {"p": engine.pack_materials(lca_data, parsed_plan['component_join'].to_numpy())}
+    svc.cache = service.ResultCache()
+    svc._pool = RecordingPool()
+    svc._table_lock = threading.Lock()
+    svc._inflight = {}
+    svc._inflight_lock = threading.Lock()
+    return(svc)
+
+
+def test_identical_jobs_are_simulated_once(idle_service):
+    depths = np.arange(-1, 4, 0.5)
+    key = ("p", depths.tobytes(), 20, 29705)
+    first = [concurrent.futures.Future() for _ in range(3)]
+    idle_service._dispatch([(key, future) for future in first])
+    assert idle_service._pool.keys == [key]
+
+    # the same job in a later batch joins the one still running
+    second = concurrent.futures.Future()
+    idle_service._dispatch([(key, second)])
+    assert idle_service._pool.keys == [key]
+
+    idle_service._run_job(key)
+    assert not idle_service._inflight
+    sum_damage, sum_co2 = second.result(timeout=0)
+    assert sum_damage.shape == sum_co2.shape == (20, depths.shape[0])
+    assert all(future.result(timeout=0) is second.result(timeout=0) for future in first)
+
+    # finished jobs are answered from the cache
+    third = concurrent.futures.Future()
+    idle_service._dispatch([(key, third)])
+    assert idle_service._pool.keys == [key]
+    assert third.result(timeout=0) is second.result(timeout=0)
+
+
+def test_failed_job_fails_every_waiting_request(idle_service):
+    key = ("p", np.arange(-1, 4, 0.5).tobytes(), 0, 29705)
+    futures = [concurrent.futures.Future() for _ in range(2)]
+    idle_service._dispatch([(key, future) for future in futures])
+    idle_service.plans = {}
+    idle_service._run_job(key)
+    assert not idle_service._inflight
+    for future in futures:
+        with pytest.raises(KeyError):
+            future.result(timeout=0)
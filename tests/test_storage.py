@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+import main
+import parse
+import storage
+
+
+@pytest.fixture(scope="module")
+def raw_results(plans, lca_data):
+    # raw rows of two plans, as the loop engine writes them
+    return([
+        main.floorplan_mcs_specific(parse.parse_floorplan(plan.copy(deep=True)), lca_data, np.random.default_rng(1), n=20)
+        for _, plan in plans.iloc[:2].iterrows()
+    ])
+
+
+def test_compact_round_trip(tmp_path, raw_results):
+    depths = np.arange(main.MIN_DEPTH, main.MAX_DEPTH, main.STEP)
+    with storage.ResultWriter(str(tmp_path / "raw.parquet")) as writer:
+        for result in raw_results:
+            writer.write(result)
+    with storage.CompactResultWriter(str(tmp_path / "compact"), depths) as writer:
+        for result in raw_results:
+            writer.write(result)
+
+    raw = pd.read_parquet(tmp_path / "raw.parquet")
+    compact = storage.read_compact(str(tmp_path / "compact"))
+    assert list(compact.columns) == list(raw.columns)
+    for col in raw.columns:
+        if col in ('sum_damage', 'sum_co2'):
+            # stored as float32
+            np.testing.assert_allclose(compact[col], raw[col], rtol=1e-6)
+        elif col == 'plan_id':
+            assert compact[col].astype(str).tolist() == raw[col].tolist()
+        else:
+            np.testing.assert_array_equal(compact[col].to_numpy(), raw[col].to_numpy())
+
+
+def test_compact_keeps_large_runs(tmp_path):
+    df = pd.DataFrame({'plan_id': "A", 'run': [0, 40000, 70000], 'flood_depth': [0.0, 1.0, 2.0],
+                       'sum_damage': 1.0, 'sum_co2': 2.0})
+    with storage.CompactResultWriter(str(tmp_path / "compact"), np.arange(3.0)) as writer:
+        writer.write(df)
+    assert storage.read_compact(str(tmp_path / "compact"))['run'].tolist() == [0, 40000, 70000]
+
+
+def test_out_of_range_values_are_refused(tmp_path):
+    with pytest.raises(ValueError):
+        storage.narrow(np.array([0, 40000]), np.int16, 'depth_idx')
+    with pytest.raises(ValueError):
+        storage.CompactResultWriter(str(tmp_path / "compact"), np.arange(40000.0))
+    assert not (tmp_path / "compact").exists()
+
+
+def test_component_round_trip(tmp_path, parsed_plan, lca_data):
+    depths = np.arange(main.MIN_DEPTH, main.MAX_DEPTH, main.STEP)
+    entries, decoded = {}, {}
+    for encoding in ("nonzero", "rle"):
+        result, entries[encoding] = main.floorplan_mcs_specific(parsed_plan, lca_data, np.random.default_rng(1), n=20,
+                                                                components=encoding)
+        path = str(tmp_path / encoding)
+        with storage.ComponentWriter(path, depths) as writer:
+            writer.write(entries[encoding])
+        decoded[encoding] = storage.read_components(path, expand=True)
+    # stretches of depths with the same damage (e.g. failed components) are stored once
+    assert entries["rle"].shape[0] < entries["nonzero"].shape[0]
+    assert (entries["nonzero"]['n_depths'] == 1).all()
+
+    # both decode to the dense per-component damage of component_frame: one row per nonzero (run, depth, component)
+    key = ['run', 'depth_idx', 'component']
+    dense = entries["nonzero"].sort_values(key).reset_index(drop=True)
+    for encoding, frame in decoded.items():
+        # components come back dictionary-encoded (categorical)
+        frame = frame.assign(component=frame['component'].astype(str)).sort_values(key).reset_index(drop=True)
+        assert frame.shape[0] == dense.shape[0], encoding
+        assert frame['plan_id'].astype(str).tolist() == dense['plan_id'].tolist()
+        np.testing.assert_array_equal(frame[['run', 'depth_idx']].to_numpy(), dense[['run', 'depth_idx']].to_numpy())
+        assert frame['component'].tolist() == dense['component'].tolist()
+        np.testing.assert_array_equal(frame['flood_depth'].to_numpy(), depths[dense['depth_idx'].to_numpy()])
+        for col in ('damage_cost', 'damage_co2'):
+            # stored as float32
+            np.testing.assert_allclose(frame[col], dense[col], rtol=1e-6)
+
+    # and the components add up to the plan's totals
+    totals = decoded["rle"].groupby(['run', 'depth_idx'])['damage_cost'].sum()
+    totals = totals.reindex(pd.MultiIndex.from_product([range(20), range(depths.shape[0])]), fill_value=0)
+    np.testing.assert_allclose(totals.to_numpy(), result['sum_damage'].to_numpy(), rtol=1e-5)